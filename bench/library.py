@@ -0,0 +1,159 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import List
+
+SHOW_WORDS = [
+    "The",
+    "Last",
+    "Night",
+    "City",
+    "Blue",
+    "House",
+    "Dark",
+    "Star",
+    "River",
+    "Doctor",
+    "Office",
+    "Crown",
+    "Empire",
+    "Wild",
+    "Lost",
+    "Signal",
+    "Harbor",
+    "Winter",
+    "Code",
+    "Line",
+]
+QUALITIES = ["720p", "1080p", "2160p"]
+SOURCES = ["WEB-DL", "WEBRip", "BluRay", "HDTV"]
+CODECS = ["x264", "x265", "H.264", "HEVC"]
+GROUPS = ["NTb", "FLUX", "GalaxyTV", "SPARKS", "RARBG", "playWEB"]
+EXTENSIONS = ["mkv", "mkv", "mkv", "mp4", "avi"]
+EXTRA_FILES = ["nfo", "srt", "txt", "jpg"]
+
+
+@dataclass
+class Library:
+    """Paths and counts of a generated synthetic library."""
+
+    src_tv: str
+    src_movies: str
+    dest_tv: str
+    dest_movies: str
+    media_files: List[str]
+    num_sample_files: int
+    num_extra_files: int
+    num_broken_links: int
+
+
+def _title(rng: random.Random, min_words: int, max_words: int) -> str:
+    return ".".join(rng.sample(SHOW_WORDS, rng.randint(min_words, max_words)))
+
+
+def _release_tags(rng: random.Random) -> str:
+    return (
+        f"{rng.choice(QUALITIES)}.{rng.choice(SOURCES)}."
+        f"{rng.choice(CODECS)}-{rng.choice(GROUPS)}"
+    )
+
+
+def _touch(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def generate_library(
+    root: str,
+    num_files: int,
+    movie_ratio: float = 0.2,
+    sample_ratio: float = 0.05,
+    extra_ratio: float = 0.1,
+    broken_link_ratio: float = 0.02,
+    episodes_per_season: int = 12,
+    seed: int = 0,
+) -> Library:
+    """
+    Generate a synthetic media library below root.
+
+    Roughly num_files media files are created with realistic release names:
+    TV episodes nested in show and season pack folders, and movies in release
+    folders. Sample files, extra non-media files and broken symlinks in the
+    destination folders are added according to the given ratios.
+    """
+    rng = random.Random(seed)
+    library = Library(
+        src_tv=os.path.join(root, "src", "tv"),
+        src_movies=os.path.join(root, "src", "movies"),
+        dest_tv=os.path.join(root, "dest", "tv"),
+        dest_movies=os.path.join(root, "dest", "movies"),
+        media_files=[],
+        num_sample_files=0,
+        num_extra_files=0,
+        num_broken_links=0,
+    )
+    for path in (
+        library.src_tv,
+        library.src_movies,
+        library.dest_tv,
+        library.dest_movies,
+    ):
+        os.makedirs(path, exist_ok=True)
+
+    num_movies = int(num_files * movie_ratio)
+    num_episodes = num_files - num_movies
+
+    show_index = 0
+    while len(library.media_files) < num_episodes:
+        show = f"{_title(rng, 1, 3)}.{show_index}"
+        show_index += 1
+        for season in range(1, rng.randint(1, 6) + 1):
+            tags = _release_tags(rng)
+            extension = rng.choice(EXTENSIONS)
+            season_dir = os.path.join(
+                library.src_tv, show, f"{show}.S{season:02d}.{tags}"
+            )
+            for episode in range(1, episodes_per_season + 1):
+                if len(library.media_files) >= num_episodes:
+                    break
+                name = f"{show}.S{season:02d}E{episode:02d}.{tags}"
+                path = os.path.join(season_dir, f"{name}.{extension}")
+                _touch(path)
+                library.media_files.append(path)
+                if rng.random() < sample_ratio:
+                    _touch(
+                        os.path.join(season_dir, "Sample", f"{name}.sample.{extension}")
+                    )
+                    library.num_sample_files += 1
+                if rng.random() < extra_ratio:
+                    _touch(
+                        os.path.join(season_dir, f"{name}.{rng.choice(EXTRA_FILES)}")
+                    )
+                    library.num_extra_files += 1
+
+    for movie_index in range(num_movies):
+        name = f"{_title(rng, 1, 4)}.{movie_index}.{rng.randint(1950, 2025)}.{_release_tags(rng)}"
+        extension = rng.choice(EXTENSIONS)
+        path = os.path.join(library.src_movies, name, f"{name}.{extension}")
+        _touch(path)
+        library.media_files.append(path)
+        if rng.random() < extra_ratio:
+            _touch(
+                os.path.join(
+                    library.src_movies, name, f"{name}.{rng.choice(EXTRA_FILES)}"
+                )
+            )
+            library.num_extra_files += 1
+
+    num_broken_links = int(num_files * broken_link_ratio)
+    for link_index in range(num_broken_links):
+        dest = library.dest_tv if link_index % 2 else library.dest_movies
+        link_dir = os.path.join(dest, f"Removed Show {link_index % 50}", "Season 01")
+        os.makedirs(link_dir, exist_ok=True)
+        os.symlink(
+            os.path.join("..", "..", "missing", f"Removed.S01E{link_index:05d}.mkv"),
+            os.path.join(link_dir, f"Removed.S01E{link_index:05d}.mkv"),
+        )
+    library.num_broken_links = num_broken_links
+
+    return library
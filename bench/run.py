@@ -0,0 +1,398 @@
+"""
+Benchmark linkarr against synthetic media libraries.
+
+Usage (from the repository root):
+
+    python bench/run.py --sizes 1000 50000 --output bench_results.json
+
+Every phase of a job run (scan, parse, link, clean) is timed separately, as
+well as complete process_job runs and the latency from a file appearing in a
+watched folder to its symlink being created. The memory taken by a loaded
+state index is reported per 100k tracked files. Full runs are repeated under
+each I/O budget (io_ops_per_second), measuring the throughput lost against the
+latency of metadata reads made meanwhile by another thread, which stand in for
+media playback. Use --tmp-dir to place the libraries on the disk of interest.
+Results are written as JSON so runs on different commits can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import replace
+from datetime import datetime, timezone
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from library import generate_library  # noqa: E402
+from linkarr.daemon import WatchDaemon  # noqa: E402
+from linkarr.helpers import create_symlink, find_media_files, logger  # noqa: E402
+from linkarr.main import process_job, process_job_for_folder  # noqa: E402
+from linkarr.models import Config, IndexedFile, Job  # noqa: E402
+from linkarr.plan import apply_plan, create_parser, plan_deep_clean  # noqa: E402
+from linkarr.state import DirectoryCache, StateIndex  # noqa: E402
+
+EXCLUDE_DIRS = ("Sample",)
+
+
+class Timer:
+    """Context manager measuring wall-clock time in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_phases(job: Job) -> dict:
+    """Time each phase of a job run separately on an unprocessed library."""
+    parser = create_parser(job, DirectoryCache(job.dest))
+    results = {}
+
+    with Timer() as timer:
+        files = list(find_media_files(job.src, job.file_type_regex, job.exclude_dirs))
+    results["scan"] = timer.seconds
+
+    with Timer() as timer:
+        parsed = parser.parse_many(files)
+    results["parse"] = timer.seconds
+
+    with Timer() as timer:
+        num_links = 0
+        for file, parsed_info in zip(files, parsed):
+            if parsed_info is None:
+                continue
+            dest_path = parser.build_destination_path(parsed_info)
+            if create_symlink(file, dest_path, parser.dest_cache) is not None:
+                num_links += 1
+    results["link"] = timer.seconds
+
+    with Timer() as timer:
+        _, num_removed = apply_plan(plan_deep_clean(job))
+    results["clean"] = timer.seconds
+
+    results["files"] = len(files)
+    results["links_created"] = num_links
+    results["broken_links_removed"] = num_removed
+    return results
+
+
+def bench_process_job(job: Job) -> dict:
+    """Time complete runs of a job, first with a deep clean and then warm."""
+    with Timer() as first:
+        process_job(job, deep_clean=True)
+    with Timer() as repeat:
+        process_job(job)
+    return {
+        "process_job_deep_clean": first.seconds,
+        "process_job_repeat": repeat.seconds,
+    }
+
+
+def bench_index_memory(job: Job, tmp_dir: str) -> dict:
+    """Measure the memory taken by the state index entries of a library once loaded."""
+    parser = create_parser(job)
+    db_path = os.path.join(tmp_dir, f"{job.media_type}-index.db")
+    with StateIndex(db_path) as index:
+        for file in find_media_files(job.src, job.file_type_regex, job.exclude_dirs):
+            stat_result = os.stat(file)
+            parsed_info = parser.parse_info(file)
+            link_path = None
+            if parsed_info is not None:
+                dest_path = parser.build_destination_path(parsed_info)
+                link_path = os.path.join(dest_path, os.path.basename(file))
+            index.put(
+                IndexedFile(
+                    file,
+                    stat_result.st_size,
+                    stat_result.st_mtime_ns,
+                    stat_result.st_ino,
+                    parsed_info,
+                    link_path,
+                )
+            )
+
+    with StateIndex(db_path, read_only=True) as index:
+        tracemalloc.start()
+        entries = index.entries()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "index_entries": len(entries),
+        "index_bytes_per_100k_files": memory * 100_000 // max(1, len(entries)),
+    }
+
+
+def bench_io_budget(job: Job, budgets) -> dict:
+    """
+    Time deep clean runs of a job under each I/O budget (None for unlimited),
+    while another thread stats a random source file and lists its directory
+    every 10ms, recording how long those reads take.
+    """
+    files = list(find_media_files(job.src, job.file_type_regex, job.exclude_dirs))
+    probe_rng = random.Random(0)
+    results = {}
+    for budget in budgets:
+        stop = threading.Event()
+        latencies = []
+
+        def probe():
+            while not stop.wait(0.01):
+                path = probe_rng.choice(files)
+                start_time = time.perf_counter()
+                os.stat(path)
+                os.listdir(os.path.dirname(path))
+                latencies.append(time.perf_counter() - start_time)
+
+        probe_thread = threading.Thread(target=probe)
+        probe_thread.start()
+        try:
+            with Timer() as timer:
+                process_job(replace(job, io_ops_per_second=budget), deep_clean=True)
+        finally:
+            stop.set()
+            probe_thread.join()
+
+        latencies = sorted(latencies) or [0.0]
+        results["unlimited" if budget is None else str(budget)] = {
+            "seconds": timer.seconds,
+            "files_per_second": len(files) / timer.seconds,
+            "probe_median": statistics.median(latencies),
+            "probe_p95": latencies[max(0, int(len(latencies) * 0.95) - 1)],
+            "probe_max": latencies[-1],
+        }
+    return results
+
+
+def bench_watch_latency(
+    job: Job, num_events: int, debounce: float, timeout: float
+) -> dict:
+    """Time from creating a file in a watched folder until its symlink exists."""
+    # Files are created at once, so waiting for them to settle would only add a constant
+    config = Config(jobs=[job], debounce_seconds=debounce, settle_seconds=0)
+    watching = threading.Event()
+
+    def process_folder(config, folder, changes):
+        process_job_for_folder(config, folder, changes)
+        if changes is None:
+            # The warm start's full run is only queued once the folder is watched
+            watching.set()
+
+    daemon = WatchDaemon(config, process_folder, warm_start=True)
+    latencies = []
+
+    def create_files():
+        watching.wait()
+        for index in range(num_events):
+            name = f"Latency.Show.S01E{index + 1:02d}.1080p.WEB-DL.x264-GRP.mkv"
+            link = os.path.join(job.dest, "Latency Show", "Season 01", name)
+            start_time = time.perf_counter()
+            open(os.path.join(job.src, name), "w").close()
+            while not os.path.lexists(link):
+                if time.perf_counter() - start_time > timeout:
+                    raise TimeoutError(
+                        f"No symlink created for {name} within {timeout}s"
+                    )
+                time.sleep(0.001)
+            latencies.append(time.perf_counter() - start_time)
+
+    async def main():
+        run_task = asyncio.create_task(daemon.run())
+        create_task = asyncio.create_task(asyncio.to_thread(create_files))
+        await asyncio.wait((run_task, create_task), return_when=asyncio.FIRST_COMPLETED)
+        if run_task.done():
+            # Let create_files return instead of waiting for a run that never comes
+            watching.set()
+            await run_task
+        try:
+            await create_task
+        finally:
+            daemon.stop()
+            await run_task
+
+    asyncio.run(main())
+
+    latencies.sort()
+    return {
+        "events": num_events,
+        "debounce_seconds": debounce,
+        "min": latencies[0],
+        "median": statistics.median(latencies),
+        "p95": latencies[max(0, int(len(latencies) * 0.95) - 1)],
+        "max": latencies[-1],
+    }
+
+
+def bench_size(num_files: int, args) -> dict:
+    """Run every benchmark against a freshly generated library of num_files media files."""
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as root:
+        with Timer() as timer:
+            library = generate_library(root, num_files, seed=args.seed)
+        jobs = {
+            "tv": Job(
+                src=library.src_tv,
+                dest=library.dest_tv,
+                media_type="tv",
+                exclude_dirs=EXCLUDE_DIRS,
+            ),
+            "movie": Job(
+                src=library.src_movies,
+                dest=library.dest_movies,
+                media_type="movie",
+                exclude_dirs=EXCLUDE_DIRS,
+            ),
+        }
+
+        results = {
+            "size": num_files,
+            "generate_seconds": timer.seconds,
+            "sample_files": library.num_sample_files,
+            "extra_files": library.num_extra_files,
+            "broken_links": library.num_broken_links,
+            "jobs": {},
+        }
+        for name, job in jobs.items():
+            results["jobs"][name] = bench_phases(job)
+            results["jobs"][name].update(bench_process_job(job))
+            results["jobs"][name].update(bench_index_memory(job, root))
+            if args.io_budgets:
+                results["jobs"][name]["io_budget"] = bench_io_budget(
+                    job, [None, *args.io_budgets]
+                )
+
+        results["phases"] = {
+            phase: sum(job_results[phase] for job_results in results["jobs"].values())
+            for phase in ("scan", "parse", "link", "clean")
+        }
+        if args.watch_events:
+            results["watch_latency"] = bench_watch_latency(
+                jobs["tv"], args.watch_events, args.debounce, args.timeout
+            )
+        return results
+
+
+def _print_summary(results: dict):
+    phases = results["phases"]
+    line = ", ".join(
+        f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in phases.items()
+    )
+    print(f"{results['size']} files: {line}", file=sys.stderr)
+    for name, job_results in results["jobs"].items():
+        print(
+            f"  {name}: process_job deep clean {job_results['process_job_deep_clean'] * 1000:.1f}ms, "
+            f"repeat {job_results['process_job_repeat'] * 1000:.1f}ms, "
+            f"index {job_results['index_bytes_per_100k_files'] / 2**20:.1f}MiB per 100k files",
+            file=sys.stderr,
+        )
+        for budget, budget_results in job_results.get("io_budget", {}).items():
+            print(
+                f"    io budget {budget}: {budget_results['files_per_second']:.0f} files/s, "
+                f"probe p95 {budget_results['probe_p95'] * 1000:.2f}ms",
+                file=sys.stderr,
+            )
+    if "watch_latency" in results:
+        latency = results["watch_latency"]
+        print(
+            f"  watch latency: median {latency['median'] * 1000:.1f}ms, "
+            f"p95 {latency['p95'] * 1000:.1f}ms",
+            file=sys.stderr,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark linkarr on synthetic libraries"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000],
+        help="Library sizes in media files",
+    )
+    parser.add_argument(
+        "--output", help="Write JSON results to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for the library generator"
+    )
+    parser.add_argument(
+        "--watch-events",
+        type=int,
+        default=20,
+        help="Number of files created to measure watch latency (0 to skip)",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.05,
+        help="Debounce window used for watch latency",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=10.0,
+        help="Seconds to wait for each watched symlink",
+    )
+    parser.add_argument(
+        "--io-budgets",
+        type=float,
+        nargs="*",
+        default=[5000.0, 1000.0],
+        help="io_ops_per_second values to compare with unlimited runs (none to skip)",
+    )
+    parser.add_argument("--tmp-dir", help="Directory to generate libraries in")
+    args = parser.parse_args()
+
+    # Parse failures and cleanups are expected and would drown the results
+    logger.setLevel(logging.ERROR)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    for size in args.sizes:
+        results = bench_size(size, args)
+        _print_summary(results)
+        report["results"].append(results)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import json
 import os
+import sys
+from functools import lru_cache
 from typing import Any, Dict, List
-import jsonschema
 from linkarr.models import Job, MediaType, Config, RunMode, MediaServerFormat, LogLevel
-from dataclasses import fields
+from dataclasses import MISSING, fields
 
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "config.schema.json")
 
@@ -16,6 +17,8 @@ def _get_default_value(cls, field_name: str) -> Any:
     """Get the default value for a field from a dataclass."""
     for field in fields(cls):
         if field.name == field_name:
+            if field.default_factory is not MISSING:
+                return field.default_factory()
             return field.default
     raise ValueError(f"Field {field_name} not found in {cls.__name__}")
 
@@ -28,20 +31,54 @@ def _default_job(job: Dict[str, Any]) -> Job:
         raise ConfigError("Each job must have 'src' and 'dest' fields.")
 
     # Use defaults from Job dataclass in models.py
-    media_type = job.get(
-        "media_type", _get_default_value(Job, "media_type")
-    )
+    media_type = job.get("media_type", _get_default_value(Job, "media_type"))
     file_type_regex = job.get(
         "file_type_regex", _get_default_value(Job, "file_type_regex")
     )
     enabled = job.get("enabled", _get_default_value(Job, "enabled"))  # True
+    state_index = job.get("state_index", _get_default_value(Job, "state_index"))
+    deep_clean_interval_hours = job.get(
+        "deep_clean_interval_hours",
+        _get_default_value(Job, "deep_clean_interval_hours"),
+    )
+    exclude_dirs = job.get("exclude_dirs", _get_default_value(Job, "exclude_dirs"))
+    watcher = job.get("watcher", _get_default_value(Job, "watcher"))
+    poll_interval_seconds = job.get(
+        "poll_interval_seconds", _get_default_value(Job, "poll_interval_seconds")
+    )
+    max_poll_interval_seconds = job.get(
+        "max_poll_interval_seconds",
+        _get_default_value(Job, "max_poll_interval_seconds"),
+    )
+    scan_processes = job.get(
+        "scan_processes", _get_default_value(Job, "scan_processes")
+    )
+    link_mode = job.get("link_mode", _get_default_value(Job, "link_mode"))
+    io_ops_per_second = job.get(
+        "io_ops_per_second", _get_default_value(Job, "io_ops_per_second")
+    )
+    io_priority = job.get("io_priority", _get_default_value(Job, "io_priority"))
+    if link_mode != "symlink" and not state_index:
+        # Without the index, linkarr can't tell its links from other files in dest
+        raise ConfigError(f"Jobs with link_mode '{link_mode}' must enable state_index.")
 
+    # Every indexed file and symlink path starts with the job's folders
     return Job(
-        src=job["src"],
-        dest=job["dest"],
+        src=sys.intern(job["src"]),
+        dest=sys.intern(job["dest"]),
         media_type=media_type,
         file_type_regex=file_type_regex,
         enabled=enabled,
+        state_index=state_index,
+        deep_clean_interval_hours=deep_clean_interval_hours,
+        exclude_dirs=tuple(exclude_dirs),
+        watcher=watcher,
+        poll_interval_seconds=poll_interval_seconds,
+        max_poll_interval_seconds=max_poll_interval_seconds,
+        scan_processes=scan_processes,
+        link_mode=link_mode,
+        io_ops_per_second=io_ops_per_second,
+        io_priority=io_priority,
     )
 
 
@@ -50,6 +87,28 @@ def _load_schema() -> Dict[str, Any]:
         return json.load(f)
 
 
+@lru_cache(maxsize=None)
+def _get_validator():
+    """
+    Build the config validator once. jsonschema is imported here since it
+    takes a noticeable part of startup, and reloads in watch mode reuse it.
+    """
+    import jsonschema
+
+    schema = _load_schema()
+    validator_class = jsonschema.validators.validator_for(schema)
+    return validator_class(schema)
+
+
+def _validate(raw: Any):
+    """Validate a raw config against the schema, reporting the error jsonschema.validate would."""
+    from jsonschema.exceptions import best_match
+
+    error = best_match(_get_validator().iter_errors(raw))
+    if error is not None:
+        raise ConfigError(f"Config validation error: {error.message}")
+
+
 def load_config(config_path: str) -> Config:
     """
     Load and validate the config file, applying defaults where necessary.
@@ -59,31 +118,51 @@ def load_config(config_path: str) -> Config:
         raise ConfigError(f"Config file not found: {config_path}")
     with open(config_path, "r") as f:
         raw = json.load(f)
-    schema = _load_schema()
-    try:
-        jsonschema.validate(instance=raw, schema=schema)
-    except jsonschema.ValidationError as e:
-        raise ConfigError(f"Config validation error: {e.message}")
+    _validate(raw)
     if "jobs" not in raw or not isinstance(raw["jobs"], list):
         raise ConfigError("Config must contain a 'jobs' list.")
 
     # Convert job dictionaries to Job objects
-    jobs = [_default_job(job) for job in raw["jobs"]]
+    jobs = tuple(_default_job(job) for job in raw["jobs"])
 
     # Use defaults from Config dataclass in models.py
-    mode = raw.get(
-        "mode", _get_default_value(Config, "mode")
-    )
+    mode = raw.get("mode", _get_default_value(Config, "mode"))
     media_server_format = raw.get(
         "media_server_format", _get_default_value(Config, "media_server_format")
     )
-    log_level = raw.get(
-        "log_level", _get_default_value(Config, "log_level")
+    log_level = raw.get("log_level", _get_default_value(Config, "log_level"))
+    log_format = raw.get("log_format", _get_default_value(Config, "log_format"))
+    debounce_seconds = raw.get(
+        "debounce_seconds", _get_default_value(Config, "debounce_seconds")
+    )
+    max_delay_seconds = raw.get(
+        "max_delay_seconds", _get_default_value(Config, "max_delay_seconds")
+    )
+    max_pending_changes = raw.get(
+        "max_pending_changes", _get_default_value(Config, "max_pending_changes")
+    )
+    settle_seconds = raw.get(
+        "settle_seconds", _get_default_value(Config, "settle_seconds")
+    )
+    in_progress_patterns = raw.get(
+        "in_progress_patterns", _get_default_value(Config, "in_progress_patterns")
     )
+    max_workers = raw.get("max_workers", _get_default_value(Config, "max_workers"))
+    metrics_port = raw.get("metrics_port", _get_default_value(Config, "metrics_port"))
+    metrics_host = raw.get("metrics_host", _get_default_value(Config, "metrics_host"))
 
     return Config(
         jobs=jobs,
         mode=mode,
         media_server_format=media_server_format,
         log_level=log_level,
+        log_format=log_format,
+        debounce_seconds=debounce_seconds,
+        max_delay_seconds=max_delay_seconds,
+        max_pending_changes=max_pending_changes,
+        settle_seconds=settle_seconds,
+        in_progress_patterns=tuple(in_progress_patterns),
+        max_workers=max_workers,
+        metrics_port=metrics_port,
+        metrics_host=metrics_host,
     )
@@ -0,0 +1,413 @@
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from linkarr.config import ConfigError, load_config
+from linkarr.helpers import is_directory_path, logger
+from linkarr.metrics import start_metrics_server
+from linkarr.models import Config, FileChange, Job
+from linkarr.plan import deep_clean_due
+from linkarr.routing import router_for
+from linkarr.scheduler import ChangeScheduler, SettleGate
+from linkarr.watch import SnapshotPoller, start_observer, watch_folder
+
+# Shortest time between checks for jobs whose deep clean is due
+MIN_DEEP_CLEAN_CHECK_SECONDS = 60.0
+# Seconds between checks of the config file for changes
+CONFIG_CHECK_SECONDS = 5.0
+
+
+def _enabled_jobs(config: Config) -> List[Job]:
+    return [job for job in config.jobs if job.enabled]
+
+
+def _watch_roots(config: Config) -> Dict[str, Job]:
+    """
+    Return the folders to watch: the outermost source folders of the enabled
+    jobs, which contain every other one. Each comes with the job it is the
+    source folder of, whose watcher settings are used (the first in config
+    order if several jobs share it).
+    """
+    return {
+        root: next(job for job in jobs if os.path.abspath(job.src) == root)
+        for root, jobs in router_for(config).roots().items()
+    }
+
+
+def _is_within(path: str, folder: str) -> bool:
+    path, folder = os.path.abspath(path), os.path.abspath(folder)
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+def _watcher_settings(job: Job) -> Tuple:
+    return job.watcher, job.poll_interval_seconds, job.max_poll_interval_seconds
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+
+class _BusyRoots:
+    """
+    The watch roots being processed. Changes are queued by watch root, but
+    full runs by job source folder, so a queued folder counts as busy while
+    the root containing it is.
+    """
+
+    def __init__(self, root_for: Callable[[str], str]):
+        self._roots: Set[str] = set()
+        self._root_for = root_for
+
+    def add(self, root: str):
+        self._roots.add(root)
+
+    def discard(self, root: str):
+        self._roots.discard(root)
+
+    def __contains__(self, folder: object) -> bool:
+        return isinstance(folder, str) and self._root_for(folder) in self._roots
+
+
+class WatchDaemon:
+    """
+    Run watch mode on an asyncio event loop.
+
+    Watcher events go through a SettleGate, which holds new files until
+    they are completely written, and are then handed over to the loop and
+    coalesced by a ChangeScheduler, while blocking filesystem work runs in a
+    pool of config.max_workers threads. Folders inside the same watched
+    folder are never processed by two workers at once, and jobs hold the lock
+    of their destination folder (see process_job_for_folder). SIGTERM and
+    SIGINT stop the watchers, process the changes received so far (files
+    still settling included) and wait for in-flight work before run returns.
+    Queued full runs are dropped then, as the next start queues them again.
+
+    Only the outermost source folders are watched, and each change is routed
+    to every job whose source folder contains it (see JobRouter), so jobs
+    sharing a source folder, or nested inside another job's, all see it.
+
+    If a config path is given, the file is reloaded when it changes. Only
+    jobs that were added or changed get a full run and (if their watcher
+    settings changed) a new watch, and removed jobs stop being watched.
+
+    With warm_start, watching starts right away instead of after an initial
+    run, and every job gets a full run in the background instead. With a
+    state index, such a run only stats the source directories unchanged
+    since the last one (see SourceListings).
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        process_folder: Callable[[Config, str, Optional[List[FileChange]]], None],
+        initial_run: Optional[Callable[[], None]] = None,
+        config_path: Optional[str] = None,
+        warm_start: bool = False,
+        start_time: Optional[float] = None,
+    ):
+        """
+        Args:
+            config: The loaded config; enabled jobs have their src watched
+            process_folder: Called with the current config, a watched folder
+                and its changes, or None for a full run of the folder's job
+            initial_run: Called once before watching starts
+            config_path: The file config was loaded from, to reload it on changes
+            warm_start: Reconcile jobs in the background instead of with initial_run
+            start_time: time.monotonic() when linkarr started, to log the startup time
+        """
+        self.config = config
+        self.process_folder = process_folder
+        self.initial_run = initial_run
+        self.config_path = config_path
+        self.warm_start = warm_start
+        self.start_time = time.monotonic() if start_time is None else start_time
+        self.scheduler = ChangeScheduler(
+            quiet_seconds=config.debounce_seconds,
+            max_delay_seconds=config.max_delay_seconds,
+            max_pending=config.max_pending_changes,
+        )
+        self.settle = SettleGate(
+            self._release, config.settle_seconds, config.in_progress_patterns
+        )
+        self.max_workers = config.max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.max_workers, thread_name_prefix="linkarr-worker"
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._observer = None
+        # The watch or polling task of each watched folder, and the job whose
+        # watcher settings it was made with
+        self._watches: Dict[str, Tuple[Job, object]] = {}
+
+    def on_change(self, folder: str, changes: List[FileChange]):
+        """Queue changes reported by a watcher. Safe to call from any thread."""
+        self.settle.submit(folder, changes)
+
+    def _release(self, folder: str, changes: List[FileChange]):
+        """Queue changes let through by the settle gate."""
+        self.scheduler.submit(folder, changes)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        """Stop watching and finish the pending work. Must be called on the event loop."""
+        if not self._stopping.is_set():
+            logger.info("Shutting down...")
+            self._stopping.set()
+            self._wakeup.set()
+
+    async def _run_blocking(self, function, *args):
+        return await self._loop.run_in_executor(
+            self._executor, partial(function, *args)
+        )
+
+    async def _wait(self, event: asyncio.Event, timeout: Optional[float]) -> bool:
+        """Wait for an event for up to timeout seconds, returning whether it was set."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def run(self):
+        """
+        Run the initial run, then watch until stopped by a signal or stop().
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        signals = (signal.SIGTERM, signal.SIGINT)
+        for signum in signals:
+            self._loop.add_signal_handler(signum, self.stop)
+
+        metrics_server = None
+        tasks: List[asyncio.Task] = []
+        try:
+            if self.initial_run is not None:
+                logger.info("Performing initial run")
+                await self._run_blocking(self.initial_run)
+            if self._stopping.is_set():
+                return
+
+            if self.config.metrics_port is not None:
+                metrics_server = start_metrics_server(
+                    self.config.metrics_host, self.config.metrics_port
+                )
+
+            self._observer = start_observer([], self.on_change)
+            roots = _watch_roots(self.config)
+            for folder, job in roots.items():
+                await self._watch(folder, job)
+            if self.warm_start:
+                for job in _enabled_jobs(self.config):
+                    logger.info("Queueing a full run of %s", job.src)
+                    self.scheduler.request_full_run(job.src)
+            tasks.append(asyncio.create_task(self._schedule_deep_cleans()))
+            if self.settle.settle_seconds > 0:
+                tasks.append(asyncio.create_task(self._settle()))
+            if self.config_path is not None:
+                tasks.append(asyncio.create_task(self._watch_config()))
+            startup_seconds = time.monotonic() - self.start_time
+            logger.info(
+                "Watching folders: %s (%.2fs after startup)",
+                list(roots),
+                startup_seconds,
+            )
+
+            await self._dispatch()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for folder in list(self._watches):
+                self._unwatch(folder)
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer.join()
+            if metrics_server is not None:
+                metrics_server.shutdown()
+            for signum in signals:
+                self._loop.remove_signal_handler(signum)
+            self._executor.shutdown(wait=True)
+
+    async def _watch(self, folder: str, job: Job):
+        """Start watching a folder with the job's configured watcher."""
+        if job.watcher == "poll":
+            poller = await self._run_blocking(
+                SnapshotPoller,
+                folder,
+                self.on_change,
+                job.poll_interval_seconds,
+                job.max_poll_interval_seconds,
+            )
+            self._watches[folder] = (job, asyncio.create_task(self._poll(poller)))
+        else:
+            watch = await self._run_blocking(
+                watch_folder, self._observer, folder, self.on_change
+            )
+            self._watches[folder] = (job, watch)
+
+    def _unwatch(self, folder: str):
+        """Stop watching a folder."""
+        _, watch = self._watches.pop(folder)
+        if isinstance(watch, asyncio.Task):
+            watch.cancel()
+        else:
+            self._observer.unschedule(watch)
+
+    async def _watch_config(self):
+        """Reload the config whenever its file changes."""
+        signature = await self._run_blocking(_file_signature, self.config_path)
+        while not await self._wait(self._stopping, CONFIG_CHECK_SECONDS):
+            new_signature = await self._run_blocking(_file_signature, self.config_path)
+            if new_signature is None or new_signature == signature:
+                continue
+            signature = new_signature
+            try:
+                config = await self._run_blocking(load_config, self.config_path)
+            except (ConfigError, OSError, ValueError) as e:
+                logger.error("Not reloading config from %s: %s", self.config_path, e)
+                continue
+            logger.info("Config reloaded from %s", self.config_path)
+            await self.apply_config(config)
+
+    async def apply_config(self, config: Config):
+        """
+        Switch to a new config, re-syncing and re-watching only the jobs that
+        were added or changed, and unwatching removed ones.
+        """
+        old_jobs = _enabled_jobs(self.config)
+        new_jobs = _enabled_jobs(config)
+        if replace(self.config, jobs=()) != replace(config, jobs=()):
+            logger.warning(
+                "Changes to settings other than jobs take effect after a restart"
+            )
+        self.config = replace(self.config, jobs=config.jobs)
+
+        new_sources = {job.src for job in new_jobs}
+        for job in old_jobs:
+            if job not in new_jobs:
+                logger.info("Job for %s was removed or changed", job.src)
+                if job.src not in new_sources:
+                    self.scheduler.discard(job.src)
+
+        roots = _watch_roots(self.config)
+        for folder in list(self._watches):
+            if folder not in roots:
+                logger.info("No longer watching %s", folder)
+                self._unwatch(folder)
+        for folder, job in roots.items():
+            watched = self._watches.get(folder)
+            if watched is not None and _watcher_settings(
+                watched[0]
+            ) != _watcher_settings(job):
+                self._unwatch(folder)
+                watched = None
+            if watched is not None:
+                self._watches[folder] = (job, watched[1])
+            elif is_directory_path(folder):
+                await self._watch(folder, job)
+
+        for src in dict.fromkeys(job.src for job in new_jobs if job not in old_jobs):
+            if not is_directory_path(src):
+                logger.error("Source folder does not exist: %s", src)
+                continue
+            logger.info("Job for %s was added or changed, queueing a full run", src)
+            self.scheduler.request_full_run(src)
+            self._wakeup.set()
+
+    def _root_for(self, folder: str) -> str:
+        """Return the watched folder containing a folder, or the folder itself if none does."""
+        for root in self._watches:
+            if _is_within(folder, root):
+                return root
+        return os.path.abspath(folder)
+
+    async def _dispatch(self):
+        """Process folders as their changes come due, until stopped and drained."""
+        running: Set[asyncio.Task] = set()
+        busy = _BusyRoots(self._root_for)
+
+        def finished(task: asyncio.Task, root: str):
+            running.discard(task)
+            busy.discard(root)
+            self._wakeup.set()
+
+        while True:
+            self._wakeup.clear()
+            stopping = self._stopping.is_set()
+            if stopping:
+                self.settle.release_all()
+                # A full run could take longer than the time left before being killed
+                for folder in self.scheduler.drop_full_runs():
+                    logger.info("Skipping the full run of %s on shutdown", folder)
+            due = None
+            if len(running) < self.max_workers:
+                due = self.scheduler.next_due(busy, immediately=stopping)
+                if due is not None and due[1] <= 0:
+                    folder = due[0]
+                    root = self._root_for(folder)
+                    busy.add(root)
+                    task = asyncio.create_task(
+                        self._flush(folder, self.scheduler.take(folder))
+                    )
+                    running.add(task)
+                    task.add_done_callback(partial(finished, root=root))
+                    continue
+            if stopping and not running and not self.scheduler.has_pending():
+                return
+            await self._wait(self._wakeup, None if due is None else due[1])
+
+    async def _flush(self, folder: str, changes: Optional[List[FileChange]]):
+        try:
+            await self._run_blocking(self.process_folder, self.config, folder, changes)
+        except Exception:
+            logger.exception("Failed to process changes for %s", folder)
+
+    async def _settle(self):
+        """Release new files and directories held by the settle gate once they stop changing."""
+        while not await self._wait(self._stopping, self.settle.check_interval):
+            if self.settle.has_pending():
+                try:
+                    await self._run_blocking(self.settle.check)
+                except Exception:
+                    logger.exception("Failed to check settling files")
+
+    async def _poll(self, poller: SnapshotPoller):
+        """Poll a folder at the poller's current interval until stopped."""
+        while not await self._wait(self._stopping, poller.current_interval):
+            try:
+                await self._run_blocking(poller.poll)
+            except Exception:
+                logger.exception("Failed to poll %s", poller.folder)
+
+    async def _schedule_deep_cleans(self):
+        """
+        Queue a full run for each job whose deep clean is due, so broken
+        symlinks are swept even while its source folder doesn't change.
+        """
+        while True:
+            # Jobs may change when the config is reloaded
+            jobs = _enabled_jobs(self.config)
+            interval = max(
+                MIN_DEEP_CLEAN_CHECK_SECONDS,
+                min((job.deep_clean_interval_hours for job in jobs), default=1.0)
+                * 3600,
+            )
+            if await self._wait(self._stopping, interval):
+                return
+            for job in jobs:
+                if await self._run_blocking(deep_clean_due, job):
+                    logger.info(
+                        "Deep clean of %s is due, queueing a full run", job.dest
+                    )
+                    self.scheduler.request_full_run(job.src)
+                    self._wakeup.set()
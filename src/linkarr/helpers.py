@@ -1,10 +1,41 @@
+import atexit
+import copy
+import errno
+import fnmatch
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
 import re
+import stat
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+from linkarr.models import DirListing
+from linkarr.throttle import throttle
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
 
 logger = logging.getLogger("linkarr")
 
+# A directory modified this close to when it was listed may change again
+# within the same mtime tick (up to 2s on SMB shares), so its mtime can't be
+# trusted to detect later changes
+RACY_MTIME_SECONDS = 2.0
+
+# Linux ioctl cloning a whole file into another (copy-on-write)
+FICLONE = 0x40049409
+# Errors of os.link and FICLONE meaning the link mode isn't possible between
+# these paths, e.g. across devices or on a filesystem without reflinks
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL}
+
+
 def ensure_directory_exists(path):
     """Ensure the given directory exists."""
     os.makedirs(path, exist_ok=True)
@@ -22,57 +53,165 @@ def symlink_exists(dest_file):
     return os.path.exists(dest_file)
 
 
-def create_symlink(src_file, dest_path):
+def create_symlink(src_file, dest_path, dest_cache=None):
     """Create a symlink for src_file in dest_path if it doesn't already exist."""
-    ensure_directory_exists(dest_path)
+    return create_link(src_file, dest_path, dest_cache)
+
+
+def create_link(src_file, dest_path, dest_cache=None, link_mode="symlink"):
+    """
+    Create a link for src_file in dest_path if it doesn't already exist.
+
+    Hardlinks and reflinks fall back to a symlink where they are not possible,
+    e.g. across devices. A broken symlink in the way is replaced.
+
+    If a DirectoryCache is given, it is used to skip creating directories and
+    checking for files that are already known to exist or to be missing.
+    """
     rel_src_file, dest_file = get_relative_symlink_paths(src_file, dest_path)
-    if symlink_exists(dest_file):
-        logger.debug(f"Link '{dest_file}' already exists... Skipping...")
+    if dest_cache is None:
+        ensure_directory_exists(dest_path)
+        present = True
+    else:
+        dest_cache.ensure_directory(dest_path)
+        present = dest_cache.contains(dest_file)
+    if present and is_broken_symlink(dest_file):
+        # A link whose source vanished, e.g. a file moved to another folder
+        logger.debug("Replacing stale link: %s", dest_file)
+        os.unlink(dest_file)
+    elif present and os.path.lexists(dest_file):
+        logger.debug("Link '%s' already exists... Skipping...", dest_file)
         return
-    os.symlink(rel_src_file, dest_file)
-    logger.debug(f"Created symlink: {dest_file} -> {rel_src_file}")
+    _make_link(src_file, rel_src_file, dest_file, link_mode)
+    if dest_cache is not None:
+        dest_cache.add(dest_file)
+    logger.debug("Created %s: %s -> %s", link_mode, dest_file, rel_src_file)
     return dest_file
 
 
+def _make_link(src_file, rel_src_file, dest_file, link_mode):
+    if link_mode != "symlink":
+        try:
+            if link_mode == "hardlink":
+                os.link(src_file, dest_file)
+            else:
+                _clone_file(src_file, dest_file)
+            return
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK_ERRNOS:
+                raise
+            logger.debug(
+                "Unable to %s '%s' (%s), creating a symlink",
+                link_mode,
+                src_file,
+                e.strerror,
+            )
+    os.symlink(rel_src_file, dest_file)
+
+
+def _clone_file(src_file, dest_file):
+    """Create dest_file as a reflink (copy-on-write clone) of src_file."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(src_file, "rb") as src, open(dest_file, "xb") as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.unlink(dest_file)
+            raise
+    shutil.copystat(src_file, dest_file)
+
+
+def resolve_symlink_target(symlink_location):
+    """Return the absolute path a symlink points at, without following further links."""
+    file_location = os.readlink(symlink_location)
+    return os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(symlink_location)), file_location)
+    )
+
+
 def is_broken_symlink(symlink_location):
     """Check if a symlink is broken (its target does not exist)."""
     if not os.path.islink(symlink_location):
         return False
-    file_location = os.readlink(symlink_location)
-    absolute_src_file = os.path.normpath(
-        os.path.join(os.path.dirname(symlink_location), file_location)
-    )
-    return not os.path.exists(absolute_src_file)
+    return not os.path.exists(resolve_symlink_target(symlink_location))
+
+
+def is_stale_link(link_location, link_mode="symlink", record=None):
+    """
+    Check if link_location is a link whose source is gone: a broken symlink,
+    or with the hardlink and reflink modes, the recorded link (see LinkRecord)
+    of a source that no longer exists, or of a source replaced by another
+    file for hardlinks. Other files are never stale.
+    """
+    throttle()
+    if os.path.islink(link_location):
+        return is_broken_symlink(link_location)
+    if link_mode == "symlink" or record is None:
+        return False
+    if not is_recorded_link(link_location, record):
+        return False
+    try:
+        src_stat = os.stat(record.src_path)
+    except FileNotFoundError:
+        return True
+    return link_mode == "hardlink" and not record.matches_stat(src_stat)
+
+
+def is_recorded_link(link_location, record):
+    """Check if link_location is still the regular file a LinkRecord was made for."""
+    try:
+        stat_result = os.lstat(link_location)
+    except OSError:
+        return False
+    return stat.S_ISREG(stat_result.st_mode) and record.matches_stat(stat_result)
 
 
 def remove_broken_symlink(symlink_location):
     """Remove a broken symlink and log a warning."""
     if not os.path.islink(symlink_location):
-        logger.error(f"Attempting remove non-symlink at path {symlink_location}")
+        logger.error("Attempting remove non-symlink at path %s", symlink_location)
         return False
-    logger.warning(f"Path {symlink_location} is a broken symlink")
+    logger.warning("Path %s is a broken symlink", symlink_location)
     os.unlink(symlink_location)
-    logger.debug(f"Removed symlink: {symlink_location}")
+    logger.debug("Removed symlink: %s", symlink_location)
 
 
-def remove_empty_directory(dir_path, root_path):
-    """Remove a directory if it is empty and not the root path."""
-    if len(os.listdir(dir_path)) == 0 and dir_path != root_path:
-        logger.warning(f"Deleting empty dir: {dir_path}")
-        shutil.rmtree(dir_path)
+def remove_stale_link(link_location, link_mode="symlink"):
+    """Remove a link whose source is gone (see is_stale_link) and log a warning."""
+    if link_mode == "symlink" or os.path.islink(link_location):
+        return remove_broken_symlink(link_location)
+    if not os.path.isfile(link_location):
+        logger.error("Attempting remove non-link at path %s", link_location)
+        return False
+    logger.warning("Path %s is a %s of a removed file", link_location, link_mode)
+    os.unlink(link_location)
+    logger.debug("Removed %s: %s", link_mode, link_location)
+
+
+def symlink_points_to(symlink_location, src_file):
+    """Check if symlink_location is a symlink resolving to src_file."""
+    if not os.path.islink(symlink_location):
+        return False
+    return resolve_symlink_target(symlink_location) == os.path.abspath(src_file)
 
 
-def clean_broken_symlinks(dest_path):
-    """Remove broken symlinks and empty directories recursively in dest_path."""
-    num_removed_symlinks = 0
-    for dir_path, folder_names, files in os.walk(dest_path, topdown=False):
-        for filename in files:
-            symlink_location = os.path.join(dir_path, filename)
-            if is_broken_symlink(symlink_location):
-                remove_broken_symlink(symlink_location)
-                num_removed_symlinks += 1
-        remove_empty_directory(dir_path, dest_path)
-    return num_removed_symlinks
+def link_points_to(link_location, src_file, link_mode="symlink", record=None):
+    """
+    Check if link_location is a link to src_file. Hardlinks and reflinks can't
+    be told apart from other files, so they must match the LinkRecord made
+    when linkarr created them, by path, source, device and inode.
+    """
+    throttle()
+    if os.path.islink(link_location):
+        return symlink_points_to(link_location, src_file)
+    if link_mode == "symlink" or record is None:
+        return False
+    return (
+        record.link_path == link_location
+        and record.src_path == src_file
+        and is_recorded_link(link_location, record)
+    )
 
 
 def is_media_file(filename, file_type_regex):
@@ -80,18 +219,233 @@ def is_media_file(filename, file_type_regex):
     return re.match(file_type_regex, filename, re.IGNORECASE) is not None
 
 
-def find_media_files(src_path, file_type_regex):
-    """Recursively find all media files in src_path matching the regex."""
-    matches = []
-    for root, dirs, files in os.walk(src_path):
-        for file in files:
-            if is_media_file(file, file_type_regex):
-                matches.append(os.path.join(root, file))
-    return matches
+def compile_exclude_patterns(exclude_dirs):
+    """Compile directory name glob patterns into a single case-insensitive regex."""
+    if not exclude_dirs:
+        return None
+    return re.compile(
+        "|".join(fnmatch.translate(pattern.rstrip("/\\")) for pattern in exclude_dirs),
+        re.IGNORECASE,
+    )
+
+
+def is_excluded_dir(dir_path, root_path, exclude_dirs):
+    """Check if dir_path, or any directory between root_path and it, is excluded."""
+    exclude_pattern = compile_exclude_patterns(exclude_dirs)
+    if exclude_pattern is None:
+        return False
+    rel_path = os.path.relpath(dir_path, root_path)
+    if rel_path == os.curdir or rel_path.startswith(os.pardir):
+        return False
+    return any(exclude_pattern.match(name) for name in rel_path.split(os.sep))
+
+
+def is_racy_mtime(mtime_ns):
+    """Check if an mtime is too recent to tell apart from changes made right after it."""
+    return abs(time.time() - mtime_ns / 1e9) < RACY_MTIME_SECONDS
+
+
+def list_directory(dir_path, mtime_ns):
+    """List a directory into a DirListing, splitting sub directories from other entries."""
+    file_names = []
+    dir_names = []
+    throttle()
+    with os.scandir(dir_path) as scanner:
+        for entry in scanner:
+            # DirEntry caches the file type from the listing, avoiding a stat per entry
+            if not entry.is_dir():
+                file_names.append(entry.name)
+            elif not entry.is_symlink():
+                dir_names.append(entry.name)
+    if is_racy_mtime(mtime_ns):
+        # Never matches a later mtime, so the directory is listed again next time
+        mtime_ns = 0
+    return DirListing(mtime_ns, file_names, dir_names)
+
+
+def find_media_files(
+    src_path, file_type_regex, exclude_dirs=(), listings=None, shared_scan=None
+):
+    """
+    Recursively find all media files in src_path matching the regex.
+
+    Matches are yielded as soon as they are found, so callers can start
+    organizing before the walk is complete. Directories whose name matches one
+    of the exclude_dirs glob patterns are skipped along with everything below
+    them. Like os.walk, symlinked directories are not followed.
+
+    If SourceListings are given, directories whose mtime is unchanged since
+    their previous listing are not listed again (their sub directories are
+    still visited, as changes deeper down don't affect a directory's mtime),
+    and every directory visited is recorded in them.
+
+    If a SharedScan is given, directories already listed by another job
+    scanning the same tree during this run are not listed again.
+    """
+    file_type_pattern = re.compile(file_type_regex, re.IGNORECASE)
+    exclude_pattern = compile_exclude_patterns(exclude_dirs)
+    pending_dirs = [src_path]
+    while pending_dirs:
+        dir_path = pending_dirs.pop()
+        try:
+            if shared_scan is not None:
+                listing = shared_scan.listing(dir_path, listings)
+            elif listings is None:
+                listing = list_directory(dir_path, 0)
+            else:
+                throttle()
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+                listing = listings.reuse(dir_path, mtime_ns)
+                if listing is None:
+                    listing = list_directory(dir_path, mtime_ns)
+                    listings.record(dir_path, listing)
+        except OSError as e:
+            logger.warning("Unable to list directory %s: %s", dir_path, e)
+            continue
+
+        sub_dirs = []
+        for name in listing.dir_names:
+            if exclude_pattern is not None and exclude_pattern.match(name):
+                logger.debug(
+                    "Skipping excluded directory: %s", os.path.join(dir_path, name)
+                )
+                continue
+            sub_dirs.append(os.path.join(dir_path, name))
+        for name in listing.file_names:
+            if file_type_pattern.match(name):
+                yield os.path.join(dir_path, name)
+        # Visit sub directories in listing order
+        pending_dirs.extend(reversed(sub_dirs))
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines, including the fields passed with extra=."""
+
+    # Attributes every LogRecord has, as opposed to those added with extra=
+    _RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+        "message",
+        "asctime",
+    }
 
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname.lower(),
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in self._RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
 
-def setup_logging(log_level: str = "info"):
-    """Configure logging to output to the console with a standard format."""
+
+class RepeatedWarningFilter(logging.Filter):
+    """
+    Let through at most limit warnings with the same message template every
+    window_seconds. The number of warnings suppressed is added to the next
+    one let through, or logged by flush.
+
+    Templates are told apart by the unformatted message, so this only groups
+    warnings logged with arguments (logger.warning("... %s", path)).
+    """
+
+    # Beyond this many templates, those without suppressed warnings are forgotten
+    MAX_TEMPLATES = 1000
+
+    def __init__(self, limit: int = 10, window_seconds: float = 60.0):
+        super().__init__()
+        self.limit = limit
+        self.window_seconds = window_seconds
+        # Template -> [window start, warnings let through, warnings suppressed]
+        self._windows: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING:
+            return True
+        template = str(record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(template)
+            if window is None or now - window[0] >= self.window_seconds:
+                if window is None and len(self._windows) >= self.MAX_TEMPLATES:
+                    self._forget_quiet_templates()
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                    record.msg = (
+                        f"{template} ({window[2]} similar warning(s) suppressed)"
+                    )
+                self._windows[template] = [now, 1, 0]
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def _forget_quiet_templates(self):
+        for template, window in list(self._windows.items()):
+            if not window[2]:
+                del self._windows[template]
+
+    def flush(self):
+        """Log how many warnings of each template were suppressed since they were last reported."""
+        with self._lock:
+            suppressed = [
+                (template, window[2])
+                for template, window in self._windows.items()
+                if window[2]
+            ]
+            self._windows.clear()
+        for template, count in suppressed:
+            logger.info(
+                "%d similar warning(s) suppressed: %s",
+                count,
+                template,
+                extra={"suppressed": count},
+            )
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records over to a QueueListener. Unlike QueueHandler, which merges
+    the traceback into the message, the formatted exception is kept in
+    exc_text, so JsonFormatter reports it in its own field.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Format the message now, as its arguments may change before it is written
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            # Tracebacks keep every frame alive, so only the text crosses the queue
+            record.exc_info = None
+        return record
+
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+def setup_logging(log_level: str = "info", log_format: str = "text"):
+    """
+    Configure logging to output to the console with a standard format, or as
+    JSON lines with the "json" log_format.
+
+    Records are handed to a background thread through a queue, so logging
+    never blocks on writing to the console, and repeated warnings are
+    rate-limited (see RepeatedWarningFilter). Pending records are written
+    when the interpreter exits.
+    """
     # Convert string log level to logging constant
     level_map = {
         "debug": logging.DEBUG,
@@ -104,11 +458,28 @@ def setup_logging(log_level: str = "info"):
     log_level_constant = level_map.get(log_level, logging.INFO)
 
     handler = logging.StreamHandler()
-    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        )
     logger.setLevel(log_level_constant)
 
     if not logger.hasHandlers():
-        logger.addHandler(handler)
+        log_queue = queue.SimpleQueue()
+        queue_handler = LogQueueHandler(log_queue)
+        warning_filter = RepeatedWarningFilter()
+        queue_handler.addFilter(warning_filter)
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        listener.start()
+        logger.addHandler(queue_handler)
+
+        def stop():
+            warning_filter.flush()
+            listener.stop()
+
+        atexit.register(stop)
 
 
 def is_directory_path(path):
@@ -1,85 +1,325 @@
 import argparse
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from linkarr.config import load_config, ConfigError
-from linkarr.helpers import clean_broken_symlinks, find_media_files, is_directory_path, logger, setup_logging
-from linkarr.models import Job, MediaType, Config
-from linkarr.parsers.tv import TVParser
-from linkarr.parsers.movie import MovieParser
-from linkarr.watch import watch_folders
-
-
-def process_job(job: Job):
-    """Process a single job."""
-    os.makedirs(job.dest, exist_ok=True)
-    num_removed_symlinks = clean_broken_symlinks(job.dest)
-
-    parser = None
-    match job.media_type:
-        case "tv":
-            parser = TVParser(job.dest, job.file_type_regex)
-        case "movie":
-            parser = MovieParser(job.dest, job.file_type_regex)
-
-    num_added_symlinks = 0
-    files = find_media_files(job.src, job.file_type_regex)
-    for file in files:
-        symlink_path = parser.organize_file(file)
-        if symlink_path is not None:
-            num_added_symlinks += 1
+from linkarr.helpers import is_directory_path, logger, setup_logging
+from linkarr.metrics import (
+    FILES_SCANNED,
+    IO_THROTTLED_SECONDS,
+    SYMLINKS_ADDED,
+    SYMLINKS_REMOVED,
+    job_label,
+)
+from linkarr.models import Job, MediaType, Config, FileChange
+from linkarr.profiling import PhaseTimer, profile_job, profile_run
+from linkarr.plan import apply_plan, deep_clean_due, plan_changes, plan_job
+from linkarr.routing import JobRouter, router_for
+from linkarr.state import SharedScan, StateIndex, locks_for
+from linkarr.throttle import io_budget
+
+
+def process_job(
+    job: Job,
+    deep_clean: bool = False,
+    full_rescan: bool = False,
+    shared_scan: Optional[SharedScan] = None,
+    sweep_when_due: bool = True,
+):
+    """
+    Process a single job.
+
+    The changes to make are planned first (see plan_job) and then applied in
+    bulk, so a run that finds nothing to do doesn't write to the disk.
+    Broken symlinks are found through the destination's link map, so the
+    destination is only walked when a deep clean is requested, or is due
+    unless sweep_when_due is unset.
+    Source directories unchanged since the last run are not listed again for
+    jobs with a state index, unless full_rescan is set. Jobs run alongside
+    others scanning the same source tree share its listings through shared_scan.
+
+    Filesystem calls are throttled to the job's I/O budget (see io_budget).
+    """
+    timer = PhaseTimer()
+    with io_budget(job) as budget:
+        if budget.idle_error is not None:
+            logger.warning(
+                "Unable to lower the I/O priority for %s: %s",
+                job.src,
+                budget.idle_error,
+            )
+        plan = plan_job(
+            job, deep_clean, timer, full_rescan, shared_scan, sweep_when_due
+        )
+        with timer.phase("apply"):
+            num_added_symlinks, num_removed_symlinks = apply_plan(plan)
+
+    timer.record(job)
+    label = job_label(job)
+    FILES_SCANNED.inc(plan.num_scanned_files, job=label)
+    IO_THROTTLED_SECONDS.inc(budget.throttled_seconds, job=label)
+    SYMLINKS_ADDED.inc(num_added_symlinks, job=label)
+    SYMLINKS_REMOVED.inc(num_removed_symlinks, job=label)
+
+    logger.info(
+        "Added %d new symlink(s), removed %d broken symlink(s).",
+        num_added_symlinks,
+        num_removed_symlinks,
+    )
+
+
+def process_changes(job: Job, changes: List[FileChange]):
+    """
+    Incrementally apply a batch of watcher changes to a single job.
+
+    Created files are organized directly and deleted files have only their own
+    symlink removed, so the source and destination trees are not walked (see
+    plan_changes). The changes are planned and then applied like a full run.
+    """
+    timer = PhaseTimer()
+    with timer.phase("incremental"):
+        plan = plan_changes(job, changes, timer)
+        num_added_symlinks, num_removed_symlinks = apply_plan(plan)
+
+    timer.record(job)
+    label = job_label(job)
+    SYMLINKS_ADDED.inc(num_added_symlinks, job=label)
+    SYMLINKS_REMOVED.inc(num_removed_symlinks, job=label)
 
     logger.info(
-        f"Added {num_added_symlinks} new symlink(s), removed {num_removed_symlinks} broken symlink(s)."
+        "Added %d new symlink(s), removed %d symlink(s).",
+        num_added_symlinks,
+        num_removed_symlinks,
     )
 
 
-def process_jobs(config: Config):
-    """Process all jobs in the config."""
-    for job in config.jobs:
-        process_job(job)
+def _shared_scans(jobs: List[Job]) -> Dict[Job, SharedScan]:
+    """
+    Return the SharedScan of each job whose source tree overlaps with other
+    jobs', one for all the jobs below the same outermost source folder.
+    """
+    shared_scans = {}
+    for root_jobs in JobRouter(jobs).roots().values():
+        if len(root_jobs) > 1:
+            shared_scan = SharedScan()
+            for job in root_jobs:
+                shared_scans[job] = shared_scan
+    return shared_scans
+
+
+def _sweep_key(job: Job) -> Tuple[str, str, Optional[str]]:
+    """Identify what a deep clean of the job's destination removes, see plan._plan_deep_clean."""
+    # Hardlinks and reflinks are only removed through the records of the job's own index
+    index_path = None if job.link_mode == "symlink" else StateIndex.path_for_job(job)
+    return os.path.abspath(job.dest), job.link_mode, index_path
+
+
+def process_jobs(config: Config, deep_clean: bool = False, full_rescan: bool = False):
+    """
+    Process all jobs in the config, running up to config.max_workers jobs at
+    once. Jobs whose destinations are equal or nested never run concurrently.
+
+    Jobs with overlapping source folders list the directories they share
+    once (see SharedScan), and a deep clean of a destination shared by
+    several jobs, whether requested or due, is only done by the first of them.
+    """
+    locks = locks_for(config)
+    shared_scans = _shared_scans(config.jobs)
+    # Decided up front, as the first deep clean of a destination resets its due time
+    due_sweeps = {
+        _sweep_key(job) for job in config.jobs if deep_clean or deep_clean_due(job)
+    }
+    swept = set()
+
+    def run_job(job: Job) -> float:
+        with locks.lock_for(job.dest), profile_job(job):
+            start_time = time.perf_counter()
+            sweep_key = _sweep_key(job)
+            # Jobs sharing a destination hold the same lock, so this can't race
+            job_deep_clean = sweep_key in due_sweeps and sweep_key not in swept
+            process_job(
+                job,
+                job_deep_clean,
+                full_rescan,
+                shared_scans.get(job),
+                sweep_when_due=False,
+            )
+            if job_deep_clean:
+                swept.add(sweep_key)
+            return time.perf_counter() - start_time
 
+    with ThreadPoolExecutor(
+        max_workers=config.max_workers, thread_name_prefix="linkarr-job"
+    ) as executor:
+        futures = [executor.submit(run_job, job) for job in config.jobs]
+        timings = [future.result() for future in futures]
 
-def process_job_for_folder(config: Config, changed_folder: str):
-    """Process only the job associated with the changed folder."""
-    for job in config.jobs:
-        if job.src == changed_folder:
-            logger.info(f"Processing job for changed folder: {changed_folder}")
-            process_job(job)
-            return
-    logger.warning(f"No job found for folder: {changed_folder}")
+    for job, duration in zip(config.jobs, timings):
+        logger.info("Job %s -> %s took %.2fs", job.src, job.dest, duration)
+
+
+def process_job_for_folder(
+    config: Config, changed_folder: str, changes: Optional[List[FileChange]] = None
+):
+    """
+    Process the jobs associated with the changed folder.
+
+    When changes are given, each one is applied incrementally to every
+    enabled job whose source folder contains it (see JobRouter). Otherwise
+    the jobs whose source folder is, or is inside, the changed folder are
+    fully reconciled, listing the directories they share once.
+
+    Each job holds the lock of its destination folder while it is processed,
+    like in process_jobs, so watch mode workers never write to the same
+    destination at once.
+    """
+    router = router_for(config)
+    locks = locks_for(config)
+    if changes is None:
+        jobs = router.jobs_under(changed_folder)
+        shared_scans = _shared_scans(jobs)
+        for job in jobs:
+            logger.info(
+                "Processing %s job for changed folder: %s", job.media_type, job.src
+            )
+            with locks.lock_for(job.dest):
+                process_job(job, shared_scan=shared_scans.get(job))
+    else:
+        changes_by_job: Dict[Job, List[FileChange]] = {}
+        for change in changes:
+            for job in router.jobs_for(change.path):
+                changes_by_job.setdefault(job, []).append(change)
+        jobs = list(changes_by_job)
+        for job, job_changes in changes_by_job.items():
+            logger.info(
+                "Processing %s job for changed folder: %s", job.media_type, job.src
+            )
+            with locks.lock_for(job.dest):
+                process_changes(job, job_changes)
+    if not jobs:
+        logger.warning("No job found for folder: %s", changed_folder)
+
+
+def profile_jobs(
+    config: Config,
+    deep_clean: bool = False,
+    output_path: Optional[str] = None,
+    use_cprofile: bool = True,
+    full_rescan: bool = False,
+):
+    """
+    Process all jobs once while profiling them, print a report of the
+    costliest phases, filesystem calls and functions per job, and optionally
+    write the raw cProfile stats to output_path.
+    """
+    with profile_run(use_cprofile) as profile:
+        process_jobs(config, deep_clean, full_rescan)
+
+    print(profile.report())
+    if output_path is not None and use_cprofile:
+        profile.dump(output_path)
+        logger.info("Profile written to %s", output_path)
 
 
 def main():
+    start_time = time.monotonic()
     parser = argparse.ArgumentParser(description="Media Organizer")
     parser.add_argument("config", help="Path to config JSON")
+    parser.add_argument(
+        "--deep-clean",
+        action="store_true",
+        help="Sweep every destination folder for broken symlinks on the first run "
+        "(in watch mode, every job gets an initial run before watching starts)",
+    )
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="List every source directory on the first run, even those unchanged since the last run "
+        "(in watch mode, every job gets an initial run before watching starts)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run the jobs once and print a report of where the time was spent",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="PATH",
+        help="With --profile, write the raw cProfile stats to this file",
+    )
+    parser.add_argument(
+        "--no-cprofile",
+        action="store_true",
+        help="With --profile, only collect phase timings and filesystem call counts",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the changes a single run would make without touching the disk",
+    )
     args = parser.parse_args()
 
     try:
         config = load_config(args.config)
     except ConfigError as e:
-        logger.error(f"Config error: {e}")
+        logger.error("Config error: %s", e)
         sys.exit(1)
 
     # Setup logging with the configured log level
-    setup_logging(config.log_level)
-    logger.info(f"Config loaded from {args.config} successfully")
+    setup_logging(config.log_level, config.log_format)
+    logger.info("Config loaded from %s successfully", args.config)
+
+    if args.dry_run:
+        for job in config.jobs:
+            print(
+                plan_job(job, args.deep_clean, full_rescan=args.full_rescan).describe()
+            )
+        return
+
+    if args.profile:
+        if config.mode != "once":
+            logger.info("Profiling a single run, ignoring mode '%s'", config.mode)
+        profile_jobs(
+            config,
+            args.deep_clean,
+            args.profile_output,
+            not args.no_cprofile,
+            args.full_rescan,
+        )
+        return
 
     match config.mode:
         case "watch":
-            logger.info(f"Performing initial run")
-            process_jobs(config)
-
-            watched_folders = [job.src for job in config.jobs if job.enabled]
-            for folder in watched_folders:
-                if not is_directory_path(folder):
-                    logger.error(f"Source folder does not exist: {folder}")
+            for job in config.jobs:
+                if job.enabled and not is_directory_path(job.src):
+                    logger.error("Source folder does not exist: %s", job.src)
                     sys.exit(1)
 
-            logger.info(f"Watching {len(watched_folders)} folders")
-            watch_folders(watched_folders, lambda changed_folder: process_job_for_folder(config, changed_folder))
+            # Only watch mode needs asyncio and the watchers, so they don't slow down other runs
+            import asyncio
+            from linkarr.daemon import WatchDaemon
+
+            # Jobs are reconciled in the background, unless a sweep or rescan is requested
+            warm_start = not (args.deep_clean or args.full_rescan)
+            initial_run = None
+            if not warm_start:
+                initial_run = lambda: process_jobs(
+                    config, args.deep_clean, args.full_rescan
+                )
+            daemon = WatchDaemon(
+                config,
+                process_job_for_folder,
+                initial_run=initial_run,
+                config_path=args.config,
+                warm_start=warm_start,
+                start_time=start_time,
+            )
+            asyncio.run(daemon.run())
         case "once":
-            logger.info(f"Triggering a single run")
-            process_jobs(config)
+            logger.info("Triggering a single run")
+            process_jobs(config, args.deep_clean, args.full_rescan)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import threading
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+from linkarr.helpers import logger
+from linkarr.models import Job
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Run durations range from milliseconds (a single watcher change) to many
+# minutes (a full run over a large library)
+DURATION_BUCKETS = (
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    900.0,
+    3600.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    if not label_names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    """Base class for metrics with optional labels, rendered in Prometheus text format."""
+
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative buckets, with their sum and count."""
+
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (the last one being +Inf), sum of observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def get_count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        bucket_label_names = self.label_names + ("le",)
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(bucket_label_names, key + (le,))} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+RUN_DURATION = Histogram(
+    "linkarr_run_duration_seconds",
+    "Time spent processing a job, per phase (clean, scan, index, plan, apply, incremental and total).",
+    ["job", "phase"],
+)
+FILES_SCANNED = Counter(
+    "linkarr_files_scanned_total",
+    "Media files found while scanning source folders.",
+    ["job"],
+)
+FILES_PARSED = Counter(
+    "linkarr_files_parsed_total", "File names parsed successfully.", ["job"]
+)
+PARSE_FAILURES = Counter(
+    "linkarr_parse_failures_total", "File names that could not be parsed.", ["job"]
+)
+SYMLINKS_ADDED = Counter(
+    "linkarr_symlinks_added_total", "Symlinks created in destination folders.", ["job"]
+)
+SYMLINKS_REMOVED = Counter(
+    "linkarr_symlinks_removed_total",
+    "Symlinks removed from destination folders.",
+    ["job"],
+)
+IO_THROTTLED_SECONDS = Counter(
+    "linkarr_io_throttled_seconds_total",
+    "Time full runs spent waiting for their I/O budget (see io_ops_per_second).",
+    ["job"],
+)
+WATCH_EVENTS = Counter(
+    "linkarr_watch_events_total",
+    "Filesystem events received from the watcher. Use rate() for events per second.",
+)
+EVENTS_COALESCED = Counter(
+    "linkarr_watch_events_coalesced_total",
+    "Watcher events merged into another event for the same path before processing.",
+)
+EVENT_QUEUE_DEPTH = Gauge(
+    "linkarr_event_queue_depth", "Changed paths waiting to be processed."
+)
+SETTLING_PATHS = Gauge(
+    "linkarr_settling_paths", "New files and directories held until they stop changing."
+)
+
+
+def job_label(job: Job) -> str:
+    """Return the label identifying a job in metrics."""
+    return f"{job.media_type}:{job.src}"
+
+
+def render_metrics() -> str:
+    """Render every registered metric in Prometheus text format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def _metrics_handler_class():
+    """
+    Build the metrics request handler. http.server is only imported here,
+    as it adds to the startup time of runs without a metrics endpoint.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    return MetricsHandler
+
+
+def start_metrics_server(host: str, port: int) -> "ThreadingHTTPServer":
+    """Serve metrics at http://host:port/metrics from a background thread."""
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _metrics_handler_class())
+    thread = threading.Thread(
+        target=server.serve_forever, name="linkarr-metrics", daemon=True
+    )
+    thread.start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -1,4 +1,4 @@
-from typing import List, Literal, TypedDict, Optional
+from typing import List, Literal, Tuple, TypedDict, Optional
 from dataclasses import dataclass
 
 # Type aliases for better readability
@@ -6,25 +6,37 @@ MediaType = Literal["tv", "movie"]
 MediaServerFormat = Literal["jellyfin"]
 RunMode = Literal["watch", "once"]
 LogLevel = Literal["debug", "info", "warning", "error", "critical"]
+LogFormat = Literal["text", "json"]
+ChangeType = Literal["created", "deleted"]
+WatcherType = Literal["native", "poll"]
+LinkMode = Literal["symlink", "hardlink", "reflink"]
+IOPriority = Literal["normal", "idle"]
 
 
-@dataclass
+# Models that are kept for every tracked file, or shared between threads, are
+# frozen and slotted: a large library holds hundreds of thousands of them.
+
+
+@dataclass(frozen=True, slots=True)
 class ParsedInfo:
     """Base class for parsed media information."""
 
     pass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TVShowInfo(ParsedInfo):
-    """Parsed information for TV shows."""
+    """
+    Parsed information for TV shows. Season and episode are numbers, they are
+    zero padded when building paths.
+    """
 
     series_name: str
-    season_number: str
-    episode_number: str
+    season_number: int
+    episode_number: int
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MovieInfo(ParsedInfo):
     """Parsed information for movies."""
 
@@ -32,7 +44,58 @@ class MovieInfo(ParsedInfo):
     year: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
+class IndexedFile:
+    """A source file tracked by the state index, with the symlink created for it."""
+
+    src_path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    parsed_info: Optional[ParsedInfo] = None
+    link_path: Optional[str] = None
+
+    def matches_stat(self, stat_result) -> bool:
+        """Check if the file is unchanged since it was indexed."""
+        return (
+            self.size == stat_result.st_size
+            and self.mtime_ns == stat_result.st_mtime_ns
+            and self.inode == stat_result.st_ino
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class LinkRecord:
+    """
+    A hardlink or reflink created by linkarr, tracked by the state index. Such
+    links look like any other file, so only a file at link_path still having
+    this device and inode is taken to be the link.
+    """
+
+    link_path: str
+    src_path: str
+    dev: int
+    inode: int
+
+    def matches_stat(self, stat_result) -> bool:
+        """Check if a file at link_path is still the link that was created."""
+        return self.dev == stat_result.st_dev and self.inode == stat_result.st_ino
+
+
+@dataclass(frozen=True, slots=True)
+class DirListing:
+    """
+    Names inside a source directory when it was last listed, used to skip
+    listing it again while its mtime is unchanged.
+    """
+
+    mtime_ns: int
+    file_names: List[str]
+    # Sub directories, not including symlinks to directories
+    dir_names: List[str]
+
+
+@dataclass(frozen=True, slots=True)
 class Job:
     """Represents a media organization job configuration."""
 
@@ -41,13 +104,47 @@ class Job:
     media_type: MediaType = "tv"
     file_type_regex: str = ".*\\.(mkv|mp4|avi)$"
     enabled: bool = True
-
-
-@dataclass
+    state_index: bool = False
+    deep_clean_interval_hours: float = 24.0
+    exclude_dirs: Tuple[str, ...] = ()
+    watcher: WatcherType = "native"
+    poll_interval_seconds: float = 10.0
+    max_poll_interval_seconds: float = 300.0
+    scan_processes: int = 1
+    link_mode: LinkMode = "symlink"
+    io_ops_per_second: Optional[float] = None
+    io_priority: IOPriority = "normal"
+
+
+@dataclass(frozen=True, slots=True)
 class Config:
     """Represents the complete configuration."""
 
-    jobs: List[Job]
+    jobs: Tuple[Job, ...]
     mode: RunMode = "watch"
     media_server_format: MediaServerFormat = "jellyfin"
     log_level: LogLevel = "info"
+    log_format: LogFormat = "text"
+    debounce_seconds: float = 2.0
+    max_delay_seconds: float = 30.0
+    max_pending_changes: int = 10000
+    settle_seconds: float = 5.0
+    in_progress_patterns: Tuple[str, ...] = (
+        "*.part",
+        "*.partial",
+        "*.!qB",
+        "*.!ut",
+        "*.crdownload",
+    )
+    max_workers: int = 1
+    metrics_port: Optional[int] = None
+    metrics_host: str = "127.0.0.1"
+
+
+@dataclass(frozen=True, slots=True)
+class FileChange:
+    """A single filesystem change reported by the watcher."""
+
+    path: str
+    change_type: ChangeType
+    is_directory: bool = False
@@ -1,20 +1,45 @@
 import os
 import re
 from abc import ABC, abstractmethod
-from typing import Optional
-from linkarr.helpers import create_symlink, logger
-from linkarr.models import ParsedInfo
+from typing import Dict, Iterable, List, Optional
+from linkarr.helpers import create_link, logger
+from linkarr.metrics import FILES_PARSED, PARSE_FAILURES
+from linkarr.models import LinkMode, ParsedInfo
+from linkarr.state import DirectoryCache
 
 
 class BaseParser(ABC):
     """Base class for media parsers that provides common functionality."""
 
     DELIM_PATTERN = r"[ .]"  # Delimiter: period or space
+    DELIM_REGEX = re.compile(DELIM_PATTERN)
+    # The kind of media parsed, as shown in log messages
+    MEDIA_NAME = "media"
+
+    def __init__(
+        self,
+        dest_path: str,
+        file_type_regex: str,
+        dest_cache: Optional[DirectoryCache] = None,
+        link_mode: LinkMode = "symlink",
+        metrics_label: Optional[str] = None,
+    ):
+        """
+        Initialize parser.
 
-    def __init__(self, dest_path: str, file_type_regex: str):
-        """Initialize parser."""
+        An optional DirectoryCache is used while linking and unlinking, to avoid
+        repeated filesystem checks within the same run. Files are linked
+        according to link_mode. Parsed files and parse failures are counted
+        in the metrics of the job with metrics_label (see job_label), if given.
+        """
         self.dest_path = dest_path
         self.file_type_regex = file_type_regex
+        self.file_type_pattern = re.compile(file_type_regex)
+        self.dest_cache = dest_cache
+        self.link_mode = link_mode
+        self.metrics_label = metrics_label
+        # Source directory -> number of files in it that failed to parse
+        self.parse_failures: Dict[str, int] = {}
 
     @abstractmethod
     def parse_info(self, source_file_path: str) -> Optional[ParsedInfo]:
@@ -42,26 +67,88 @@ class BaseParser(ABC):
         """
         pass
 
+    @abstractmethod
+    def build_destination_path(self, parsed_info: ParsedInfo) -> str:
+        """
+        Build the destination path for already parsed media information.
+
+        Args:
+            parsed_info: ParsedInfo object returned by parse_info
+
+        Returns:
+            Destination path where the file should be organized
+        """
+        pass
+
+    def parse_many(
+        self, source_file_paths: Iterable[str]
+    ) -> List[Optional[ParsedInfo]]:
+        """
+        Parse media information for a batch of source file paths.
+
+        Args:
+            source_file_paths: Paths to the source media files
+
+        Returns:
+            List with the ParsedInfo (or None if parsing fails) for each path, in order
+        """
+        parse_info = self.parse_info
+        return [parse_info(source_file_path) for source_file_path in source_file_paths]
+
+    def record_parsed(self):
+        """Count a file parsed successfully in the job's metrics."""
+        if self.metrics_label is not None:
+            FILES_PARSED.inc(job=self.metrics_label)
+
+    def record_parse_failure(self, source_file_path: str):
+        """Count a file that failed to parse, to be summed up by report_parse_failures."""
+        if self.metrics_label is not None:
+            PARSE_FAILURES.inc(job=self.metrics_label)
+        logger.debug(
+            "Failed to parse %s info from file: %s", self.MEDIA_NAME, source_file_path
+        )
+        dir_path = os.path.dirname(source_file_path)
+        self.parse_failures[dir_path] = self.parse_failures.get(dir_path, 0) + 1
+
+    def report_parse_failures(self):
+        """
+        Log a single warning per source directory with files that failed to
+        parse since the last report, instead of one per file.
+        """
+        for dir_path, count in sorted(self.parse_failures.items()):
+            logger.warning(
+                "%d file(s) failed %s parsing in %s",
+                count,
+                self.MEDIA_NAME,
+                dir_path,
+                extra={"parse_failures": count, "directory": dir_path},
+            )
+        self.parse_failures.clear()
+
     def check_file_type_valid(self, source_file_path: str) -> bool:
         """Check if the file matches the file_type_regex."""
-        return re.match(self.file_type_regex, source_file_path) is not None
+        return self.file_type_pattern.match(source_file_path) is not None
 
-    def organize_file(self, source_file_path: str) -> Optional[str]:
+    def organize_file(
+        self, source_file_path: str, validate_file_type: bool = True
+    ) -> Optional[str]:
         """
-        Organize a file by creating a symlink at the calculated destination.
+        Organize a file by creating a link at the calculated destination.
 
         Args:
             source_file_path: Path to the source media file
+            validate_file_type: Whether to check the file against file_type_regex.
+                Disable for files that already passed the check while scanning.
 
         Returns:
-            Path to the created symlink, or None if organization fails
+            Path to the created link, or None if organization fails
         """
-        if not self.check_file_type_valid(source_file_path):
-            logger.debug(f"Skipping file with ignored file type: {source_file_path}")
+        if validate_file_type and not self.check_file_type_valid(source_file_path):
+            logger.debug("Skipping file with ignored file type: %s", source_file_path)
             return None
 
         dest_path = self.get_destination_path(source_file_path)
         if not dest_path:
             return None
 
-        return create_symlink(source_file_path, dest_path)
+        return create_link(source_file_path, dest_path, self.dest_cache, self.link_mode)
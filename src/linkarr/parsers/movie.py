@@ -1,32 +1,35 @@
 import os
 import re
+import sys
 from typing import Optional
 from .base import BaseParser
-from linkarr.helpers import logger
 from linkarr.models import MovieInfo
 
 
 class MovieParser(BaseParser):
     """Parser for movie files."""
 
+    MEDIA_NAME = "movie"
+
+    INFO_PATTERN = re.compile(
+        rf"(?:.*/)?"  # Optional path
+        rf"(?P<movie>.+?)"  # Movie name (non-greedy)
+        rf"{BaseParser.DELIM_PATTERN}"
+        rf"(?P<year>\d{{4}})"  # Movie year
+        rf"(?:.*$)"  # Rest of the filename
+    )
+
     def parse_info(self, source_file_path: str) -> Optional[MovieInfo]:
         """Parse movie information from a source file path."""
-        delim = self.DELIM_PATTERN
-        pattern = (
-            rf"(?:.*/)?"            # Optional path
-            rf"(?P<movie>.+?)"      # Movie name (non-greedy)
-            rf"{delim}"
-            rf"(?P<year>\d{{4}})"   # Movie year
-            rf"(?:.*$)"             # Rest of the filename
-        )
-        result = re.search(pattern, source_file_path)
+        result = self.INFO_PATTERN.search(source_file_path)
         if not result:
-            logger.warning(f"Failed to parse movie info from file: {source_file_path}")
+            self.record_parse_failure(source_file_path)
             return None
+        self.record_parsed()
 
-        title = re.sub(delim, " ", result.group("movie"))
-        title = title.strip().title()
-        year = result.group("year")
+        title = self.DELIM_REGEX.sub(" ", result.group("movie"))
+        title = sys.intern(title.strip().title())
+        year = sys.intern(result.group("year"))
 
         return MovieInfo(title=title, year=year)
 
@@ -36,6 +39,10 @@ class MovieParser(BaseParser):
         if not parsed_info:
             return None
 
+        return self.build_destination_path(parsed_info)
+
+    def build_destination_path(self, parsed_info: MovieInfo) -> str:
+        """Build the destination path for already parsed movie information."""
         target_dir = os.path.join(
             self.dest_path, f"{parsed_info.title} ({parsed_info.year})"
         )
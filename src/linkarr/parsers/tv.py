@@ -1,41 +1,49 @@
 import os
 import re
+import sys
+from functools import lru_cache
 from typing import Optional
 from .base import BaseParser
-from linkarr.helpers import logger
 from linkarr.models import TVShowInfo
 
 
+@lru_cache(maxsize=None)
+def _season_dir_name(season_number: int) -> str:
+    return f"Season {season_number:02d}"
+
+
 class TVParser(BaseParser):
     """Parser for TV show files."""
 
+    MEDIA_NAME = "TV show"
+
+    INFO_PATTERN = re.compile(
+        rf"(?:.*/)?"  # Optional path
+        rf"(?P<series>.+?)"  # Series name (non-greedy)
+        rf"{BaseParser.DELIM_PATTERN}"
+        rf"(?:\d{{4}}{BaseParser.DELIM_PATTERN})?"  # Optional year
+        rf"[Ss](?P<season>\d{{2}})"  # Season
+        rf"[Ee](?P<episode>\d{{2}})"  # Episode
+        rf"(?:.*$)",  # Rest of the filename
+        re.VERBOSE,
+    )
+
     def parse_info(self, source_file_path: str) -> Optional[TVShowInfo]:
         """Parse TV show information from a source file path."""
-        delim = self.DELIM_PATTERN
-        pattern = (
-            rf"(?:.*/)?"                    # Optional path
-            rf"(?P<series>.+?)"             # Series name (non-greedy)
-            rf"{delim}"
-            rf"(?:\d{{4}}{delim})?"         # Optional year
-            rf"[Ss](?P<season>\d{{2}})"     # Season
-            rf"[Ee](?P<episode>\d{{2}})"    # Episode
-            rf"(?:.*$)"                     # Rest of the filename
-        )
-
-        result = re.search(pattern, source_file_path, re.VERBOSE)
+        result = self.INFO_PATTERN.search(source_file_path)
         if not result:
-            logger.warning(f"Failed to parse TV show info from file: {source_file_path}")
+            self.record_parse_failure(source_file_path)
             return None
+        self.record_parsed()
 
-        series_name = re.sub(delim, " ", result.group("series"))
-        series_name = series_name.strip().title()
-        season_number = result.group("season")
-        episode_number = result.group("episode")
+        series_name = self.DELIM_REGEX.sub(" ", result.group("series"))
+        # Interned, as every episode of a series repeats its name
+        series_name = sys.intern(series_name.strip().title())
 
         return TVShowInfo(
             series_name=series_name,
-            season_number=season_number,
-            episode_number=episode_number,
+            season_number=int(result.group("season")),
+            episode_number=int(result.group("episode")),
         )
 
     def get_destination_path(self, source_file_path: str) -> Optional[str]:
@@ -44,9 +52,13 @@ class TVParser(BaseParser):
         if not parsed_info:
             return None
 
+        return self.build_destination_path(parsed_info)
+
+    def build_destination_path(self, parsed_info: TVShowInfo) -> str:
+        """Build the destination path for already parsed TV show information."""
         target_dir = os.path.join(
             self.dest_path,
             parsed_info.series_name,
-            f"Season {parsed_info.season_number}",
+            _season_dir_name(parsed_info.season_number),
         )
         return target_dir
@@ -0,0 +1,874 @@
+import heapq
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from linkarr.helpers import (
+    compile_exclude_patterns,
+    create_link,
+    find_media_files,
+    get_relative_symlink_paths,
+    is_excluded_dir,
+    is_media_file,
+    is_recorded_link,
+    is_stale_link,
+    link_points_to,
+    list_directory,
+    logger,
+    remove_stale_link,
+    resolve_symlink_target,
+)
+from linkarr.metrics import job_label
+from linkarr.models import (
+    DirListing,
+    FileChange,
+    IndexedFile,
+    Job,
+    LinkRecord,
+    ParsedInfo,
+)
+from linkarr.parsers.base import BaseParser
+from linkarr.parsers.movie import MovieParser
+from linkarr.parsers.tv import TVParser
+from linkarr.profiling import PhaseTimer
+from linkarr.state import (
+    DirectoryCache,
+    LinkMap,
+    SharedScan,
+    SourceListings,
+    StateIndex,
+    get_link_map,
+    set_link_map,
+)
+from linkarr.throttle import io_budget, throttle
+
+
+def create_parser(job: Job, dest_cache: Optional[DirectoryCache] = None) -> BaseParser:
+    """Create the parser matching the job's media type, counting into the job's metrics."""
+    label = job_label(job)
+    match job.media_type:
+        case "tv":
+            return TVParser(
+                job.dest, job.file_type_regex, dest_cache, job.link_mode, label
+            )
+        case "movie":
+            return MovieParser(
+                job.dest, job.file_type_regex, dest_cache, job.link_mode, label
+            )
+
+
+@dataclass
+class PlannedLink:
+    """
+    A link to create or remove, and the source file it points at, if known.
+    """
+
+    src_path: Optional[str]
+    link_path: str
+
+
+@dataclass
+class ScannedFile:
+    """A source file found and parsed by a scan worker (see _scan_sharded)."""
+
+    src_path: str
+    parsed_info: Optional[ParsedInfo]
+    link_path: Optional[str]
+    # Only collected for jobs with a state index
+    stat_result: Optional[os.stat_result] = None
+
+
+@dataclass
+class SyncPlan:
+    """
+    The changes needed to bring a job's destination in line with its source
+    folder, computed without touching the disk (see plan_job and apply_plan).
+    """
+
+    job: Job
+    link_map: LinkMap
+    dest_cache: DirectoryCache
+    # Whether link_map was rebuilt by a full sweep of the destination
+    deep_cleaned: bool = False
+    # The hardlinks and reflinks recorded in the state index, keyed by path
+    link_records: Dict[str, LinkRecord] = field(default_factory=dict)
+    # Records of links no longer found in the destination
+    forgotten_links: List[str] = field(default_factory=list)
+    num_scanned_files: int = 0
+    links_to_create: List[PlannedLink] = field(default_factory=list)
+    links_to_remove: List[PlannedLink] = field(default_factory=list)
+    dirs_to_prune: List[str] = field(default_factory=list)
+    # Sources whose symlinks are forgotten, because they no longer exist
+    vanished_sources: List[str] = field(default_factory=list)
+    index_updates: List[IndexedFile] = field(default_factory=list)
+    index_removals: List[str] = field(default_factory=list)
+    listing_updates: Dict[str, DirListing] = field(default_factory=dict)
+    listing_removals: List[str] = field(default_factory=list)
+    # Planned link paths -> the source files they point at
+    _created_paths: Dict[str, str] = field(default_factory=dict, repr=False)
+    _removed_paths: Set[str] = field(default_factory=set, repr=False)
+
+    def is_empty(self) -> bool:
+        """Check if applying the plan would not change anything."""
+        return not (
+            self.links_to_create
+            or self.links_to_remove
+            or self.dirs_to_prune
+            or self.vanished_sources
+            or self.index_updates
+            or self.index_removals
+            or self.listing_updates
+            or self.listing_removals
+            or self.forgotten_links
+        )
+
+    def create_link(self, src_file: str, link_path: str):
+        self.links_to_create.append(PlannedLink(src_file, link_path))
+        self._created_paths[link_path] = src_file
+
+    def remove_link(self, src_file: Optional[str], link_path: str):
+        if link_path not in self._removed_paths:
+            self.links_to_remove.append(PlannedLink(src_file, link_path))
+            self._removed_paths.add(link_path)
+
+    def points_to(self, link_path: str, src_file: str) -> bool:
+        """Check if link_path is, or is planned to be, a link to src_file, see link_points_to."""
+        if self._created_paths.get(link_path) == src_file:
+            return True
+        record = self.link_records.get(link_path)
+        return link_points_to(link_path, src_file, self.job.link_mode, record)
+
+    def describe(self) -> str:
+        """Return a human readable listing of the plan, as printed by --dry-run."""
+        lines = [
+            f"Plan for {self.job.media_type} job {self.job.src} -> {self.job.dest}:"
+        ]
+        for link in sorted(self.links_to_remove, key=lambda link: link.link_path):
+            lines.append(f"  remove {link.link_path}")
+        for dir_path in self.dirs_to_prune:
+            lines.append(f"  rmdir  {dir_path}")
+        for link in sorted(self.links_to_create, key=lambda link: link.link_path):
+            lines.append(f"  create {link.link_path} -> {link.src_path}")
+        lines.append(
+            f"  {len(self.links_to_create)} symlink(s) to create, "
+            f"{len(self.links_to_remove)} to remove, "
+            f"{len(self.dirs_to_prune)} dir(s) to prune"
+        )
+        return "\n".join(lines)
+
+
+def _plan_link(plan: SyncPlan, src_file: str, link_path: str) -> bool:
+    """
+    Plan a link for src_file at link_path unless something is already there.
+    A stale link in the way (see is_stale_link) is planned to be replaced.
+
+    Returns whether a link was planned.
+    """
+    if link_path in plan._created_paths:
+        logger.debug("Link '%s' is already planned... Skipping...", link_path)
+        return False
+    if plan.dest_cache.exists(link_path):
+        link_mode = plan.job.link_mode
+        record = plan.link_records.get(link_path)
+        if is_stale_link(link_path, link_mode, record):
+            # A link whose source vanished, e.g. a file moved to another folder
+            if os.path.islink(link_path):
+                plan.remove_link(resolve_symlink_target(link_path), link_path)
+            else:
+                plan.remove_link(record.src_path, link_path)
+        elif os.path.lexists(link_path):
+            if link_mode != "symlink" and plan.points_to(link_path, src_file):
+                # Unlike symlinks, these aren't found when sweeping the destination
+                plan.link_map.add(src_file, link_path)
+            logger.debug("Link '%s' already exists... Skipping...", link_path)
+            return False
+    plan.create_link(src_file, link_path)
+    return True
+
+
+def _plan_deep_clean(plan: SyncPlan, candidate_dirs: Set[str]):
+    """
+    Plan the removal of every broken symlink in the destination, rebuilding the
+    link map. With the hardlink and reflink modes, the recorded links of
+    sources that are gone are planned for removal as well, and records of
+    links no longer found are forgotten. Other files are left alone.
+    """
+    job = plan.job
+    found_records = set()
+    for dir_path, dir_names, file_names in os.walk(job.dest, topdown=False):
+        throttle()
+        plan.dest_cache.remember_listing(dir_path, dir_names + file_names)
+        candidate_dirs.add(dir_path)
+        for filename in file_names:
+            symlink_location = os.path.join(dir_path, filename)
+            throttle()
+            if not os.path.islink(symlink_location):
+                record = plan.link_records.get(symlink_location)
+                if record is None or not is_recorded_link(symlink_location, record):
+                    continue
+                found_records.add(symlink_location)
+                if is_stale_link(symlink_location, job.link_mode, record):
+                    plan.remove_link(record.src_path, symlink_location)
+                else:
+                    plan.link_map.add(record.src_path, symlink_location)
+                continue
+            target = resolve_symlink_target(symlink_location)
+            if not os.path.exists(target):
+                plan.remove_link(target, symlink_location)
+            else:
+                plan.link_map.add(target, symlink_location)
+    plan.forgotten_links = [
+        path for path in plan.link_records if path not in found_records
+    ]
+
+
+def _plan_pruning(plan: SyncPlan, candidate_dirs: Set[str]):
+    """
+    Plan the removal of the candidate directories, and of their parents, that
+    are empty or will be left empty by the planned removals.
+    """
+    root_path = os.path.abspath(plan.job.dest)
+    # Directories receiving new symlinks are kept, along with their parents
+    kept_dirs = set()
+    for link in plan.links_to_create:
+        dir_path = os.path.dirname(os.path.abspath(link.link_path))
+        while dir_path.startswith(root_path + os.sep) and dir_path not in kept_dirs:
+            kept_dirs.add(dir_path)
+            dir_path = os.path.dirname(dir_path)
+
+    removed_paths = {os.path.abspath(path) for path in plan._removed_paths}
+    pruned_dirs = set()
+    # Visit the deepest directories first, so parents see which children go away
+    pending: List[Tuple[int, str]] = []
+    for dir_path in {os.path.abspath(path) for path in candidate_dirs}:
+        heapq.heappush(pending, (-dir_path.count(os.sep), dir_path))
+    visited = set()
+    while pending:
+        _, dir_path = heapq.heappop(pending)
+        if dir_path in visited:
+            continue
+        visited.add(dir_path)
+        if not dir_path.startswith(root_path + os.sep) or dir_path in kept_dirs:
+            continue
+        try:
+            names = plan.dest_cache.entries(dir_path)
+        except OSError:
+            continue
+        remaining = [
+            name
+            for name in names
+            if os.path.join(dir_path, name) not in removed_paths
+            and os.path.join(dir_path, name) not in pruned_dirs
+        ]
+        if remaining:
+            continue
+        pruned_dirs.add(dir_path)
+        parent = os.path.dirname(dir_path)
+        heapq.heappush(pending, (-parent.count(os.sep), parent))
+
+    plan.dirs_to_prune = sorted(
+        pruned_dirs, key=lambda path: (-path.count(os.sep), path)
+    )
+
+
+def _load_link_records(job: Job) -> Dict[str, LinkRecord]:
+    """Read the hardlinks and reflinks recorded in the job's state index."""
+    db_path = StateIndex.path_for_job(job)
+    if job.link_mode == "symlink" or not job.state_index or not os.path.exists(db_path):
+        return {}
+    with StateIndex(db_path, read_only=True) as index:
+        return index.links()
+
+
+def _load_index(job: Job) -> Tuple[Dict[str, IndexedFile], Dict[str, DirListing]]:
+    """
+    Read the job's state index without creating or modifying it. An index of
+    files matched with other settings is treated as empty (see StateIndex).
+    """
+    db_path = StateIndex.path_for_job(job)
+    if not os.path.exists(db_path):
+        return {}, {}
+    with StateIndex(db_path, read_only=True) as index:
+        if not index.matches_job(job):
+            return {}, {}
+        return index.entries(), index.dir_listings()
+
+
+def _parse_files(job: Job, parser: BaseParser, src_files) -> List[ScannedFile]:
+    """Parse source files into their destination symlinks, stat'ing them for the state index."""
+    scanned = []
+    for src_file in src_files:
+        stat_result = None
+        if job.state_index:
+            throttle()
+            try:
+                stat_result = os.stat(src_file)
+            except FileNotFoundError:
+                continue
+        parsed_info = parser.parse_info(src_file)
+        link_path = None
+        if parsed_info is not None:
+            dest_path = parser.build_destination_path(parsed_info)
+            _, link_path = get_relative_symlink_paths(src_file, dest_path)
+        scanned.append(ScannedFile(src_file, parsed_info, link_path, stat_result))
+    return scanned
+
+
+def _scan_shard(
+    job: Job, shard_dir: str
+) -> Tuple[List[ScannedFile], Dict[str, DirListing]]:
+    """
+    Find and parse the media files below shard_dir, in a worker process.
+    Returns them along with the listings of the directories visited.
+    """
+    listings = SourceListings() if job.state_index else None
+    with io_budget(job, share=job.scan_processes):
+        files = find_media_files(
+            shard_dir, job.file_type_regex, job.exclude_dirs, listings
+        )
+        scanned = _parse_files(job, create_parser(job), files)
+    return scanned, {} if listings is None else listings.current
+
+
+def _scan_sharded(
+    job: Job, parser: BaseParser, listings: Optional[SourceListings]
+) -> List[ScannedFile]:
+    """
+    Find and parse the job's media files with a pool of job.scan_processes
+    processes, each walking one top-level directory of the source folder at a
+    time. Files directly inside it are parsed with parser, which also gets the
+    parse failures of the workers. Nothing is written, the results are planned
+    by the caller.
+    """
+    try:
+        if listings is None:
+            top_listing = list_directory(job.src, 0)
+        else:
+            top_listing = list_directory(job.src, os.stat(job.src).st_mtime_ns)
+            listings.record(job.src, top_listing)
+    except OSError as e:
+        logger.warning("Unable to list directory %s: %s", job.src, e)
+        return []
+
+    file_type_pattern = re.compile(job.file_type_regex, re.IGNORECASE)
+    exclude_pattern = compile_exclude_patterns(job.exclude_dirs)
+    shards = [
+        os.path.join(job.src, name)
+        for name in top_listing.dir_names
+        if exclude_pattern is None or not exclude_pattern.match(name)
+    ]
+    top_files = [
+        os.path.join(job.src, name)
+        for name in top_listing.file_names
+        if file_type_pattern.match(name)
+    ]
+
+    results: Dict[str, List[ScannedFile]] = {}
+    num_files = 0
+    # Processes are spawned rather than forked, as other jobs may be running in threads
+    with ProcessPoolExecutor(
+        max_workers=job.scan_processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {executor.submit(_scan_shard, job, shard): shard for shard in shards}
+        for future in as_completed(futures):
+            scanned, shard_listings = future.result()
+            results[futures[future]] = scanned
+            num_files += len(scanned)
+            if listings is not None:
+                for dir_path, listing in shard_listings.items():
+                    listings.record(dir_path, listing)
+            logger.info(
+                "Scanned %d/%d directories of %s (%d files)",
+                len(results),
+                len(shards),
+                job.src,
+                num_files,
+            )
+
+    # Plan in walk order, so conflicting links resolve the same way as a sequential scan
+    scanned_files = _parse_files(job, parser, top_files)
+    for shard in shards:
+        # Parser metrics and failures recorded in the worker processes are lost with them
+        for scanned in results[shard]:
+            if scanned.parsed_info is None:
+                parser.record_parse_failure(scanned.src_path)
+            else:
+                parser.record_parsed()
+        scanned_files.extend(results[shard])
+    return scanned_files
+
+
+def _load_link_map(job: Job) -> Optional[LinkMap]:
+    """
+    Return the link map of the job's destination. If this process hasn't
+    built one yet, a job with a state index loads it from the links of its
+    indexed files, as long as the index recorded a deep clean.
+
+    Returns None if the destination must be swept to build the map, which is
+    also the case for a job without a state index if the map isn't complete.
+    """
+    link_map = get_link_map(job.dest)
+    if link_map is None and job.state_index:
+        db_path = StateIndex.path_for_job(job)
+        if os.path.exists(db_path):
+            with StateIndex(db_path, read_only=True) as index:
+                last_deep_clean = index.last_deep_clean()
+                if last_deep_clean is not None and index.matches_job(job):
+                    link_map = LinkMap(last_deep_clean, complete=False)
+                    for entry in index.entries().values():
+                        if entry.link_path is not None:
+                            link_map.add(entry.src_path, entry.link_path)
+                    set_link_map(job.dest, link_map)
+    if link_map is None or not (link_map.complete or job.state_index):
+        return None
+    return link_map
+
+
+def deep_clean_due(job: Job) -> bool:
+    """Check if the job's destination has no usable link map yet, or its deep clean is due."""
+    link_map = _load_link_map(job)
+    return link_map is None or link_map.deep_clean_due(job.deep_clean_interval_hours)
+
+
+def _begin_plan(
+    job: Job,
+    deep_clean: bool,
+    timer: PhaseTimer,
+    candidate_dirs: Set[str],
+    sweep_when_due: bool = True,
+) -> SyncPlan:
+    """
+    Start a plan for the job with its destination's link map, planning a
+    deep clean to rebuild it first if there is none to use yet (see
+    _load_link_map), one is requested, or (with sweep_when_due) one is due.
+    """
+    dest_cache = DirectoryCache(job.dest)
+    link_map = _load_link_map(job)
+    link_records = _load_link_records(job)
+    if (
+        deep_clean
+        or link_map is None
+        or (sweep_when_due and link_map.deep_clean_due(job.deep_clean_interval_hours))
+    ):
+        logger.info("Performing deep clean of %s", job.dest)
+        plan = SyncPlan(
+            job, LinkMap(), dest_cache, deep_cleaned=True, link_records=link_records
+        )
+        with timer.phase("clean"):
+            _plan_deep_clean(plan, candidate_dirs)
+        return plan
+    return SyncPlan(job, link_map, dest_cache, link_records=link_records)
+
+
+def plan_deep_clean(job: Job) -> SyncPlan:
+    """Compute the changes of a deep clean of the job's destination alone, see plan_job."""
+    candidate_dirs: Set[str] = set()
+    plan = _begin_plan(job, True, PhaseTimer(), candidate_dirs)
+    _plan_pruning(plan, candidate_dirs)
+    return plan
+
+
+def plan_job(
+    job: Job,
+    deep_clean: bool = False,
+    timer: Optional[PhaseTimer] = None,
+    full_rescan: bool = False,
+    shared_scan: Optional[SharedScan] = None,
+    sweep_when_due: bool = True,
+) -> SyncPlan:
+    """
+    Compute the changes a run of the job would make, without writing anything.
+
+    The destination is swept for broken symlinks if its link map hasn't been
+    built yet (or loaded from the state index), a deep clean is requested, or
+    one is due and sweep_when_due is set. Otherwise only the sources known to
+    the link map are checked for having vanished.
+
+    With a state index, source directories whose mtime is unchanged since the
+    last run are not listed again and their indexed files are not stat'ed,
+    unless a full rescan is requested. A deep clean still recreates the
+    links of indexed files that went missing from the destination.
+
+    With job.scan_processes above 1, the source folder is scanned and parsed
+    by a process pool (see _scan_sharded), unless a state index from a
+    previous run exists, since only changed files are parsed then.
+
+    Jobs scanning overlapping source folders during the same run can pass a
+    SharedScan, so the directories they have in common are listed once.
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    candidate_dirs: Set[str] = set()
+    plan = _begin_plan(job, deep_clean, timer, candidate_dirs, sweep_when_due)
+    parser = create_parser(job, plan.dest_cache)
+    if job.state_index:
+        with timer.phase("index"):
+            known_files, dir_listings = _load_index(job)
+        listings = SourceListings(dir_listings, reuse=not full_rescan)
+        if job.scan_processes > 1 and not known_files and not dir_listings:
+            # The initial sync of a new index
+            with timer.phase("scan"):
+                scanned_files = _scan_sharded(job, parser, listings)
+            with timer.phase("plan"):
+                for scanned in scanned_files:
+                    plan.num_scanned_files += 1
+                    _plan_index_entry(
+                        plan,
+                        scanned.src_path,
+                        scanned.stat_result,
+                        scanned.parsed_info,
+                        scanned.link_path,
+                    )
+        else:
+            files = timer.iterate(
+                find_media_files(
+                    job.src,
+                    job.file_type_regex,
+                    job.exclude_dirs,
+                    listings,
+                    shared_scan,
+                ),
+                "scan",
+            )
+            with timer.phase("plan"):
+                for file in files:
+                    plan.num_scanned_files += 1
+                    entry = known_files.pop(file, None)
+                    if entry is not None and os.path.dirname(file) in listings.reused:
+                        # Its directory is unchanged, so the file can't have been renamed
+                        _plan_missing_link(plan, entry)
+                        continue
+                    _plan_indexed_file(plan, parser, file, entry)
+        with timer.phase("plan"):
+            # Files that disappeared since the last run have their symlinks removed
+            for entry in known_files.values():
+                if entry.link_path and plan.points_to(entry.link_path, entry.src_path):
+                    plan.remove_link(entry.src_path, entry.link_path)
+                    candidate_dirs.add(os.path.dirname(entry.link_path))
+                plan.vanished_sources.append(entry.src_path)
+                plan.index_removals.append(entry.src_path)
+            plan.listing_updates, plan.listing_removals = listings.changes()
+    else:
+        found_files = set()
+        if job.scan_processes > 1:
+            with timer.phase("scan"):
+                scanned_files = _scan_sharded(job, parser, None)
+            with timer.phase("plan"):
+                for scanned in scanned_files:
+                    plan.num_scanned_files += 1
+                    found_files.add(os.path.abspath(scanned.src_path))
+                    if scanned.link_path is not None:
+                        _plan_link(plan, scanned.src_path, scanned.link_path)
+        else:
+            files = timer.iterate(
+                find_media_files(
+                    job.src,
+                    job.file_type_regex,
+                    job.exclude_dirs,
+                    shared_scan=shared_scan,
+                ),
+                "scan",
+            )
+            with timer.phase("plan"):
+                for file in files:
+                    plan.num_scanned_files += 1
+                    found_files.add(os.path.abspath(file))
+                    dest_path = parser.get_destination_path(file)
+                    if dest_path:
+                        _, link_path = get_relative_symlink_paths(file, dest_path)
+                        _plan_link(plan, file, link_path)
+        with timer.phase("plan"):
+            for src_file in plan.link_map.sources_under(job.src):
+                if src_file in found_files:
+                    continue
+                throttle()
+                if os.path.exists(src_file):
+                    continue
+                for symlink_location in plan.link_map.links_for(src_file):
+                    if plan.points_to(symlink_location, src_file):
+                        plan.remove_link(src_file, symlink_location)
+                        candidate_dirs.add(os.path.dirname(symlink_location))
+                plan.vanished_sources.append(src_file)
+
+    with timer.phase("plan"):
+        _plan_pruning(plan, candidate_dirs)
+    parser.report_parse_failures()
+    return plan
+
+
+def plan_changes(
+    job: Job, changes: List[FileChange], timer: Optional[PhaseTimer] = None
+) -> SyncPlan:
+    """
+    Compute the changes needed to apply a batch of watcher changes to a
+    single job, without writing anything (see apply_plan).
+
+    Created files are planned directly and created directories are scanned,
+    while deleted files and directories have only the links known for them
+    (through the state index, or else the link map) planned for removal, so
+    the source and destination trees are not walked. The destination is
+    still swept first when its link map needs a deep clean, like plan_job.
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    candidate_dirs: Set[str] = set()
+    plan = _begin_plan(job, False, timer, candidate_dirs)
+    parser = create_parser(job, plan.dest_cache)
+    index = None
+    if job.state_index and os.path.exists(StateIndex.path_for_job(job)):
+        index = StateIndex(StateIndex.path_for_job(job), read_only=True)
+        if not index.matches_job(job):
+            index.close()
+            index = None
+    # A new directory is reported along with the files created inside it
+    planned_files: Set[str] = set()
+    try:
+        for change in changes:
+            match change.change_type:
+                case "created":
+                    for file in _created_media_files(job, change):
+                        if file in planned_files:
+                            continue
+                        planned_files.add(file)
+                        plan.num_scanned_files += 1
+                        if job.state_index:
+                            entry = None if index is None else index.get(file)
+                            _plan_indexed_file(plan, parser, file, entry)
+                            continue
+                        dest_path = parser.get_destination_path(file)
+                        if dest_path:
+                            _, link_path = get_relative_symlink_paths(file, dest_path)
+                            _plan_link(plan, file, link_path)
+                case "deleted":
+                    if os.path.lexists(change.path):
+                        # Deleted and created again since the change was reported
+                        continue
+                    if job.state_index:
+                        _plan_deleted_entries(plan, index, change, candidate_dirs)
+                    else:
+                        _plan_deleted_sources(plan, change, candidate_dirs)
+    finally:
+        if index is not None:
+            index.close()
+
+    _plan_pruning(plan, candidate_dirs)
+    parser.report_parse_failures()
+    return plan
+
+
+def _created_media_files(job: Job, change: FileChange) -> List[str]:
+    """
+    Return the media files of a created file or directory, unless it is
+    excluded. Files are matched by name like find_media_files does.
+    """
+    if change.is_directory:
+        if is_excluded_dir(change.path, job.src, job.exclude_dirs):
+            return []
+        return list(
+            find_media_files(change.path, job.file_type_regex, job.exclude_dirs)
+        )
+    if is_excluded_dir(os.path.dirname(change.path), job.src, job.exclude_dirs):
+        return []
+    if not is_media_file(os.path.basename(change.path), job.file_type_regex):
+        return []
+    return [change.path]
+
+
+def _plan_deleted_entries(
+    plan: SyncPlan,
+    index: Optional[StateIndex],
+    change: FileChange,
+    candidate_dirs: Set[str],
+):
+    """Plan the removal of the links and index entries of a deleted file or directory."""
+    if index is None:
+        # Nothing is indexed yet with the job's settings
+        _plan_deleted_sources(plan, change, candidate_dirs)
+        return
+    if change.is_directory:
+        entries = list(index.entries_under(change.path))
+    else:
+        entry = index.get(change.path)
+        entries = [] if entry is None else [entry]
+    for entry in entries:
+        if entry.link_path and plan.points_to(entry.link_path, entry.src_path):
+            plan.remove_link(entry.src_path, entry.link_path)
+            candidate_dirs.add(os.path.dirname(entry.link_path))
+        plan.vanished_sources.append(entry.src_path)
+        plan.index_removals.append(entry.src_path)
+
+
+def _plan_deleted_sources(plan: SyncPlan, change: FileChange, candidate_dirs: Set[str]):
+    """Plan the removal of the links the link map knows for a deleted file or directory."""
+    if change.is_directory:
+        # The directory's contents can no longer be listed, so look up the
+        # links of everything that was below it
+        src_files = plan.link_map.sources_under(change.path)
+    else:
+        src_files = [change.path]
+    for src_file in src_files:
+        for link_path in plan.link_map.links_for(src_file):
+            if plan.points_to(link_path, src_file):
+                plan.remove_link(src_file, link_path)
+                candidate_dirs.add(os.path.dirname(link_path))
+        plan.vanished_sources.append(src_file)
+
+
+def _plan_indexed_file(
+    plan: SyncPlan, parser: BaseParser, src_file: str, entry: Optional[IndexedFile]
+):
+    """Plan the symlink and index entry of a source file, unless the index shows it is unchanged."""
+    throttle()
+    try:
+        stat_result = os.stat(src_file)
+    except FileNotFoundError:
+        return
+    if entry is not None and entry.matches_stat(stat_result):
+        _plan_missing_link(plan, entry)
+        return
+
+    parsed_info = parser.parse_info(src_file)
+    link_path = None
+    if parsed_info is not None:
+        dest_path = parser.build_destination_path(parsed_info)
+        _, link_path = get_relative_symlink_paths(src_file, dest_path)
+    _plan_index_entry(plan, src_file, stat_result, parsed_info, link_path)
+
+
+def _plan_missing_link(plan: SyncPlan, entry: IndexedFile):
+    """
+    Plan the link of an unchanged indexed file again if it was removed from
+    the destination. Only checked during a deep clean, which lists the whole
+    destination anyway.
+    """
+    if (
+        plan.deep_cleaned
+        and entry.link_path
+        and not plan.dest_cache.exists(entry.link_path)
+    ):
+        logger.info("Link '%s' is missing, creating it again", entry.link_path)
+        _plan_link(plan, entry.src_path, entry.link_path)
+
+
+def _plan_index_entry(
+    plan: SyncPlan,
+    src_file: str,
+    stat_result: os.stat_result,
+    parsed_info: Optional[ParsedInfo],
+    link_path: Optional[str],
+):
+    """Plan the symlink of a parsed source file, and its new index entry."""
+    if link_path is not None:
+        if not _plan_link(plan, src_file, link_path) and not plan.points_to(
+            link_path, src_file
+        ):
+            logger.warning(
+                "'%s' exists but was not created by linkarr... Skipping...", link_path
+            )
+            link_path = None
+
+    plan.index_updates.append(
+        IndexedFile(
+            src_path=src_file,
+            size=stat_result.st_size,
+            mtime_ns=stat_result.st_mtime_ns,
+            inode=stat_result.st_ino,
+            parsed_info=parsed_info,
+            link_path=link_path,
+        )
+    )
+
+
+def apply_plan(plan: SyncPlan) -> Tuple[int, int]:
+    """
+    Execute a plan: remove symlinks, prune the directories left empty, then
+    create the new symlinks, each in path order so work on a directory is
+    grouped together. The job's link map and state index are updated to match.
+
+    Returns the number of symlinks created and removed.
+    """
+    job = plan.job
+    link_map = plan.link_map
+    dest_cache = plan.dest_cache
+    os.makedirs(job.dest, exist_ok=True)
+
+    num_removed_symlinks = 0
+    forgotten_links = list(plan.forgotten_links)
+    for link in sorted(plan.links_to_remove, key=lambda link: link.link_path):
+        if link.src_path is not None:
+            link_map.remove(link.src_path)
+        record = plan.link_records.get(link.link_path)
+        if record is not None:
+            forgotten_links.append(link.link_path)
+        if not os.path.islink(link.link_path) and not (
+            record is not None and is_recorded_link(link.link_path, record)
+        ):
+            continue
+        remove_stale_link(link.link_path, job.link_mode)
+        dest_cache.discard(link.link_path)
+        num_removed_symlinks += 1
+    for src_file in plan.vanished_sources:
+        link_map.remove(src_file)
+
+    for dir_path in plan.dirs_to_prune:
+        try:
+            os.rmdir(dir_path)
+        except OSError as e:
+            logger.warning("Unable to remove dir %s: %s", dir_path, e)
+            continue
+        logger.warning("Deleting empty dir: %s", dir_path)
+        dest_cache.forget_directory(dir_path)
+
+    num_added_symlinks = 0
+    new_records = []
+    for link in sorted(plan.links_to_create, key=lambda link: link.link_path):
+        symlink_path = create_link(
+            link.src_path, os.path.dirname(link.link_path), dest_cache, job.link_mode
+        )
+        if symlink_path is not None:
+            link_map.add(link.src_path, symlink_path)
+            num_added_symlinks += 1
+            if job.link_mode != "symlink" and not os.path.islink(symlink_path):
+                stat_result = os.lstat(symlink_path)
+                new_records.append(
+                    LinkRecord(
+                        symlink_path,
+                        link.src_path,
+                        stat_result.st_dev,
+                        stat_result.st_ino,
+                    )
+                )
+
+    if job.state_index and (
+        plan.deep_cleaned
+        or plan.index_updates
+        or plan.index_removals
+        or plan.listing_updates
+        or plan.listing_removals
+        or forgotten_links
+        or new_records
+    ):
+        with StateIndex.for_job(job) as index:
+            # Removed paths may have been linked again, so records are forgotten first
+            for link_path in forgotten_links:
+                index.remove_link(link_path)
+            for record in new_records:
+                index.put_link(record)
+            for entry in plan.index_updates:
+                if entry.link_path is not None:
+                    link_map.add(entry.src_path, entry.link_path)
+                index.put(entry)
+            for src_file in plan.index_removals:
+                index.remove(src_file)
+            for dir_path, listing in plan.listing_updates.items():
+                index.put_dir_listing(dir_path, listing)
+            for dir_path in plan.listing_removals:
+                index.remove_dir_listing(dir_path)
+            if plan.deep_cleaned:
+                index.set_last_deep_clean(link_map.last_deep_clean)
+
+    if plan.deep_cleaned:
+        set_link_map(job.dest, link_map)
+    return num_added_symlinks, num_removed_symlinks
@@ -0,0 +1,245 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+from linkarr.metrics import RUN_DURATION, job_label
+from linkarr.models import Job
+
+T = TypeVar("T")
+
+# Filesystem calls counted while profiling. Calls made through os.path and
+# shutil are included since they look these functions up on the os module.
+SYSCALLS = (
+    "scandir",
+    "listdir",
+    "stat",
+    "lstat",
+    "readlink",
+    "symlink",
+    "makedirs",
+    "mkdir",
+    "unlink",
+    "rmdir",
+)
+
+
+class PhaseTimer:
+    """
+    Accumulate wall-clock and CPU time per phase of a job run.
+
+    Phases can be nested, in which case time spent in the inner phase is not
+    counted towards the outer one.
+    """
+
+    def __init__(self):
+        self.wall: Dict[str, float] = defaultdict(float)
+        self.cpu: Dict[str, float] = defaultdict(float)
+        self._start_wall = time.perf_counter()
+        self._stack: List[str] = []
+        self._mark = (self._start_wall, time.thread_time())
+
+    def _charge(self):
+        now = (time.perf_counter(), time.thread_time())
+        if self._stack:
+            phase = self._stack[-1]
+            self.wall[phase] += now[0] - self._mark[0]
+            self.cpu[phase] += now[1] - self._mark[1]
+        self._mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as the given phase."""
+        self._charge()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self._stack.pop()
+
+    def iterate(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """Yield the items of iterable, timing the work of producing them as the given phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, job: Job):
+        """Report the phase durations of a job run to the metrics and any active profile."""
+        total = time.perf_counter() - self._start_wall
+        label = job_label(job)
+        for phase, seconds in self.wall.items():
+            RUN_DURATION.observe(seconds, job=label, phase=phase)
+        RUN_DURATION.observe(total, job=label, phase="total")
+
+        profile = _active_profile
+        if profile is not None:
+            profile.add_phases(label, self.wall, self.cpu, total)
+
+
+class _JobProfile:
+    """Costs collected for a single job while profiling."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.wall: Dict[str, float] = defaultdict(float)
+        self.cpu: Dict[str, float] = defaultdict(float)
+        self.syscall_counts: Dict[str, int] = defaultdict(int)
+        self.syscall_seconds: Dict[str, float] = defaultdict(float)
+
+
+class RunProfile:
+    """
+    Per-job phase timings, filesystem call counts and optionally a cProfile
+    of a run, collected while the profile is active (see profile_run).
+    """
+
+    def __init__(self, use_cprofile: bool = True):
+        self.use_cprofile = use_cprofile
+        self.jobs: Dict[str, _JobProfile] = defaultdict(_JobProfile)
+        self.stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def add_phases(
+        self, label: str, wall: Dict[str, float], cpu: Dict[str, float], total: float
+    ):
+        with self._lock:
+            job_profile = self.jobs[label]
+            job_profile.total += total
+            for phase in wall:
+                job_profile.wall[phase] += wall[phase]
+                job_profile.cpu[phase] += cpu[phase]
+
+    def add_syscalls(
+        self, label: str, counts: Dict[str, int], seconds: Dict[str, float]
+    ):
+        with self._lock:
+            job_profile = self.jobs[label]
+            for name, count in counts.items():
+                job_profile.syscall_counts[name] += count
+                job_profile.syscall_seconds[name] += seconds[name]
+
+    def add_stats(self, profiler: cProfile.Profile):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+
+    def report(self, top: int = 15) -> str:
+        """Return a human readable report of the costliest phases, calls and functions per job."""
+        lines = []
+        for label, job_profile in self.jobs.items():
+            lines.append(f"Job {label}: {job_profile.total:.3f}s")
+            lines.append(f"  {'phase':<24}{'wall':>10}{'cpu':>10}")
+            for phase, wall in sorted(
+                job_profile.wall.items(), key=lambda item: -item[1]
+            ):
+                lines.append(
+                    f"  {phase:<24}{wall:>9.3f}s{job_profile.cpu[phase]:>9.3f}s"
+                )
+            if job_profile.syscall_counts:
+                lines.append(f"  {'filesystem call':<24}{'calls':>10}{'wall':>10}")
+                for name, seconds in sorted(
+                    job_profile.syscall_seconds.items(), key=lambda item: -item[1]
+                ):
+                    lines.append(
+                        f"  {name:<24}{job_profile.syscall_counts[name]:>10}{seconds:>9.3f}s"
+                    )
+            lines.append("")
+
+        if self.stats is not None:
+            output = io.StringIO()
+            self.stats.stream = output
+            self.stats.sort_stats("cumulative").print_stats(top)
+            lines.append(f"Top {top} functions by cumulative time (all jobs):")
+            lines.append(output.getvalue().strip())
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Write the raw cProfile stats to path, for use with pstats or snakeviz."""
+        if self.stats is None:
+            raise ValueError("No cProfile stats were collected")
+        self.stats.dump_stats(path)
+
+
+_active_profile: Optional[RunProfile] = None
+_syscall_stats = threading.local()
+
+
+def _counting(name: str, function):
+    def wrapper(*args, **kwargs):
+        counts = getattr(_syscall_stats, "counts", None)
+        if counts is None:
+            return function(*args, **kwargs)
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counts[name] += 1
+            _syscall_stats.seconds[name] += time.perf_counter() - start_time
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+@contextmanager
+def profile_run(use_cprofile: bool = True):
+    """
+    Collect a RunProfile for the jobs processed within this block.
+
+    Filesystem calls on the os module are wrapped to count them for the
+    duration of the block, so this is meant for one-off runs only.
+    """
+    global _active_profile
+    if _active_profile is not None:
+        raise RuntimeError("A profile is already active")
+
+    profile = RunProfile(use_cprofile)
+    originals = {name: getattr(os, name) for name in SYSCALLS}
+    for name, function in originals.items():
+        setattr(os, name, _counting(name, function))
+    _active_profile = profile
+    try:
+        yield profile
+    finally:
+        _active_profile = None
+        for name, function in originals.items():
+            setattr(os, name, function)
+
+
+@contextmanager
+def profile_job(job: Job):
+    """
+    Attribute the filesystem calls and cProfile stats of the enclosed block,
+    run on the current thread, to the job. Does nothing unless a profile is active.
+    """
+    profile = _active_profile
+    if profile is None:
+        yield
+        return
+
+    _syscall_stats.counts = defaultdict(int)
+    _syscall_stats.seconds = defaultdict(float)
+    profiler = cProfile.Profile() if profile.use_cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile.add_stats(profiler)
+        profile.add_syscalls(
+            job_label(job), _syscall_stats.counts, _syscall_stats.seconds
+        )
+        _syscall_stats.counts = None
@@ -0,0 +1,92 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from linkarr.models import Config, Job
+
+
+class _Node:
+    """A path component in a JobRouter, with the jobs whose source folder ends there."""
+
+    __slots__ = ("children", "jobs")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.jobs: List[Job] = []
+
+
+def _components(path: str) -> List[str]:
+    return [name for name in os.path.abspath(path).split(os.sep) if name]
+
+
+class JobRouter:
+    """
+    Index of jobs by the path components of their source folder.
+
+    A changed path is routed to every job whose source folder contains it,
+    walking one trie node per component of the path, so routing doesn't
+    depend on the number of jobs. Jobs sharing a source folder, or with
+    source folders nested inside one another, all receive the path.
+    """
+
+    def __init__(self, jobs: Iterable[Job]):
+        self._jobs = list(jobs)
+        self._root = _Node()
+        for job in self._jobs:
+            node = self._root
+            for name in _components(job.src):
+                node = node.children.setdefault(name, _Node())
+            node.jobs.append(job)
+
+    def jobs_for(self, path: str) -> List[Job]:
+        """Return the jobs whose source folder is path or one of its parents, outermost first."""
+        node = self._root
+        jobs = list(node.jobs)
+        for name in _components(path):
+            node = node.children.get(name)
+            if node is None:
+                break
+            jobs.extend(node.jobs)
+        return jobs
+
+    def jobs_under(self, path: str) -> List[Job]:
+        """Return the jobs whose source folder is path or inside it, in config order."""
+        node = self._root
+        for name in _components(path):
+            node = node.children.get(name)
+            if node is None:
+                return []
+        found = set()
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            found.update(id(job) for job in node.jobs)
+            pending.extend(node.children.values())
+        return [job for job in self._jobs if id(job) in found]
+
+    def roots(self) -> Dict[str, List[Job]]:
+        """
+        Return the outermost source folders, which contain every other one,
+        along with the jobs below each of them in config order.
+        """
+        roots: Dict[str, List[Job]] = {}
+        for job in self._jobs:
+            outermost = self.jobs_for(job.src)[0]
+            roots.setdefault(os.path.abspath(outermost.src), []).append(job)
+        return roots
+
+
+# The router of the most recently routed config
+_cached_router: Optional[Tuple[Config, JobRouter]] = None
+_cached_router_lock = threading.Lock()
+
+
+def router_for(config: Config) -> JobRouter:
+    """Return a router of the config's enabled jobs, built once per config."""
+    global _cached_router
+    with _cached_router_lock:
+        cached = _cached_router
+        if cached is not None and cached[0] is config:
+            return cached[1]
+        router = JobRouter(job for job in config.jobs if job.enabled)
+        _cached_router = (config, router)
+        return router
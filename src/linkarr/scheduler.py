@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+from typing import Callable, Collection, Container, Dict, List, Optional, Tuple
+from linkarr.helpers import compile_exclude_patterns, logger
+from linkarr.metrics import (
+    EVENT_QUEUE_DEPTH,
+    EVENTS_COALESCED,
+    SETTLING_PATHS,
+    WATCH_EVENTS,
+)
+from linkarr.models import FileChange
+
+
+class _PendingBatch:
+    """Changes collected for a single watched folder that have not been processed yet."""
+
+    def __init__(self, now: float):
+        self.changes: Dict[str, FileChange] = {}
+        self.num_events = 0
+        self.first_event_time = now
+        self.last_event_time = now
+        self.overflowed = False
+
+
+class ChangeScheduler:
+    """
+    Coalesce watcher changes per folder until they are due to be processed.
+
+    Changes for a folder are held until no new change arrived for
+    `quiet_seconds`, or until the oldest one has waited `max_delay_seconds`.
+    Repeated changes to the same path are merged into the latest one. If more
+    than `max_pending` distinct paths pile up for a folder, the individual
+    changes are dropped and the folder is fully reconciled instead.
+
+    The scheduler doesn't process anything itself: a loop asks next_due which
+    folder comes next and takes its changes once they are due.
+    """
+
+    def __init__(
+        self,
+        quiet_seconds: float = 2.0,
+        max_delay_seconds: float = 30.0,
+        max_pending: int = 10000,
+    ):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_pending = max_pending
+
+        # Number of events merged away in the most recent run for each folder
+        self.last_coalesced: Dict[str, int] = {}
+        self.total_coalesced = 0
+
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, folder: str, changes: List[FileChange]):
+        """Queue changes for a folder. Safe to call from the watcher thread."""
+        with self._lock:
+            now = time.monotonic()
+            batch = self._pending.get(folder)
+            if batch is None:
+                batch = self._pending[folder] = _PendingBatch(now)
+            batch.last_event_time = now
+            batch.num_events += len(changes)
+            WATCH_EVENTS.inc(len(changes))
+            if not batch.overflowed:
+                for change in changes:
+                    # Re-insert so the batch keeps the order of the latest changes
+                    batch.changes.pop(change.path, None)
+                    batch.changes[change.path] = change
+                if len(batch.changes) > self.max_pending:
+                    logger.warning(
+                        "More than %d pending changes for %s, falling back to a full run",
+                        self.max_pending,
+                        folder,
+                    )
+                    batch.changes.clear()
+                    batch.overflowed = True
+            self._update_queue_depth()
+
+    def request_full_run(self, folder: str):
+        """Queue a full run of a folder, replacing any pending changes."""
+        with self._lock:
+            batch = self._pending.get(folder)
+            if batch is None:
+                batch = self._pending[folder] = _PendingBatch(time.monotonic())
+            batch.changes.clear()
+            batch.overflowed = True
+            self._update_queue_depth()
+
+    def discard(self, folder: str):
+        """Drop the pending changes of a folder that is no longer watched."""
+        with self._lock:
+            self._pending.pop(folder, None)
+            self._update_queue_depth()
+
+    def drop_full_runs(self) -> List[str]:
+        """Drop the folders queued for a full run, returning them."""
+        with self._lock:
+            folders = [
+                folder for folder, batch in self._pending.items() if batch.overflowed
+            ]
+            for folder in folders:
+                del self._pending[folder]
+            self._update_queue_depth()
+        return folders
+
+    def has_pending(self) -> bool:
+        """Check if any folder has changes waiting to be processed."""
+        with self._lock:
+            return bool(self._pending)
+
+    def next_due(
+        self, exclude: Container[str] = (), immediately: bool = False
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Return the folder whose changes are due first, ignoring those in
+        exclude, and the seconds until they are due (0 if they are due now or
+        immediately is set). Returns None if no such folder has changes.
+        """
+        with self._lock:
+            candidates = [
+                item for item in self._pending.items() if item[0] not in exclude
+            ]
+            if not candidates:
+                return None
+            folder, batch = min(candidates, key=lambda item: self._deadline(item[1]))
+            if immediately:
+                return folder, 0.0
+            return folder, max(0.0, self._deadline(batch) - time.monotonic())
+
+    def take(self, folder: str) -> Optional[List[FileChange]]:
+        """
+        Remove and return the pending changes of a folder, or None if the
+        folder needs a full run instead.
+        """
+        with self._lock:
+            batch = self._pending.pop(folder)
+            self._update_queue_depth()
+
+        changes = None if batch.overflowed else list(batch.changes.values())
+        num_coalesced = batch.num_events - (0 if changes is None else len(changes))
+        self.last_coalesced[folder] = num_coalesced
+        self.total_coalesced += num_coalesced
+        EVENTS_COALESCED.inc(num_coalesced)
+        logger.info(
+            "Processing %d event(s) for %s (%d coalesced)",
+            batch.num_events,
+            folder,
+            num_coalesced,
+        )
+        return changes
+
+    def _update_queue_depth(self):
+        EVENT_QUEUE_DEPTH.set(
+            sum(len(batch.changes) for batch in self._pending.values())
+        )
+
+    def _deadline(self, batch: _PendingBatch) -> float:
+        return min(
+            batch.last_event_time + self.quiet_seconds,
+            batch.first_event_time + self.max_delay_seconds,
+        )
+
+
+def _settle_signature(path: str, is_directory: bool) -> Optional[Tuple[int, int, int]]:
+    """
+    Return what changes while a path is being written: the size and mtime of
+    a file, or the number, total size and latest mtime of the files below a
+    directory. Returns None if the path is gone.
+    """
+    try:
+        if not is_directory:
+            stat_result = os.stat(path)
+            return 1, stat_result.st_size, stat_result.st_mtime_ns
+        if not os.path.isdir(path):
+            return None
+        num_files = total_size = latest_mtime_ns = 0
+        for dir_path, _, file_names in os.walk(path):
+            for name in file_names:
+                try:
+                    stat_result = os.stat(os.path.join(dir_path, name))
+                except OSError:
+                    continue
+                num_files += 1
+                total_size += stat_result.st_size
+                latest_mtime_ns = max(latest_mtime_ns, stat_result.st_mtime_ns)
+        return num_files, total_size, latest_mtime_ns
+    except OSError:
+        return None
+
+
+class _SettlingPath:
+    """A created path held by a SettleGate, and when it was last seen changing."""
+
+    __slots__ = ("folder", "change", "signature", "stable_since")
+
+    def __init__(self, folder: str, change: FileChange, now: float):
+        self.folder = folder
+        self.change = change
+        self.signature: Optional[Tuple[int, int, int]] = None
+        self.stable_since = now
+
+
+class SettleGate:
+    """
+    Hold watcher changes for new files until they stop being written.
+
+    Download clients create a file and then write to it for minutes, often
+    under a temporary name they rename once done. Changes to paths matching
+    one of the in_progress_patterns (or inside a matching directory) are
+    dropped. Created files and directories are held until check has seen
+    their size and mtime (for a directory, those of the files below it)
+    unchanged for `settle_seconds`, and are then passed to on_release, so
+    each file is processed once, when complete. Other changes are passed on
+    right away, and a deletion also drops the held paths it covers.
+
+    check only stats the held paths, and should be called every
+    `check_interval` seconds while has_pending is true.
+    """
+
+    def __init__(
+        self,
+        on_release: Callable[[str, List[FileChange]], None],
+        settle_seconds: float = 5.0,
+        in_progress_patterns: Collection[str] = (),
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.on_release = on_release
+        self.settle_seconds = settle_seconds
+        self.check_interval = settle_seconds / 2
+        self._in_progress_pattern = compile_exclude_patterns(in_progress_patterns)
+        self._clock = clock
+        self._pending: Dict[str, _SettlingPath] = {}
+        self._lock = threading.Lock()
+
+    def _is_in_progress(self, folder: str, path: str) -> bool:
+        if self._in_progress_pattern is None:
+            return False
+        rel_path = os.path.relpath(path, folder)
+        if rel_path.startswith(os.pardir):
+            rel_path = os.path.basename(path)
+        return any(
+            self._in_progress_pattern.match(name) for name in rel_path.split(os.sep)
+        )
+
+    def submit(self, folder: str, changes: List[FileChange]):
+        """Filter and hold changes to a watched folder. Safe to call from any thread."""
+        released = []
+        with self._lock:
+            now = self._clock()
+            for change in changes:
+                if self._is_in_progress(folder, change.path):
+                    logger.debug("Ignoring in-progress path: %s", change.path)
+                    continue
+                if change.change_type == "created" and self.settle_seconds > 0:
+                    self._pending[change.path] = _SettlingPath(folder, change, now)
+                    continue
+                if change.change_type == "deleted":
+                    self._forget(change.path)
+                released.append(change)
+            SETTLING_PATHS.set(len(self._pending))
+        if released:
+            self.on_release(folder, released)
+
+    def _forget(self, path: str):
+        prefix = os.path.join(path, "")
+        for held_path in [held for held in self._pending if held.startswith(prefix)]:
+            del self._pending[held_path]
+        self._pending.pop(path, None)
+
+    def has_pending(self) -> bool:
+        """Check if any path is being held."""
+        with self._lock:
+            return bool(self._pending)
+
+    def check(self):
+        """
+        Stat the held paths, and release those unchanged for settle_seconds.
+        Paths that vanished are dropped, as their deletion is reported as well.
+        """
+        with self._lock:
+            held = list(self._pending.items())
+        # Stat without the lock, so watcher threads aren't held up
+        signatures = [
+            _settle_signature(path, settling.change.is_directory)
+            for path, settling in held
+        ]
+
+        released: Dict[str, List[FileChange]] = {}
+        with self._lock:
+            now = self._clock()
+            for (path, settling), signature in zip(held, signatures):
+                if self._pending.get(path) is not settling:
+                    # Deleted or created again while it was being checked
+                    continue
+                if signature is None:
+                    del self._pending[path]
+                elif signature != settling.signature:
+                    settling.signature = signature
+                    settling.stable_since = now
+                elif now - settling.stable_since >= self.settle_seconds:
+                    del self._pending[path]
+                    released.setdefault(settling.folder, []).append(settling.change)
+            SETTLING_PATHS.set(len(self._pending))
+        for folder, changes in released.items():
+            self.on_release(folder, changes)
+
+    def release_all(self):
+        """Release every held path right away, e.g. when shutting down."""
+        released: Dict[str, List[FileChange]] = {}
+        with self._lock:
+            for settling in self._pending.values():
+                released.setdefault(settling.folder, []).append(settling.change)
+            self._pending.clear()
+            SETTLING_PATHS.set(0)
+        for folder, changes in released.items():
+            self.on_release(folder, changes)
@@ -0,0 +1,646 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from linkarr.helpers import list_directory
+from linkarr.models import (
+    Config,
+    DirListing,
+    IndexedFile,
+    Job,
+    LinkRecord,
+    MovieInfo,
+    ParsedInfo,
+    TVShowInfo,
+)
+from linkarr.throttle import throttle
+
+# Parsed info is stored as JSON, tagged with the kind of media it describes
+_INFO_TYPES = {
+    "tv": TVShowInfo,
+    "movie": MovieInfo,
+}
+
+
+def _encode_info(parsed_info: Optional[ParsedInfo]) -> Optional[str]:
+    if parsed_info is None:
+        return None
+    for kind, info_type in _INFO_TYPES.items():
+        if isinstance(parsed_info, info_type):
+            return json.dumps({"kind": kind, **asdict(parsed_info)})
+    raise TypeError(f"Cannot index parsed info of type {type(parsed_info).__name__}")
+
+
+def _decode_info(raw: Optional[str]) -> Optional[ParsedInfo]:
+    if raw is None:
+        return None
+    fields = json.loads(raw)
+    info_type = _INFO_TYPES[fields.pop("kind")]
+    if info_type is TVShowInfo:
+        # Indexes written by older versions store zero padded strings
+        return TVShowInfo(
+            sys.intern(fields["series_name"]),
+            int(fields["season_number"]),
+            int(fields["episode_number"]),
+        )
+    return MovieInfo(sys.intern(fields["title"]), sys.intern(fields["year"]))
+
+
+def _job_key(job: Job) -> str:
+    """Identify a job by its media type and source, for naming its files in the destination."""
+    return hashlib.sha1(f"{job.media_type}:{job.src}".encode()).hexdigest()[:12]
+
+
+def _matching_settings(job: Job) -> str:
+    """Return the job settings deciding which source files are indexed, as stored by the index."""
+    return json.dumps(
+        {"file_type_regex": job.file_type_regex, "exclude_dirs": job.exclude_dirs}
+    )
+
+
+class StateIndex:
+    """
+    Persistent SQLite index of a job's source files, their parsed information
+    and the symlinks created for them, along with the hardlinks and reflinks
+    created (see LinkRecord).
+
+    The files and directory listings are only valid for the job settings
+    that decide which files match, so they are dropped once those change
+    (see for_job and matches_job). Link records are kept.
+    """
+
+    SCHEMA_VERSION = 4
+
+    def __init__(self, db_path: str, read_only: bool = False):
+        """Open (and create if needed) the index at db_path."""
+        self.db_path = db_path
+        if read_only:
+            # Used to plan a run without touching the disk; the index must exist
+            self._connection = sqlite3.connect(
+                f"file:{db_path}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        # The index may be opened by the main thread and used by the scheduler worker
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                src_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                parsed_info TEXT,
+                link_path TEXT
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                dir_path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                file_names TEXT NOT NULL,
+                dir_names TEXT NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS links (
+                link_path TEXT PRIMARY KEY,
+                src_path TEXT NOT NULL,
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS settings (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            """
+        )
+        self._connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    @staticmethod
+    def path_for_job(job: Job) -> str:
+        """Return the index location for a job, inside its destination folder."""
+        return os.path.join(job.dest, f".linkarr-{job.media_type}-{_job_key(job)}.db")
+
+    @classmethod
+    def for_job(cls, job: Job) -> "StateIndex":
+        """
+        Open the index belonging to a job, dropping its files and directory
+        listings if they were indexed with other matching settings.
+        """
+        index = cls(cls.path_for_job(job))
+        if not index.matches_job(job):
+            index._connection.execute("DELETE FROM files")
+            index._connection.execute("DELETE FROM dirs")
+            index._connection.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('matching', ?)",
+                (_matching_settings(job),),
+            )
+        return index
+
+    def matches_job(self, job: Job) -> bool:
+        """Check if the indexed files were matched with the job's current settings."""
+        try:
+            row = self._connection.execute(
+                "SELECT value FROM settings WHERE name = 'matching'"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # A read-only index created before settings were stored
+            return False
+        return row is not None and row[0] == _matching_settings(job)
+
+    def __enter__(self) -> "StateIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    @staticmethod
+    def _row_to_entry(row) -> IndexedFile:
+        src_path, size, mtime_ns, inode, parsed_info, link_path = row
+        return IndexedFile(
+            src_path=src_path,
+            size=size,
+            mtime_ns=mtime_ns,
+            inode=inode,
+            parsed_info=_decode_info(parsed_info),
+            link_path=link_path,
+        )
+
+    def entries(self) -> Dict[str, IndexedFile]:
+        """Return every indexed file keyed by its source path."""
+        rows = self._connection.execute("SELECT * FROM files")
+        return {row[0]: self._row_to_entry(row) for row in rows}
+
+    def get(self, src_path: str) -> Optional[IndexedFile]:
+        """Return the entry for a source path, or None if it isn't indexed."""
+        row = self._connection.execute(
+            "SELECT * FROM files WHERE src_path = ?", (src_path,)
+        ).fetchone()
+        return None if row is None else self._row_to_entry(row)
+
+    def entries_under(self, dir_path: str) -> Iterator[IndexedFile]:
+        """Yield every indexed file below a source directory."""
+        prefix = os.path.join(dir_path, "")
+        rows = self._connection.execute(
+            "SELECT * FROM files WHERE substr(src_path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        for row in rows.fetchall():
+            yield self._row_to_entry(row)
+
+    def put(self, entry: IndexedFile):
+        """Insert or replace an entry."""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                entry.src_path,
+                entry.size,
+                entry.mtime_ns,
+                entry.inode,
+                _encode_info(entry.parsed_info),
+                entry.link_path,
+            ),
+        )
+
+    def remove(self, src_path: str):
+        """Remove the entry for a source path."""
+        self._connection.execute("DELETE FROM files WHERE src_path = ?", (src_path,))
+
+    def dir_listings(self) -> Dict[str, DirListing]:
+        """Return the source directory listings of the last run keyed by directory."""
+        try:
+            rows = self._connection.execute("SELECT * FROM dirs").fetchall()
+        except sqlite3.OperationalError:
+            # A read-only index created before directory listings were stored
+            return {}
+        return {
+            dir_path: DirListing(
+                mtime_ns, json.loads(file_names), json.loads(dir_names)
+            )
+            for dir_path, mtime_ns, file_names, dir_names in rows
+        }
+
+    def put_dir_listing(self, dir_path: str, listing: DirListing):
+        """Insert or replace the listing of a source directory."""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+            (
+                dir_path,
+                listing.mtime_ns,
+                json.dumps(listing.file_names),
+                json.dumps(listing.dir_names),
+            ),
+        )
+
+    def remove_dir_listing(self, dir_path: str):
+        """Remove the listing of a source directory."""
+        self._connection.execute("DELETE FROM dirs WHERE dir_path = ?", (dir_path,))
+
+    def links(self) -> Dict[str, LinkRecord]:
+        """Return the recorded hardlinks and reflinks keyed by their path."""
+        try:
+            rows = self._connection.execute("SELECT * FROM links").fetchall()
+        except sqlite3.OperationalError:
+            # A read-only index created before links were recorded
+            return {}
+        return {row[0]: LinkRecord(*row) for row in rows}
+
+    def put_link(self, record: LinkRecord):
+        """Insert or replace the record of a hardlink or reflink."""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)",
+            (record.link_path, record.src_path, record.dev, record.inode),
+        )
+
+    def remove_link(self, link_path: str):
+        """Forget the record of a hardlink or reflink."""
+        self._connection.execute("DELETE FROM links WHERE link_path = ?", (link_path,))
+
+    def last_deep_clean(self) -> Optional[float]:
+        """Return when the destination was last swept (see LinkMap), or None if never."""
+        try:
+            row = self._connection.execute(
+                "SELECT value FROM settings WHERE name = 'last_deep_clean'"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # A read-only index created before settings were stored
+            return None
+        return None if row is None else float(row[0])
+
+    def set_last_deep_clean(self, timestamp: float):
+        """Record when the destination was last swept."""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO settings VALUES ('last_deep_clean', ?)",
+            (repr(timestamp),),
+        )
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class LinkMap:
+    """
+    In-memory reverse map from source files to the symlinks created for them
+    in a destination folder.
+
+    It is filled by a full sweep of the destination (a "deep clean") and kept
+    up to date while linking, so later cleanups only have to look at sources
+    that vanished instead of walking the whole destination.
+
+    A new process can instead load the map from a job's state index, which
+    records the time of the last sweep. Such a map only holds the links of
+    that job, so it is not complete.
+    """
+
+    def __init__(self, last_deep_clean: Optional[float] = None, complete: bool = True):
+        self._links: Dict[str, Set[str]] = {}
+        # Wall-clock time, as it is persisted across runs
+        self.last_deep_clean = (
+            time.time() if last_deep_clean is None else last_deep_clean
+        )
+        self.complete = complete
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def add(self, src_file: str, symlink_location: str):
+        """Record a symlink pointing at src_file."""
+        self._links.setdefault(os.path.abspath(src_file), set()).add(symlink_location)
+
+    def remove(self, src_file: str):
+        """Forget every symlink recorded for src_file."""
+        self._links.pop(os.path.abspath(src_file), None)
+
+    def links_for(self, src_file: str) -> Set[str]:
+        """Return the symlinks recorded for src_file."""
+        return set(self._links.get(os.path.abspath(src_file), ()))
+
+    def sources_under(self, dir_path: str) -> List[str]:
+        """Return every recorded source file below dir_path."""
+        prefix = os.path.join(os.path.abspath(dir_path), "")
+        return [src_file for src_file in self._links if src_file.startswith(prefix)]
+
+    def deep_clean_due(self, interval_hours: float) -> bool:
+        """Check if the last full sweep of the destination is older than interval_hours."""
+        return time.time() - self.last_deep_clean >= interval_hours * 3600
+
+
+# Link maps of the destination folders seen by this process, built lazily
+_link_maps: Dict[str, LinkMap] = {}
+
+
+def get_link_map(dest_path: str) -> Optional[LinkMap]:
+    """Return the link map for a destination folder, or None if it hasn't been built yet."""
+    return _link_maps.get(os.path.abspath(dest_path))
+
+
+def set_link_map(dest_path: str, link_map: LinkMap):
+    """Store the link map for a destination folder."""
+    _link_maps[os.path.abspath(dest_path)] = link_map
+
+
+class SourceListings:
+    """
+    Listings of a job's source directories: those of the previous run, which
+    are reused for directories whose mtime is unchanged, and those of the
+    current walk.
+    """
+
+    def __init__(
+        self, previous: Optional[Dict[str, DirListing]] = None, reuse: bool = True
+    ):
+        """Set reuse to False to list every directory again, while still recording them."""
+        self.previous: Dict[str, DirListing] = previous or {}
+        self.reuse_previous = reuse
+        self.current: Dict[str, DirListing] = {}
+        self.reused: Set[str] = set()
+
+    def reuse(self, dir_path: str, mtime_ns: int) -> Optional[DirListing]:
+        """Return the previous listing of a directory if its mtime is unchanged."""
+        listing = self.previous.get(dir_path)
+        if not self.reuse_previous or listing is None or listing.mtime_ns != mtime_ns:
+            return None
+        self.current[dir_path] = listing
+        self.reused.add(dir_path)
+        return listing
+
+    def record(self, dir_path: str, listing: DirListing):
+        """Record a directory that was listed during the current walk."""
+        self.current[dir_path] = listing
+
+    def changes(self) -> Tuple[Dict[str, DirListing], List[str]]:
+        """Return the listings that are new or changed since the previous run, and the directories that vanished."""
+        updates = {
+            dir_path: listing
+            for dir_path, listing in self.current.items()
+            if self.previous.get(dir_path) != listing
+        }
+        removals = [
+            dir_path for dir_path in self.previous if dir_path not in self.current
+        ]
+        return updates, removals
+
+
+class SharedScan:
+    """
+    Listings of source directories shared by the jobs of a run whose source
+    folders overlap, so each directory is listed once however many jobs
+    scan it, each job filtering the names with its own file_type_regex and
+    exclude_dirs. Thread safe: a job needing a directory another job is
+    listing waits for that listing rather than making its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # The mtime and listing of each directory, once listed
+        self._listings: Dict[str, Future] = {}
+
+    def listing(
+        self, dir_path: str, listings: Optional[SourceListings] = None
+    ) -> DirListing:
+        """
+        Return the listing of a directory, listing it unless a job already
+        did during this run. With the job's SourceListings, its previous
+        listing is reused if the directory is unchanged, and the listing is
+        recorded in them. Raises OSError if the directory can't be listed.
+        """
+        with self._lock:
+            future = self._listings.get(dir_path)
+            owner = future is None
+            if owner:
+                future = self._listings[dir_path] = Future()
+        if owner:
+            try:
+                throttle()
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+                listing = (
+                    None if listings is None else listings.reuse(dir_path, mtime_ns)
+                )
+                if listing is None:
+                    listing = list_directory(dir_path, mtime_ns)
+                    if listings is not None:
+                        listings.record(dir_path, listing)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            future.set_result((mtime_ns, listing))
+            return listing
+
+        mtime_ns, listing = future.result()
+        if listings is not None and listings.reuse(dir_path, mtime_ns) is None:
+            listings.record(dir_path, listing)
+        return listing
+
+
+class DestinationLocks:
+    """
+    Locks serializing work on destination folders. Folders that are equal or
+    nested inside one another share a lock, since their cleanups overlap.
+    """
+
+    def __init__(
+        self, dest_paths: Iterable[str], previous: Optional["DestinationLocks"] = None
+    ):
+        """
+        Group the destination folders, reusing the locks previous had for the
+        outermost ones, so work started with the previous locks still excludes
+        work on the same folders started with these.
+        """
+        self._locks: Dict[str, threading.Lock] = {}
+        # Visit outer folders before the folders nested inside them
+        for dest_path in sorted(
+            {os.path.abspath(path) for path in dest_paths}, key=len
+        ):
+            outer_path = self._find_outer(dest_path)
+            if outer_path is not None:
+                self._locks[dest_path] = self._locks[outer_path]
+            elif previous is not None and dest_path in previous._locks:
+                self._locks[dest_path] = previous._locks[dest_path]
+            else:
+                self._locks[dest_path] = threading.Lock()
+
+    def _find_outer(self, dest_path: str) -> Optional[str]:
+        for known_path in self._locks:
+            if dest_path == known_path or dest_path.startswith(known_path + os.sep):
+                return known_path
+        return None
+
+    def lock_for(self, dest_path: str) -> threading.Lock:
+        """Return the lock guarding a destination folder."""
+        return self._locks[os.path.abspath(dest_path)]
+
+
+# The destination locks of the most recently used config
+_cached_locks: Optional[Tuple[Config, DestinationLocks]] = None
+_cached_locks_lock = threading.Lock()
+
+
+def locks_for(config: Config) -> DestinationLocks:
+    """
+    Return the locks of the config's destination folders, built once per
+    config. The locks of a reloaded config carry over those of the previous
+    one (see DestinationLocks).
+    """
+    global _cached_locks
+    # Workers of a new config must all get the same locks
+    with _cached_locks_lock:
+        cached = _cached_locks
+        if cached is not None and cached[0] is config:
+            return cached[1]
+        locks = DestinationLocks(
+            (job.dest for job in config.jobs), None if cached is None else cached[1]
+        )
+        _cached_locks = (config, locks)
+        return locks
+
+
+class DirectoryCache:
+    """
+    Per-run cache of the directories known to exist below a destination
+    folder and of the names they contain.
+
+    The destination is listed once up front, and every other directory at
+    most once when its contents are first needed, so linking many files into
+    the same folder doesn't repeat makedirs and exists calls.
+    """
+
+    def __init__(self, root_path: str):
+        self.root_path = os.path.abspath(root_path)
+        # Directory -> names it contains, or None if it exists but hasn't been listed
+        self._entries: Dict[str, Optional[Set[str]]] = {}
+        self._seeded = False
+
+    def _seed(self):
+        throttle()
+        try:
+            with os.scandir(self.root_path) as scanner:
+                names = set()
+                for entry in scanner:
+                    names.add(entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        self._entries.setdefault(entry.path, None)
+        except FileNotFoundError:
+            # Seeded once the root has been created
+            return
+        self._seeded = True
+        self._entries[self.root_path] = names
+
+    def _is_below_root(self, path: str) -> bool:
+        return path.startswith(self.root_path + os.sep)
+
+    def remember_listing(self, dir_path: str, names: Iterable[str]):
+        """Record the names inside a directory that was just listed by the caller."""
+        self._entries[os.path.abspath(dir_path)] = set(names)
+
+    def entries(self, dir_path: str) -> Set[str]:
+        """Return the names inside an existing directory, listing it on first use."""
+        dir_path = os.path.abspath(dir_path)
+        names = self._entries.get(dir_path)
+        if names is None:
+            throttle()
+            names = self._entries[dir_path] = set(os.listdir(dir_path))
+        return names
+
+    def ensure_directory(self, dir_path: str):
+        """Create a directory (and its parents) unless it is already known to exist."""
+        if not self._seeded:
+            self._seed()
+        dir_path = os.path.abspath(dir_path)
+        if dir_path in self._entries:
+            return
+        if not self._is_below_root(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+            self._entries[dir_path] = None
+            return
+        if self.root_path not in self._entries:
+            # The root itself is missing, it is listed on the next call instead
+            os.makedirs(dir_path, exist_ok=True)
+            return
+
+        missing_paths = self._missing_directories(dir_path)
+        if not missing_paths:
+            return
+
+        # Everything from here down is missing and created with a single call
+        os.makedirs(dir_path, exist_ok=True)
+        for path in reversed(missing_paths):
+            self.entries(os.path.dirname(path)).add(os.path.basename(path))
+            self._entries[path] = set()
+
+    def _missing_directories(self, dir_path: str) -> List[str]:
+        """
+        Return dir_path and those of its parents below the root that don't
+        exist, deepest first. The root must be known to exist.
+        """
+        # Find the closest ancestor known to exist, then walk back down using
+        # directory listings until reaching the first directory that is missing
+        missing_paths = [dir_path]
+        while os.path.dirname(missing_paths[-1]) not in self._entries:
+            missing_paths.append(os.path.dirname(missing_paths[-1]))
+        while missing_paths:
+            path = missing_paths[-1]
+            siblings = self.entries(os.path.dirname(path))
+            if os.path.basename(path) not in siblings:
+                break
+            self._entries[path] = None
+            missing_paths.pop()
+        return missing_paths
+
+    def exists(self, path: str) -> bool:
+        """Check if a path exists (as any kind of entry) without creating any directories."""
+        if not self._seeded:
+            self._seed()
+        path = os.path.abspath(path)
+        if self.root_path not in self._entries or not self._is_below_root(path):
+            return os.path.lexists(path)
+        dir_path = os.path.dirname(path)
+        if dir_path not in self._entries and self._missing_directories(dir_path):
+            return False
+        return os.path.basename(path) in self.entries(dir_path)
+
+    def contains(self, path: str) -> bool:
+        """Check if a path exists (as any kind of entry) in its already ensured directory."""
+        path = os.path.abspath(path)
+        return os.path.basename(path) in self.entries(os.path.dirname(path))
+
+    def add(self, path: str):
+        """Record that a path was created."""
+        path = os.path.abspath(path)
+        names = self._entries.get(os.path.dirname(path))
+        if names is not None:
+            names.add(os.path.basename(path))
+
+    def discard(self, path: str):
+        """Record that a path was removed."""
+        path = os.path.abspath(path)
+        names = self._entries.get(os.path.dirname(path))
+        if names is not None:
+            names.discard(os.path.basename(path))
+
+    def forget_directory(self, dir_path: str):
+        """Invalidate a removed directory and everything known below it."""
+        dir_path = os.path.abspath(dir_path)
+        prefix = os.path.join(dir_path, "")
+        for known_path in [path for path in self._entries if path.startswith(prefix)]:
+            del self._entries[known_path]
+        self._entries.pop(dir_path, None)
+        self.discard(dir_path)
@@ -0,0 +1,152 @@
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+from linkarr.models import Job
+
+# Sleeps shorter than this are deferred and added to a later one, so a bucket
+# running dry doesn't turn every filesystem call into a separate sleep
+MIN_SLEEP_SECONDS = 0.01
+
+# ioprio_set and ioprio_get syscall numbers, which differ between architectures
+_IOPRIO_SYSCALLS = {
+    "x86_64": (251, 252),
+    "aarch64": (30, 31),
+    "i686": (289, 290),
+    "armv7l": (314, 315),
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+
+
+class TokenBucket:
+    """
+    Limit operations to rate per second on average, allowing bursts of up to
+    burst operations after a pause. Not thread safe: each thread doing
+    throttled work uses its own bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.burst = max(1.0, rate if burst is None else burst)
+        self.tokens = self.burst
+        # Total seconds spent waiting for tokens
+        self.throttled_seconds = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+
+    def acquire(self, cost: float = 1.0):
+        """Take cost tokens, sleeping while the bucket is in debt."""
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self.tokens -= cost
+        delay = -self.tokens / self.rate
+        if delay >= MIN_SLEEP_SECONDS:
+            self._sleep(delay)
+            self.throttled_seconds += delay
+
+
+_budget = threading.local()
+
+
+def throttle(cost: float = 1.0):
+    """
+    Charge cost filesystem operations to the I/O budget of the calling
+    thread's job, waiting if it is used up. Does nothing outside io_budget.
+    """
+    bucket = getattr(_budget, "bucket", None)
+    if bucket is not None:
+        bucket.acquire(cost)
+
+
+@lru_cache(maxsize=None)
+def _libc():
+    import ctypes
+
+    return ctypes.CDLL(None, use_errno=True)
+
+
+def _ioprio_syscall(index: int, *args: int) -> int:
+    """Call ioprio_set (index 0) or ioprio_get (index 1) on Linux, raising OSError on failure."""
+    numbers = _IOPRIO_SYSCALLS.get(platform.machine())
+    if not sys.platform.startswith("linux") or numbers is None:
+        raise OSError(
+            f"I/O priorities are not supported on {sys.platform} {platform.machine()}"
+        )
+    import ctypes
+
+    result = _libc().syscall(numbers[index], *args)
+    if result == -1:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+def get_io_priority() -> int:
+    """Return the raw I/O priority of the calling thread."""
+    return _ioprio_syscall(1, IOPRIO_WHO_PROCESS, 0)
+
+
+def set_io_priority(priority: int):
+    """Set the raw I/O priority of the calling thread."""
+    _ioprio_syscall(0, IOPRIO_WHO_PROCESS, 0, priority)
+
+
+class IOBudget:
+    """The throttling in effect for a job run on the current thread (see io_budget)."""
+
+    def __init__(self, bucket: Optional[TokenBucket], idle_error: Optional[OSError]):
+        self.bucket = bucket
+        # Why the idle I/O priority couldn't be applied, if it was requested
+        self.idle_error = idle_error
+
+    @property
+    def throttled_seconds(self) -> float:
+        return 0.0 if self.bucket is None else self.bucket.throttled_seconds
+
+
+@contextmanager
+def io_budget(job: Job, share: int = 1) -> Iterator[IOBudget]:
+    """
+    Throttle the filesystem calls made on the current thread within this
+    block to the job's io_ops_per_second (see throttle), and with the job's
+    "idle" io_priority, only let the thread use the disk when nothing else
+    does. The I/O priority is per thread on Linux, and is restored on exit.
+
+    share splits the budget between that many processes working on the job
+    at once, each entering the block.
+    """
+    bucket = None
+    if job.io_ops_per_second is not None:
+        bucket = TokenBucket(job.io_ops_per_second / share)
+    previous_priority = None
+    idle_error = None
+    if job.io_priority == "idle":
+        try:
+            previous_priority = get_io_priority()
+            set_io_priority(IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+        except OSError as e:
+            previous_priority = None
+            idle_error = e
+
+    previous_bucket = getattr(_budget, "bucket", None)
+    _budget.bucket = bucket
+    try:
+        yield IOBudget(bucket, idle_error)
+    finally:
+        _budget.bucket = previous_bucket
+        if previous_priority is not None:
+            set_io_priority(previous_priority)
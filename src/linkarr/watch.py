@@ -1,42 +1,176 @@
-import time
+import os
+from typing import Dict, List, Optional
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from linkarr.helpers import logger
+from linkarr.helpers import is_racy_mtime, logger
+from linkarr.models import FileChange
 
 
-def watch_folders(watched_folders, on_change_callback):
-    """
-    Watch the given folders for any changes and call on_change_callback when a change is detected.
-    """
-    class RerunHandler(FileSystemEventHandler):
-        def __init__(self, watched_folder):
-            self.watched_folder = watched_folder
+class _RerunHandler(FileSystemEventHandler):
+    def __init__(self, watched_folder, on_change_callback):
+        self.watched_folder = watched_folder
+        self.on_change_callback = on_change_callback
+
+    def on_created(self, event):
+        logger.info("Detected file created: %s", event.src_path)
+        self.handler([FileChange(event.src_path, "created", event.is_directory)])
+
+    def on_deleted(self, event):
+        logger.info("Detected file deleted: %s", event.src_path)
+        self.handler([FileChange(event.src_path, "deleted", event.is_directory)])
 
-        def on_created(self, event):
-            logger.info(f"Detected file created: {event.src_path}")
-            self.handler()
+    def on_moved(self, event):
+        logger.info("Detected file moved: %s to %s.", event.src_path, event.dest_path)
+        self.handler(
+            [
+                FileChange(event.src_path, "deleted", event.is_directory),
+                FileChange(event.dest_path, "created", event.is_directory),
+            ]
+        )
 
-        def on_deleted(self, event):
-            logger.info(f"Detected file deleted: {event.src_path}")
-            self.handler()
+    def handler(self, changes):
+        self.on_change_callback(self.watched_folder, changes)
 
-        def on_moved(self, event):
-            logger.info(f"Detected file moved: {event.src_path} to {event.dest_path}.")
-            self.handler()
 
-        def handler(self):
-            on_change_callback(self.watched_folder)
+def watch_folder(observer, folder, on_change_callback):
+    """
+    Watch another folder with an observer, returning the watch to pass to
+    observer.unschedule to stop watching it. See start_observer.
+    """
+    return observer.schedule(
+        _RerunHandler(folder, on_change_callback), folder, recursive=True
+    )
+
 
+def start_observer(watched_folders, on_change_callback):
+    """
+    Start watching the given folders in the background and return the running observer.
+
+    The callback receives the watched folder and a list of FileChange objects
+    describing the affected paths. A move is reported as a deletion of the old
+    path followed by a creation of the new one.
+    """
     observer = Observer()
     for folder in watched_folders:
-        event_handler = RerunHandler(folder)
-        observer.schedule(event_handler, folder, recursive=True)
+        watch_folder(observer, folder, on_change_callback)
     observer.start()
-    logger.info(f"Watching folders: {watched_folders}")
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info(f"Shutting down...")
-        observer.stop()
-    observer.join()
+    return observer
+
+
+class _DirSnapshot:
+    """Modification time and entries (name -> is a directory) of a listed directory."""
+
+    __slots__ = ("mtime_ns", "entries", "racy")
+
+    def __init__(self, mtime_ns: int, entries: Dict[str, bool], racy: bool):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.racy = racy
+
+
+class SnapshotPoller:
+    """
+    Watch a folder by polling, for network shares that don't deliver
+    filesystem events.
+
+    A snapshot of every directory's mtime and entries is kept, and each poll
+    only stats the directories, re-listing those whose mtime changed. poll
+    should be called every `current_interval` seconds, which starts at
+    `interval` and backs off up to `max_interval` while nothing changes. Changes are reported like start_observer does: a new
+    directory is reported once without its contents, and a renamed entry is
+    reported as deleted and created.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        on_change_callback,
+        interval: float = 10.0,
+        max_interval: float = 300.0,
+    ):
+        self.folder = folder
+        self.on_change_callback = on_change_callback
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.current_interval = interval
+        self._snapshots: Dict[str, _DirSnapshot] = {}
+        self._snapshot_tree(folder)
+
+    def _list(self, dir_path: str) -> Optional[_DirSnapshot]:
+        """List a directory into a snapshot, or return None if it is gone."""
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+            with os.scandir(dir_path) as scanner:
+                entries = {
+                    entry.name: entry.is_dir(follow_symlinks=False) for entry in scanner
+                }
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as e:
+            logger.warning("Unable to list directory %s: %s", dir_path, e)
+            return None
+        # A recently modified directory is listed again on the next poll, in
+        # case it changes again within the same mtime tick
+        racy = is_racy_mtime(mtime_ns)
+        return _DirSnapshot(mtime_ns, entries, racy)
+
+    def _snapshot_tree(self, dir_path: str):
+        pending_dirs = [dir_path]
+        while pending_dirs:
+            path = pending_dirs.pop()
+            snapshot = self._list(path)
+            if snapshot is None:
+                continue
+            self._snapshots[path] = snapshot
+            pending_dirs.extend(
+                os.path.join(path, name)
+                for name, is_dir in snapshot.entries.items()
+                if is_dir
+            )
+
+    def _forget_tree(self, dir_path: str):
+        prefix = os.path.join(dir_path, "")
+        for path in [path for path in self._snapshots if path.startswith(prefix)]:
+            del self._snapshots[path]
+        self._snapshots.pop(dir_path, None)
+
+    def poll(self) -> List[FileChange]:
+        """Check the folder once, report any changes and return them."""
+        changes: List[FileChange] = []
+        for dir_path, old in list(self._snapshots.items()):
+            if dir_path not in self._snapshots:
+                # Forgotten along with a deleted parent during this poll
+                continue
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                # Reported by its parent, or the watched folder itself is unavailable
+                continue
+            if mtime_ns == old.mtime_ns and not old.racy:
+                continue
+            new = self._list(dir_path)
+            if new is None:
+                continue
+            self._snapshots[dir_path] = new
+
+            for name, was_dir in old.entries.items():
+                if new.entries.get(name) != was_dir:
+                    path = os.path.join(dir_path, name)
+                    changes.append(FileChange(path, "deleted", was_dir))
+                    if was_dir:
+                        self._forget_tree(path)
+            for name, is_dir in new.entries.items():
+                if old.entries.get(name) != is_dir:
+                    path = os.path.join(dir_path, name)
+                    changes.append(FileChange(path, "created", is_dir))
+                    if is_dir:
+                        self._snapshot_tree(path)
+
+        if changes:
+            for change in changes:
+                logger.info("Detected file %s: %s", change.change_type, change.path)
+            self.current_interval = self.interval
+            self.on_change_callback(self.folder, changes)
+        else:
+            self.current_interval = min(self.current_interval * 2, self.max_interval)
+        return changes
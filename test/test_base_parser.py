@@ -3,14 +3,21 @@ import os
 from linkarr.parsers.base import BaseParser
 from linkarr.models import ParsedInfo
 
+
 class DummyParser(BaseParser):
     """Minimal parser for testing file_type_regex in organize_file."""
+
     def parse_info(self, source_file_path: str):
         return ParsedInfo()
+
     def get_destination_path(self, source_file_path: str):
         # Just return a dummy path for testing
         return "/dummy/dest"
 
+    def build_destination_path(self, parsed_info):
+        return "/dummy/dest"
+
+
 class TestBaseParser(unittest.TestCase):
     def setUp(self):
         self.dest_path = "/dummy/dest"
@@ -29,6 +36,17 @@ class TestBaseParser(unittest.TestCase):
         result = parser.organize_file("/some/path/file.mp4")
         self.assertIsNone(result)
 
+    def test_parser_must_build_destination_paths(self):
+        class IncompleteParser(BaseParser):
+            def parse_info(self, source_file_path: str):
+                return ParsedInfo()
+
+            def get_destination_path(self, source_file_path: str):
+                return "/dummy/dest"
+
+        with self.assertRaises(TypeError):
+            IncompleteParser(self.dest_path, r".*\.mkv$")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import tempfile
+from dataclasses import replace
+from unittest import mock
+from linkarr.main import process_job, process_jobs
+from linkarr.plan import apply_plan, plan_job
+from linkarr.models import Config, Job
+
+
+class TestCleanup(unittest.TestCase):
+    """Test cases for link map driven cleanup of broken symlinks."""
+
+    def setUp(self):
+        """Set up a temporary source and destination tree."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        self.job = Job(src=self.src, dest=self.dest, media_type="tv")
+        self.src_file = os.path.join(self.src, "Show.Name.S01E01.mkv")
+        open(self.src_file, "w").close()
+        self.link = os.path.join(
+            self.dest, "Show Name", "Season 01", "Show.Name.S01E01.mkv"
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_vanished_source_is_cleaned_without_walking_dest(self):
+        """Test a later run removes the symlink of a vanished source without a deep clean."""
+        process_job(self.job)
+        self.assertTrue(os.path.islink(self.link))
+        os.remove(self.src_file)
+
+        with mock.patch("linkarr.plan._plan_deep_clean") as plan_deep_clean:
+            process_job(self.job)
+        plan_deep_clean.assert_not_called()
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_deep_clean_removes_unknown_broken_symlinks(self):
+        """Test a deep clean removes broken symlinks the link map doesn't know about."""
+        process_job(self.job)
+        stray_link = os.path.join(self.dest, "Other", "stray.mkv")
+        os.makedirs(os.path.dirname(stray_link))
+        os.symlink("../../missing.mkv", stray_link)
+
+        process_job(self.job)
+        self.assertTrue(os.path.islink(stray_link))
+        process_job(self.job, deep_clean=True)
+        self.assertFalse(os.path.exists(os.path.dirname(stray_link)))
+        self.assertTrue(os.path.islink(self.link))
+
+    def test_deep_clean_runs_when_due(self):
+        """Test a deep clean runs once the configured interval has passed."""
+        self.job = replace(self.job, deep_clean_interval_hours=0)
+        process_job(self.job)
+        with mock.patch("linkarr.plan._plan_deep_clean") as plan_deep_clean:
+            process_job(self.job)
+        plan_deep_clean.assert_called_once()
+
+    def test_directory_filled_after_planning_is_kept(self):
+        """Test a directory that gets a file after its pruning was planned is kept."""
+        process_job(self.job)
+        os.remove(self.src_file)
+        plan = plan_job(self.job)
+        season_dir = os.path.dirname(self.link)
+        self.assertIn(season_dir, plan.dirs_to_prune)
+
+        new_file = os.path.join(season_dir, "new.mkv")
+        open(new_file, "w").close()
+        with self.assertLogs("linkarr", "WARNING"):
+            apply_plan(plan)
+        self.assertFalse(os.path.lexists(self.link))
+        self.assertEqual(os.listdir(season_dir), ["new.mkv"])
+
+    def test_shared_destination_is_swept_once(self):
+        """Test a requested deep clean of a destination shared by several jobs runs once."""
+        movie_job = replace(self.job, media_type="movie")
+        config = Config(jobs=(self.job, movie_job), max_workers=2)
+        process_jobs(config)
+        with mock.patch("linkarr.plan._plan_deep_clean") as plan_deep_clean:
+            process_jobs(config, deep_clean=True)
+        plan_deep_clean.assert_called_once()
+        self.assertTrue(os.path.islink(self.link))
+
+    def test_shared_destination_due_sweep_runs_once(self):
+        """Test a due deep clean of a destination shared by several jobs runs once per run."""
+        job = replace(self.job, deep_clean_interval_hours=0)
+        movie_job = replace(job, media_type="movie")
+        config = Config(jobs=(job, movie_job), max_workers=2)
+        process_jobs(config)
+        with mock.patch("linkarr.plan._plan_deep_clean") as plan_deep_clean:
+            process_jobs(config)
+        plan_deep_clean.assert_called_once()
+        self.assertTrue(os.path.islink(self.link))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,301 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+from linkarr.config import load_config
+from linkarr.daemon import WatchDaemon
+from linkarr.models import Config, FileChange, Job
+
+
+class TestWatchDaemon(unittest.TestCase):
+    """Test cases for the asyncio based watch mode."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        os.makedirs(self.src)
+        self.processed = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _config(self, watcher="native", debounce_seconds=0.05):
+        job = Job(
+            src=self.src,
+            dest=os.path.join(self.tmp_dir.name, "dest"),
+            media_type="tv",
+            watcher=watcher,
+            poll_interval_seconds=0.05,
+        )
+        return Config(jobs=[job], debounce_seconds=debounce_seconds, settle_seconds=0.1)
+
+    def _run(self, daemon, scenario, timeout=10):
+        """Run the daemon alongside the scenario coroutine, failing if it doesn't stop in time."""
+
+        async def main():
+            scenario_task = asyncio.create_task(scenario())
+            await asyncio.wait_for(daemon.run(), timeout)
+            await scenario_task
+
+        asyncio.run(main())
+
+    def test_changes_are_processed(self):
+        """Test watcher changes are coalesced and handed to process_folder."""
+        daemon = None
+
+        def process_folder(config, folder, changes):
+            self.processed.append((folder, changes))
+            daemon._loop.call_soon_threadsafe(daemon.stop)
+
+        for watcher in ("native", "poll"):
+            with self.subTest(watcher=watcher):
+                self.processed = []
+                daemon = WatchDaemon(self._config(watcher), process_folder)
+                path = os.path.join(self.src, f"Show.S01E01.{watcher}.mkv")
+
+                async def scenario():
+                    await asyncio.sleep(0.2)
+                    open(path, "w").close()
+
+                self._run(daemon, scenario)
+                self.assertEqual(self.processed[0][0], self.src)
+                self.assertIn(FileChange(path, "created", False), self.processed[0][1])
+
+    def test_downloads_are_processed_once_complete(self):
+        """Test a download written under a temporary name is processed once, after settling."""
+        daemon = None
+
+        def process_folder(config, folder, changes):
+            self.processed.append(changes)
+            daemon._loop.call_soon_threadsafe(daemon.stop)
+
+        daemon = WatchDaemon(self._config(), process_folder)
+        path = os.path.join(self.src, "Show.S01E01.mkv")
+
+        async def scenario():
+            await asyncio.sleep(0.2)
+            with open(path + ".part", "w") as f:
+                for _ in range(3):
+                    f.write("data")
+                    f.flush()
+                    await asyncio.sleep(0.1)
+            os.rename(path + ".part", path)
+
+        self._run(daemon, scenario)
+        self.assertEqual(self.processed, [[FileChange(path, "created", False)]])
+
+    def test_pending_changes_are_drained_on_stop(self):
+        """Test stopping processes queued changes without waiting for the debounce delay."""
+        daemon = WatchDaemon(
+            self._config(debounce_seconds=60),
+            lambda config, folder, changes: self.processed.append((folder, changes)),
+        )
+        change = FileChange(os.path.join(self.src, "Show.S01E01.mkv"), "created", False)
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            daemon.on_change(self.src, [change])
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(self.processed, [(self.src, [change])])
+
+    def test_full_runs_are_dropped_on_stop(self):
+        """Test stopping doesn't start queued full runs, only the pending changes."""
+        daemon = WatchDaemon(
+            self._config(debounce_seconds=60),
+            lambda config, folder, changes: self.processed.append((folder, changes)),
+            warm_start=True,
+        )
+        change = FileChange(
+            os.path.join(self.tmp_dir.name, "other", "a.mkv"), "created"
+        )
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            daemon.on_change(change.path, [change])
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(self.processed, [(change.path, [change])])
+
+    def test_initial_run_comes_first(self):
+        """Test the initial run completes before any changes are processed."""
+        calls = []
+        daemon = WatchDaemon(
+            self._config(),
+            lambda config, folder, changes: calls.append("changes"),
+            initial_run=lambda: calls.append("initial"),
+        )
+
+        async def scenario():
+            while not calls:
+                await asyncio.sleep(0.01)
+            daemon.on_change(self.src, [FileChange(self.src, "created", True)])
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(calls, ["initial", "changes"])
+
+    def test_warm_start_runs_every_job(self):
+        """Test a warm start watches right away and runs every job in the background."""
+        jobs = []
+        for name in ("first", "second"):
+            src = os.path.join(self.tmp_dir.name, name)
+            os.makedirs(src)
+            jobs.append(Job(src=src, dest=src + "-dest", media_type="tv"))
+        daemon = WatchDaemon(
+            Config(jobs=jobs, debounce_seconds=0.05),
+            lambda config, folder, changes: self.processed.append((folder, changes)),
+            warm_start=True,
+        )
+
+        async def scenario():
+            while len(self.processed) < 2:
+                await asyncio.sleep(0.01)
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(self.processed, [(jobs[0].src, None), (jobs[1].src, None)])
+
+    def test_full_runs_wait_for_changes_of_their_watch(self):
+        """Test a full run of a nested job doesn't overlap the changes of the folder watching it."""
+        nested = os.path.join(self.src, "anime")
+        os.makedirs(nested)
+        jobs = [
+            Job(src=self.src, dest=self.src + "-tv", media_type="tv"),
+            Job(src=nested, dest=nested + "-dest", media_type="tv"),
+        ]
+        running = []
+        overlaps = []
+
+        def process_folder(config, folder, changes):
+            overlaps.append(bool(running))
+            running.append(folder)
+            time.sleep(0.1)
+            running.remove(folder)
+
+        daemon = WatchDaemon(
+            Config(jobs=jobs, debounce_seconds=0.01, settle_seconds=0, max_workers=2),
+            process_folder,
+        )
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            daemon.on_change(self.src, [FileChange(self.src, "created", True)])
+            daemon.scheduler.request_full_run(nested)
+            while len(overlaps) < 2:
+                await asyncio.sleep(0.01)
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(overlaps, [False, False])
+
+    def test_nested_jobs_share_a_watch(self):
+        """Test jobs inside another job's source folder are watched through the outer one."""
+        nested = os.path.join(self.src, "anime")
+        os.makedirs(nested)
+        jobs = [
+            Job(src=self.src, dest=self.src + "-tv", media_type="tv"),
+            Job(src=self.src, dest=self.src + "-movies", media_type="movie"),
+            Job(src=nested, dest=nested + "-dest", media_type="tv"),
+        ]
+        watched = []
+        daemon = WatchDaemon(
+            Config(jobs=jobs, debounce_seconds=0.05),
+            lambda config, folder, changes: None,
+        )
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            watched.extend(daemon._watches)
+            daemon.stop()
+
+        self._run(daemon, scenario)
+        self.assertEqual(watched, [self.src])
+
+    def test_config_reload_only_touches_changed_jobs(self):
+        """Test reloading the config re-syncs added and changed jobs and unwatches removed ones."""
+        folders = {}
+        for name in ("changed", "unchanged", "removed", "added"):
+            folders[name] = os.path.join(self.tmp_dir.name, name)
+            os.makedirs(folders[name])
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+
+        def write_config(names, regex):
+            jobs = [
+                {
+                    "src": folders[name],
+                    "dest": folders[name] + "-dest",
+                    "media_type": "tv",
+                    "file_type_regex": regex if name == "changed" else ".*\\.mkv$",
+                }
+                for name in names
+            ]
+            with open(config_path, "w") as f:
+                json.dump({"jobs": jobs}, f)
+
+        write_config(("changed", "unchanged", "removed"), ".*\\.mkv$")
+        full_runs = []
+        watched = []
+        daemon = WatchDaemon(
+            load_config(config_path),
+            lambda config, folder, changes: full_runs.append(
+                (
+                    folder,
+                    [job.file_type_regex for job in config.jobs if job.src == folder],
+                )
+            ),
+            config_path=config_path,
+        )
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            write_config(("changed", "unchanged", "added"), ".*\\.(mkv|mp4)$")
+            while len(full_runs) < 2:
+                await asyncio.sleep(0.01)
+            watched.extend(daemon._watches)
+            daemon.stop()
+
+        with mock.patch("linkarr.daemon.CONFIG_CHECK_SECONDS", 0.02):
+            self._run(daemon, scenario)
+        self.assertCountEqual(
+            full_runs,
+            [
+                (folders["changed"], [".*\\.(mkv|mp4)$"]),
+                (folders["added"], [".*\\.mkv$"]),
+            ],
+        )
+        self.assertCountEqual(
+            watched, [folders[name] for name in ("changed", "unchanged", "added")]
+        )
+
+    def test_invalid_config_is_not_applied(self):
+        """Test a config file that fails validation leaves the running config in place."""
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+        with open(config_path, "w") as f:
+            job = {"src": self.src, "dest": self.src + "-dest", "media_type": "tv"}
+            json.dump({"jobs": [job]}, f)
+        config = load_config(config_path)
+        daemon = WatchDaemon(
+            config, lambda config, folder, changes: None, config_path=config_path
+        )
+
+        async def scenario():
+            await asyncio.sleep(0.1)
+            with open(config_path, "w") as f:
+                f.write('{"jobs": [')
+            await asyncio.sleep(0.2)
+            daemon.stop()
+
+        with mock.patch("linkarr.daemon.CONFIG_CHECK_SECONDS", 0.02):
+            with self.assertLogs("linkarr", "ERROR"):
+                self._run(daemon, scenario)
+        self.assertIs(daemon.config, config)
+
+
+if __name__ == "__main__":
+    unittest.main()
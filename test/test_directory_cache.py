@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from linkarr.helpers import create_symlink
+from linkarr.state import DirectoryCache
+
+
+class TestDirectoryCache(unittest.TestCase):
+    """Test cases for the per-run destination directory cache."""
+
+    def setUp(self):
+        """Set up a temporary source and destination tree."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        os.makedirs(os.path.join(self.dest, "Existing Show"))
+        self.season_dir = os.path.join(self.dest, "Show Name", "Season 01")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _touch(self, name):
+        path = os.path.join(self.src, name)
+        open(path, "w").close()
+        return path
+
+    def test_linking_a_season_creates_directories_once(self):
+        """Test linking many files into one new directory creates it once and needs no stats."""
+        cache = DirectoryCache(self.dest)
+        files = [
+            self._touch(f"Show.Name.S01E{episode:02d}.mkv") for episode in range(1, 25)
+        ]
+        with mock.patch("os.mkdir", wraps=os.mkdir) as mkdir, mock.patch(
+            "os.path.exists", wraps=os.path.exists
+        ) as exists:
+            for file in files:
+                self.assertIsNotNone(create_symlink(file, self.season_dir, cache))
+        # One call each for "Show Name" and "Season 01"
+        self.assertEqual(mkdir.call_count, 2)
+        # The only existence checks are made by makedirs itself, never per file
+        self.assertFalse(
+            [call for call in exists.call_args_list if call.args[0].endswith(".mkv")]
+        )
+        self.assertEqual(len(os.listdir(self.season_dir)), 24)
+
+    def test_existing_links_are_skipped(self):
+        """Test a link that already exists is detected through the cache."""
+        file = self._touch("Show.Name.S01E01.mkv")
+        create_symlink(file, self.season_dir)
+        self.assertIsNone(
+            create_symlink(file, self.season_dir, DirectoryCache(self.dest))
+        )
+
+    def test_existing_directories_are_not_recreated(self):
+        """Test directories found in the initial listing are not created again."""
+        cache = DirectoryCache(self.dest)
+        with mock.patch("os.makedirs") as makedirs:
+            cache.ensure_directory(os.path.join(self.dest, "Existing Show"))
+        makedirs.assert_not_called()
+
+    def test_removed_directories_are_forgotten(self):
+        """Test a directory removed during cleanup is created again when needed."""
+        cache = DirectoryCache(self.dest)
+        file = self._touch("Show.Name.S01E01.mkv")
+        link = create_symlink(file, self.season_dir, cache)
+        os.unlink(link)
+        cache.discard(link)
+        for dir_path in (self.season_dir, os.path.dirname(self.season_dir)):
+            os.rmdir(dir_path)
+            cache.forget_directory(dir_path)
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "Show Name")))
+
+        self.assertIsNotNone(create_symlink(file, self.season_dir, cache))
+        self.assertTrue(os.path.islink(link))
+
+
+if __name__ == "__main__":
+    unittest.main()
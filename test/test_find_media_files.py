@@ -0,0 +1,144 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from linkarr.helpers import find_media_files
+from linkarr.state import SharedScan, SourceListings
+
+
+class TestFindMediaFiles(unittest.TestCase):
+    """Test cases for walking source folders."""
+
+    def setUp(self):
+        """Set up a temporary source tree."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = self.tmp_dir.name
+        for parts in (
+            ("Show.Name.S01E01.mkv",),
+            ("Show.Name.S01", "Show.Name.S01E02.MKV"),
+            ("Show.Name.S01", "notes.txt"),
+            ("Show.Name.S01", "Sample", "Show.Name.S01E02.sample.mkv"),
+            (".incomplete", "Show.Name.S01E03.mkv"),
+        ):
+            path = os.path.join(self.src, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _find(self, exclude_dirs=()):
+        files = find_media_files(self.src, ".*\\.mkv$", exclude_dirs)
+        return sorted(os.path.relpath(file, self.src) for file in files)
+
+    def test_finds_all_media_files(self):
+        """Test every matching file is found, case-insensitively."""
+        self.assertEqual(
+            self._find(),
+            [
+                os.path.join(".incomplete", "Show.Name.S01E03.mkv"),
+                os.path.join("Show.Name.S01", "Sample", "Show.Name.S01E02.sample.mkv"),
+                os.path.join("Show.Name.S01", "Show.Name.S01E02.MKV"),
+                "Show.Name.S01E01.mkv",
+            ],
+        )
+
+    def test_excluded_dirs_are_pruned(self):
+        """Test directories matching an exclude pattern are skipped entirely."""
+        self.assertEqual(
+            self._find(["sample/", ".*"]),
+            [
+                os.path.join("Show.Name.S01", "Show.Name.S01E02.MKV"),
+                "Show.Name.S01E01.mkv",
+            ],
+        )
+
+    def test_symlinked_dirs_are_not_followed(self):
+        """Test symlinked directories are not descended into."""
+        os.symlink(
+            os.path.join(self.src, "Show.Name.S01"), os.path.join(self.src, "Link")
+        )
+        self.assertNotIn(os.path.join("Link", "Show.Name.S01E02.MKV"), self._find())
+
+    def test_results_are_streamed(self):
+        """Test matches are yielded lazily rather than collected up front."""
+        files = find_media_files(self.src, ".*\\.mkv$")
+        self.assertIsInstance(next(files), str)
+
+    def _age_dirs(self):
+        """Move directory mtimes into the past, so their listings can be trusted."""
+        for dir_path, _, _ in os.walk(self.src):
+            os.utime(dir_path, (1_000_000_000, 1_000_000_000))
+
+    def test_unchanged_dirs_are_not_listed_again(self):
+        """Test directories with an unchanged mtime reuse their previous listing."""
+        self._age_dirs()
+        listings = SourceListings()
+        expected = self._find_with(listings)
+
+        listings = SourceListings(listings.current)
+        with mock.patch("linkarr.helpers.os.scandir", wraps=os.scandir) as scandir:
+            self.assertEqual(self._find_with(listings), expected)
+        scandir.assert_not_called()
+        self.assertEqual(listings.changes(), ({}, []))
+
+        # A new file changes only its own directory's mtime
+        new_file = os.path.join(
+            self.src, "Show.Name.S01", "Sample", "Show.Name.S01E04.mkv"
+        )
+        open(new_file, "w").close()
+        listings = SourceListings(listings.current)
+        with mock.patch("linkarr.helpers.os.scandir", wraps=os.scandir) as scandir:
+            self.assertIn(
+                os.path.relpath(new_file, self.src), self._find_with(listings)
+            )
+        scandir.assert_called_once_with(os.path.dirname(new_file))
+        self.assertEqual(list(listings.changes()[0]), [os.path.dirname(new_file)])
+
+    def test_recently_modified_dirs_are_listed_again(self):
+        """Test a directory modified right before it was listed isn't trusted on the next walk."""
+        listings = SourceListings()
+        self._find_with(listings)
+        listings = SourceListings(listings.current)
+        with mock.patch("linkarr.helpers.os.scandir", wraps=os.scandir) as scandir:
+            self._find_with(listings)
+        self.assertEqual(scandir.call_count, 4)
+
+    def test_shared_scan_lists_each_directory_once(self):
+        """Test walks sharing a scan list each directory once, and filter it their own way."""
+        shared_scan = SharedScan()
+        listings = SourceListings()
+        with mock.patch("linkarr.helpers.os.scandir", wraps=os.scandir) as scandir:
+            episodes = list(
+                find_media_files(self.src, ".*\\.mkv$", shared_scan=shared_scan)
+            )
+            notes = list(
+                find_media_files(
+                    self.src,
+                    ".*\\.txt$",
+                    ("Sample",),
+                    listings,
+                    shared_scan=shared_scan,
+                )
+            )
+            nested = list(
+                find_media_files(
+                    os.path.join(self.src, "Show.Name.S01"),
+                    ".*\\.mkv$",
+                    shared_scan=shared_scan,
+                )
+            )
+        self.assertEqual(scandir.call_count, 4)
+        self.assertEqual(len(episodes), 4)
+        self.assertEqual(notes, [os.path.join(self.src, "Show.Name.S01", "notes.txt")])
+        self.assertEqual(len(nested), 2)
+        # Listings are recorded for walks with a state index, excluded directories aside
+        self.assertEqual(len(listings.current), 3)
+
+    def _find_with(self, listings):
+        files = find_media_files(self.src, ".*\\.mkv$", listings=listings)
+        return sorted(os.path.relpath(file, self.src) for file in files)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import tempfile
+from dataclasses import replace
+from linkarr.main import process_changes
+from linkarr.models import Job, FileChange
+
+
+class TestIncrementalProcessing(unittest.TestCase):
+    """Test cases for applying watcher changes incrementally."""
+
+    def setUp(self):
+        """Set up a temporary source and destination tree."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        self.job = Job(src=self.src, dest=self.dest, media_type="tv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _touch(self, *parts):
+        path = os.path.join(self.src, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        return path
+
+    def test_created_file_is_linked(self):
+        """Test a created file is linked without a full run."""
+        src_file = self._touch("Show.Name.S01E02.mkv")
+        process_changes(self.job, [FileChange(src_file, "created")])
+
+        link = os.path.join(self.dest, "Show Name", "Season 01", "Show.Name.S01E02.mkv")
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.path.realpath(link), os.path.realpath(src_file))
+
+    def test_created_file_extension_case_is_ignored(self):
+        """Test a created file is matched by name regardless of case, like a full scan."""
+        src_file = self._touch("Show.Name.S01E02.MKV")
+        process_changes(self.job, [FileChange(src_file, "created")])
+
+        link = os.path.join(self.dest, "Show Name", "Season 01", "Show.Name.S01E02.MKV")
+        self.assertTrue(os.path.islink(link))
+
+    def test_created_directory_is_scanned(self):
+        """Test a created directory has its media files linked."""
+        self._touch("Show.Name.S01", "Show.Name.S01E01.mkv")
+        self._touch("Show.Name.S01", "Show.Name.S01E02.mkv")
+        self._touch("Show.Name.S01", "notes.txt")
+        folder = os.path.join(self.src, "Show.Name.S01")
+        process_changes(self.job, [FileChange(folder, "created", is_directory=True)])
+
+        season_dir = os.path.join(self.dest, "Show Name", "Season 01")
+        self.assertEqual(
+            sorted(os.listdir(season_dir)),
+            ["Show.Name.S01E01.mkv", "Show.Name.S01E02.mkv"],
+        )
+
+    def test_deleted_file_removes_link_and_empty_dirs(self):
+        """Test a deleted file removes its symlink and any emptied parent dirs."""
+        src_file = self._touch("Show.Name.S01E02.mkv")
+        process_changes(self.job, [FileChange(src_file, "created")])
+        os.remove(src_file)
+        process_changes(self.job, [FileChange(src_file, "deleted")])
+
+        self.assertTrue(os.path.isdir(self.dest))
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_deleted_file_keeps_foreign_files(self):
+        """Test a deleted file does not remove a file linkarr did not create."""
+        src_file = self._touch("Show.Name.S01E02.mkv")
+        season_dir = os.path.join(self.dest, "Show Name", "Season 01")
+        os.makedirs(season_dir)
+        foreign = os.path.join(season_dir, "Show.Name.S01E02.mkv")
+        open(foreign, "w").close()
+        os.remove(src_file)
+        process_changes(self.job, [FileChange(src_file, "deleted")])
+
+        self.assertTrue(os.path.isfile(foreign))
+
+    def test_created_file_in_excluded_dir_is_skipped(self):
+        """Test files below an excluded directory are not linked."""
+        self.job = replace(self.job, exclude_dirs=("sample",))
+        src_file = self._touch("Show.Name.S01", "Sample", "Show.Name.S01E01.mkv")
+        process_changes(self.job, [FileChange(src_file, "created")])
+        folder = os.path.join(self.src, "Show.Name.S01")
+        process_changes(self.job, [FileChange(folder, "created", is_directory=True)])
+
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_moved_file_relinks(self):
+        """Test a move is handled as a deletion followed by a creation."""
+        old_file = self._touch("Show.Name.S01E02.mkv")
+        process_changes(self.job, [FileChange(old_file, "created")])
+        new_file = os.path.join(self.src, "Other.Show.S02E03.mkv")
+        os.rename(old_file, new_file)
+        process_changes(
+            self.job,
+            [FileChange(old_file, "deleted"), FileChange(new_file, "created")],
+        )
+
+        self.assertEqual(os.listdir(self.dest), ["Other Show"])
+
+
+if __name__ == "__main__":
+    unittest.main()
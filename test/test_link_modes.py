@@ -0,0 +1,188 @@
+import unittest
+import errno
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+from linkarr import helpers
+from linkarr.config import ConfigError, load_config
+from linkarr.main import process_changes, process_job
+from linkarr.models import FileChange, Job
+from linkarr.state import StateIndex
+
+
+class TestLinkModes(unittest.TestCase):
+    """Test cases for linking with hardlinks and reflinks instead of symlinks."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        self.src_file = os.path.join(self.src, "Show.Name.S01E01.mkv")
+        with open(self.src_file, "w") as f:
+            f.write("episode")
+        self.link = os.path.join(
+            self.dest, "Show Name", "Season 01", "Show.Name.S01E01.mkv"
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _job(self, link_mode, **kwargs):
+        return Job(
+            src=self.src,
+            dest=self.dest,
+            media_type="tv",
+            link_mode=link_mode,
+            state_index=True,
+            **kwargs,
+        )
+
+    def _forget_index(self, job):
+        """Drop the index entries, as if the source file was deleted while linkarr wasn't running."""
+        with StateIndex.for_job(job) as index:
+            for src_path in index.entries():
+                index.remove(src_path)
+
+    def test_hardlinks_are_created_and_cleaned(self):
+        """Test hardlinks share the source's inode, are recorded and removed once it is deleted."""
+        job = self._job("hardlink")
+        process_job(job)
+        self.assertFalse(os.path.islink(self.link))
+        self.assertTrue(os.path.samefile(self.link, self.src_file))
+        with StateIndex.for_job(job) as index:
+            record = index.links()[self.link]
+        self.assertEqual(record.src_path, self.src_file)
+        self.assertEqual(record.inode, os.stat(self.src_file).st_ino)
+
+        os.remove(self.src_file)
+        process_job(job)
+        self.assertFalse(os.path.exists(os.path.dirname(self.link)))
+        with StateIndex.for_job(job) as index:
+            self.assertEqual(index.links(), {})
+
+    def test_link_modes_require_state_index(self):
+        """Test a config using hardlinks or reflinks without a state index is refused."""
+        config_path = os.path.join(self.tmp_dir.name, "config.json")
+        for link_mode in ("hardlink", "reflink"):
+            with self.subTest(link_mode=link_mode):
+                job = {"src": self.src, "dest": self.dest, "link_mode": link_mode}
+                with open(config_path, "w") as f:
+                    json.dump({"jobs": [job]}, f)
+                with self.assertRaises(ConfigError):
+                    load_config(config_path)
+
+    def test_deep_clean_only_removes_recorded_hardlinks(self):
+        """Test a deep clean removes recorded links of deleted sources, but no other files."""
+        job = self._job("hardlink")
+        process_job(job)
+        season = os.path.dirname(self.link)
+        notes = os.path.join(self.dest, "notes.txt")
+        open(notes, "w").close()
+        # A media file with a single link that linkarr didn't create
+        foreign = os.path.join(season, "Show.Name.S01E03.mkv")
+        open(foreign, "w").close()
+        other_src = os.path.join(self.src, "Show.Name.S01E02.mkv")
+        open(other_src, "w").close()
+
+        os.remove(self.src_file)
+        self._forget_index(job)
+        process_job(job, deep_clean=True)
+        self.assertFalse(os.path.exists(self.link))
+        self.assertTrue(os.path.isfile(notes))
+        self.assertTrue(os.path.isfile(foreign))
+        other_link = os.path.join(season, "Show.Name.S01E02.mkv")
+        self.assertTrue(os.path.samefile(other_link, other_src))
+
+    def test_replaced_link_is_not_removed(self):
+        """Test a recorded link replaced by another file is left alone and forgotten."""
+        job = self._job("hardlink")
+        process_job(job)
+        os.remove(self.link)
+        with open(self.link, "w") as f:
+            f.write("mine")
+
+        os.remove(self.src_file)
+        process_job(job)
+        self.assertTrue(os.path.isfile(self.link))
+        self._forget_index(job)
+        process_job(job, deep_clean=True)
+        self.assertTrue(os.path.isfile(self.link))
+        with StateIndex.for_job(job) as index:
+            self.assertEqual(index.links(), {})
+
+    def test_replaced_source_is_relinked(self):
+        """Test a source file replaced by a new file gets its stale hardlink replaced."""
+        job = self._job("hardlink")
+        process_job(job)
+        os.remove(self.src_file)
+        with open(self.src_file, "w") as f:
+            f.write("proper")
+        process_job(job)
+        self.assertTrue(os.path.samefile(self.link, self.src_file))
+
+    def test_hardlink_across_devices_falls_back_to_symlink(self):
+        """Test a symlink is created when hardlinking fails because of another device."""
+        with mock.patch(
+            "linkarr.helpers.os.link",
+            side_effect=OSError(errno.EXDEV, "Invalid cross-device link"),
+        ):
+            process_job(self._job("hardlink"))
+        self.assertTrue(os.path.islink(self.link))
+        self.assertTrue(os.path.samefile(self.link, self.src_file))
+
+    @unittest.skipIf(helpers.fcntl is None, "Reflinks are cloned with a Linux ioctl")
+    def test_unsupported_reflink_falls_back_to_symlink(self):
+        """Test a symlink is created when the filesystem can't clone files."""
+        with mock.patch(
+            "linkarr.helpers.fcntl.ioctl",
+            side_effect=OSError(errno.EOPNOTSUPP, "Not supported"),
+        ):
+            process_job(self._job("reflink"))
+        self.assertTrue(os.path.islink(self.link))
+        self.assertEqual(
+            os.listdir(os.path.dirname(self.link)), ["Show.Name.S01E01.mkv"]
+        )
+
+    def test_reflinks_are_removed_with_their_source(self):
+        """Test reflinks recorded in the state index are removed once their source is deleted."""
+        job = self._job("reflink")
+        with mock.patch("linkarr.helpers._clone_file", side_effect=shutil.copy2):
+            process_job(job)
+        self.assertFalse(os.path.islink(self.link))
+        self.assertFalse(os.path.samefile(self.link, self.src_file))
+
+        os.remove(self.src_file)
+        process_job(job)
+        self.assertFalse(os.path.exists(self.link))
+
+    def test_same_size_file_is_not_claimed_as_reflink(self):
+        """Test a file of the source's size that linkarr didn't clone is never removed."""
+        foreign = self.link
+        os.makedirs(os.path.dirname(foreign))
+        shutil.copy2(self.src_file, foreign)
+        job = self._job("reflink")
+        process_job(job)
+        with StateIndex.for_job(job) as index:
+            self.assertIsNone(index.get(self.src_file).link_path)
+
+        os.remove(self.src_file)
+        process_job(job)
+        process_job(job, deep_clean=True)
+        self.assertTrue(os.path.isfile(foreign))
+
+    def test_incremental_changes_with_hardlinks(self):
+        """Test watcher changes create and remove hardlinks."""
+        job = self._job("hardlink")
+        process_changes(job, [FileChange(self.src_file, "created")])
+        self.assertTrue(os.path.samefile(self.link, self.src_file))
+
+        os.remove(self.src_file)
+        process_changes(job, [FileChange(self.src_file, "deleted")])
+        self.assertFalse(os.path.exists(self.link))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import io
+import json
+import logging
+import logging.handlers
+import queue
+from unittest import mock
+from linkarr.helpers import (
+    JsonFormatter,
+    LogQueueHandler,
+    RepeatedWarningFilter,
+    logger,
+)
+from linkarr.parsers.tv import TVParser
+
+
+def _record(msg, *args, level=logging.WARNING, **extra):
+    record = logging.LogRecord("linkarr", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestJsonFormatter(unittest.TestCase):
+    """Test cases for the JSON lines log format."""
+
+    def test_record_is_one_json_object(self):
+        """Test records are formatted as JSON with their message and extra fields."""
+        line = JsonFormatter().format(
+            _record("Removed %s", "/dest/a.mkv", job="tv:/src")
+        )
+        self.assertNotIn("\n", line)
+        entry = json.loads(line)
+        self.assertEqual(entry["level"], "warning")
+        self.assertEqual(entry["message"], "Removed /dest/a.mkv")
+        self.assertEqual(entry["job"], "tv:/src")
+        self.assertIn("time", entry)
+
+    def test_exception_through_queue(self):
+        """Test an exception logged through the queue is reported in its own field."""
+        output = io.StringIO()
+        handler = logging.StreamHandler(output)
+        handler.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        test_logger = logging.getLogger("linkarr.test_exception_through_queue")
+        test_logger.propagate = False
+        test_logger.addHandler(LogQueueHandler(log_queue))
+        listener.start()
+        try:
+            try:
+                raise ValueError("bad value")
+            except ValueError:
+                test_logger.exception("Failed to process %s", "/src")
+        finally:
+            listener.stop()
+
+        entry = json.loads(output.getvalue())
+        self.assertEqual(entry["message"], "Failed to process /src")
+        self.assertIn("ValueError: bad value", entry["exception"])
+        self.assertIn("Traceback", entry["exception"])
+
+
+class TestRepeatedWarningFilter(unittest.TestCase):
+    """Test cases for rate-limiting repeated warnings."""
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch("linkarr.helpers.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.warning_filter = RepeatedWarningFilter(limit=3, window_seconds=60)
+
+    def _passed(self, records):
+        return [record for record in records if self.warning_filter.filter(record)]
+
+    def test_repeated_warnings_are_limited(self):
+        """Test only the first warnings of a template pass, the next window reports the rest."""
+        passed = self._passed(
+            [_record("Broken symlink %s", index) for index in range(10)]
+        )
+        self.assertEqual(
+            [record.getMessage() for record in passed],
+            ["Broken symlink 0", "Broken symlink 1", "Broken symlink 2"],
+        )
+
+        self.now = 60
+        passed = self._passed([_record("Broken symlink %s", 10)])
+        self.assertEqual(
+            passed[0].getMessage(),
+            "Broken symlink 10 (7 similar warning(s) suppressed)",
+        )
+        self.assertEqual(passed[0].suppressed, 7)
+
+    def test_other_messages_pass(self):
+        """Test other templates and other levels are not limited."""
+        records = [_record("Broken symlink %s", index) for index in range(5)]
+        records += [_record("Deleting empty dir: %s", "/dest/a")]
+        records += [
+            _record("Created %s", index, level=logging.DEBUG) for index in range(5)
+        ]
+        self.assertEqual(len(self._passed(records)), 3 + 1 + 5)
+
+    def test_flush_reports_suppressed(self):
+        """Test flushing logs the count of warnings suppressed since the last report."""
+        self._passed([_record("Broken symlink %s", index) for index in range(5)])
+        with self.assertLogs(logger, "INFO") as logs:
+            self.warning_filter.flush()
+        self.assertEqual(
+            logs.output,
+            ["INFO:linkarr:2 similar warning(s) suppressed: Broken symlink %s"],
+        )
+
+
+class TestParseFailureSummary(unittest.TestCase):
+    """Test cases for summing up parse failures per directory."""
+
+    def test_failures_are_reported_per_directory(self):
+        """Test a single warning is logged for all failures in a directory."""
+        parser = TVParser("/media/tv", ".*\\.mkv$")
+        names = [f"/src/x/extra.{index}.mkv" for index in range(312)] + [
+            "/src/y/notes.mkv"
+        ]
+        with self.assertLogs(logger, "WARNING") as logs:
+            parser.parse_many(names)
+            parser.report_parse_failures()
+        self.assertEqual(
+            logs.output,
+            [
+                "WARNING:linkarr:312 file(s) failed TV show parsing in /src/x",
+                "WARNING:linkarr:1 file(s) failed TV show parsing in /src/y",
+            ],
+        )
+        self.assertEqual(parser.parse_failures, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
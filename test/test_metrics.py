@@ -0,0 +1,127 @@
+import unittest
+import os
+import tempfile
+import urllib.error
+import urllib.request
+from linkarr.main import process_job
+from linkarr.metrics import (
+    Counter,
+    FILES_PARSED,
+    FILES_SCANNED,
+    Histogram,
+    PARSE_FAILURES,
+    REGISTRY,
+    RUN_DURATION,
+    SYMLINKS_ADDED,
+    job_label,
+    render_metrics,
+    start_metrics_server,
+)
+from linkarr.models import Job
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for the Prometheus metrics."""
+
+    def tearDown(self):
+        # Metrics created by the tests should not end up in the rendered output of other tests
+        REGISTRY[:] = [
+            metric for metric in REGISTRY if not metric.name.startswith("test_")
+        ]
+
+    def test_render_counter_and_histogram(self):
+        """Test metrics are rendered in the Prometheus text format."""
+        counter = Counter("test_things_total", "Things.", ["kind"])
+        counter.inc(kind="a")
+        counter.inc(2, kind="a")
+        histogram = Histogram("test_seconds", "Seconds.", buckets=(1.0, 5.0))
+        histogram.observe(0.5)
+        histogram.observe(3)
+        histogram.observe(10)
+
+        self.assertEqual(
+            counter.render(),
+            "# HELP test_things_total Things.\n"
+            "# TYPE test_things_total counter\n"
+            'test_things_total{kind="a"} 3',
+        )
+        self.assertEqual(
+            histogram.render().splitlines()[2:],
+            [
+                'test_seconds_bucket{le="1.0"} 1',
+                'test_seconds_bucket{le="5.0"} 2',
+                'test_seconds_bucket{le="+Inf"} 3',
+                "test_seconds_sum 13.5",
+                "test_seconds_count 3",
+            ],
+        )
+
+    def test_unexpected_labels_are_rejected(self):
+        """Test using labels that do not match the metric raises an error."""
+        counter = Counter("test_labels_total", "Labels.", ["job"])
+        with self.assertRaises(ValueError):
+            counter.inc(media_type="tv")
+
+    def test_process_job_records_metrics(self):
+        """Test a job run counts scanned, parsed and linked files and times each phase."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src = os.path.join(tmp_dir, "src")
+            os.makedirs(src)
+            for name in (
+                "Show.Name.S01E01.mkv",
+                "Show.Name.S01E02.mkv",
+                "Unparseable.mkv",
+            ):
+                open(os.path.join(src, name), "w").close()
+            job = Job(src=src, dest=os.path.join(tmp_dir, "dest"), media_type="tv")
+            label = job_label(job)
+
+            process_job(job)
+
+            self.assertEqual(FILES_SCANNED.get(job=label), 3)
+            self.assertEqual(SYMLINKS_ADDED.get(job=label), 2)
+            self.assertEqual(FILES_PARSED.get(job=label), 2)
+            self.assertEqual(PARSE_FAILURES.get(job=label), 1)
+            for phase in ("clean", "scan", "plan", "apply", "total"):
+                self.assertEqual(RUN_DURATION.get_count(job=label, phase=phase), 1)
+
+    def test_parse_metrics_are_per_job(self):
+        """Test two jobs of the same media type count their parse results separately."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = []
+            for name, num_failures in (("a", 1), ("b", 2)):
+                src = os.path.join(tmp_dir, name)
+                os.makedirs(src)
+                open(os.path.join(src, "Show.Name.S01E01.mkv"), "w").close()
+                for failure in range(num_failures):
+                    open(os.path.join(src, f"Unparseable{failure}.mkv"), "w").close()
+                jobs.append(Job(src=src, dest=src + "-dest", media_type="tv"))
+                with self.assertLogs("linkarr", "WARNING"):
+                    process_job(jobs[-1])
+
+            for job, num_failures in zip(jobs, (1, 2)):
+                self.assertEqual(FILES_PARSED.get(job=job_label(job)), 1)
+                self.assertEqual(PARSE_FAILURES.get(job=job_label(job)), num_failures)
+
+    def test_metrics_endpoint(self):
+        """Test metrics are served over HTTP at /metrics only."""
+        server = start_metrics_server("127.0.0.1", 0)
+        try:
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(f"{base_url}/metrics") as response:
+                self.assertEqual(response.status, 200)
+                body = response.read().decode()
+            self.assertIn("# TYPE linkarr_run_duration_seconds histogram", body)
+            self.assertIn("# TYPE linkarr_event_queue_depth gauge", body)
+            self.assertTrue(render_metrics().startswith("# HELP"))
+
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(f"{base_url}/other")
+            self.assertEqual(context.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,7 +24,7 @@ class TestMovieParser(unittest.TestCase):
         if result:  # Type guard for linter
             self.assertEqual(result.title, "Movie Title")
             self.assertEqual(result.year, "2023")
-    
+
     def test_parse_info_valid_format_extended(self):
         """Test parse_info with valid movie filename (title.year.extension.res.details)."""
         source_file = "/path/to/Movie.Title.2023.1080p.x264.mkv"
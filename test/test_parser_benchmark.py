@@ -0,0 +1,91 @@
+import unittest
+import os
+import re
+import timeit
+from linkarr.helpers import logger
+from linkarr.parsers.tv import TVParser
+from linkarr.parsers.movie import MovieParser
+
+NUM_NAMES = 20000
+
+
+def _legacy_parse_tv(source_file_path):
+    """TV parsing as done before patterns were precompiled, for comparison."""
+    delim = r"[ .]"
+    pattern = (
+        rf"(?:.*/)?"
+        rf"(?P<series>.+?)"
+        rf"{delim}"
+        rf"(?:\d{{4}}{delim})?"
+        rf"[Ss](?P<season>\d{{2}})"
+        rf"[Ee](?P<episode>\d{{2}})"
+        rf"(?:.*$)"
+    )
+    result = re.search(pattern, source_file_path, re.VERBOSE)
+    if not result:
+        return None
+    series_name = re.sub(delim, " ", result.group("series")).strip().title()
+    return series_name, result.group("season"), result.group("episode")
+
+
+class TestParserBenchmark(unittest.TestCase):
+    """Micro-benchmark comparing per-call parsing against the batch parse API."""
+
+    def setUp(self):
+        """Generate a batch of release names."""
+        self.tv_names = [
+            f"/downloads/Show.Number.{i % 500}.S{i % 20:02d}E{i % 24:02d}.1080p.WEB.x264.mkv"
+            for i in range(NUM_NAMES)
+        ]
+        self.movie_names = [
+            f"/downloads/Movie.Number.{i}.{1950 + i % 75}.1080p.BluRay.x264.mkv"
+            for i in range(NUM_NAMES)
+        ]
+
+    def test_parse_many_matches_parse_info(self):
+        """Test batch parsing returns the same results as parsing one by one."""
+        for parser, names in (
+            (TVParser("/media/tv", ".*\\.mkv$"), self.tv_names[:100]),
+            (MovieParser("/media/movies", ".*\\.mkv$"), self.movie_names[:100]),
+        ):
+            with self.subTest(parser=type(parser).__name__):
+                self.assertEqual(
+                    parser.parse_many(names),
+                    [parser.parse_info(name) for name in names],
+                )
+
+    def test_parse_many_keeps_failures_in_place(self):
+        """Test unparsable names result in None at their position."""
+        parser = TVParser("/media/tv", ".*\\.mkv$")
+        with self.assertLogs(logger, "WARNING") as logs:
+            results = parser.parse_many([self.tv_names[0], "/downloads/not.a.show.mkv"])
+            parser.report_parse_failures()
+        self.assertIsNotNone(results[0])
+        self.assertIsNone(results[1])
+        self.assertIn("1 file(s) failed TV show parsing in /downloads", logs.output[0])
+
+    @unittest.skipUnless(
+        os.environ.get("LINKARR_BENCHMARK"), "set LINKARR_BENCHMARK=1 to run"
+    )
+    def test_benchmark_tv_parsing(self):
+        """Print the time taken to parse the batch with the legacy and batch approaches."""
+        parser = TVParser("/media/tv", ".*\\.mkv$")
+        legacy = min(
+            timeit.repeat(
+                lambda: [_legacy_parse_tv(name) for name in self.tv_names],
+                number=1,
+                repeat=3,
+            )
+        )
+        batch = min(
+            timeit.repeat(lambda: parser.parse_many(self.tv_names), number=1, repeat=3)
+        )
+        print(
+            f"\nParsed {NUM_NAMES} TV names: legacy {legacy * 1000:.1f}ms, "
+            f"parse_many {batch * 1000:.1f}ms ({legacy / batch:.2f}x)"
+        )
+        self.assertLess(batch, legacy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from linkarr.main import process_job
+from linkarr.models import Job
+from linkarr.plan import apply_plan, plan_job
+
+
+def _snapshot(root):
+    """Return every path below root with its symlink target, if any."""
+    paths = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in dir_names + file_names:
+            path = os.path.join(dir_path, name)
+            paths[path] = os.readlink(path) if os.path.islink(path) else None
+    return paths
+
+
+class TestPlan(unittest.TestCase):
+    """Test cases for planning and applying job runs."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        for name in ("Show.Name.S01E01.mkv", "Show.Name.S01E02.mkv"):
+            open(os.path.join(self.src, name), "w").close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _job(self, **kwargs):
+        return Job(src=self.src, dest=self.dest, media_type="tv", **kwargs)
+
+    def test_plan_does_not_touch_the_disk(self):
+        """Test planning a run lists the symlinks to create without writing anything."""
+        plan = plan_job(self._job(), deep_clean=True)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(
+            sorted(os.path.basename(link.link_path) for link in plan.links_to_create),
+            ["Show.Name.S01E01.mkv", "Show.Name.S01E02.mkv"],
+        )
+        self.assertIn(
+            "2 symlink(s) to create, 0 to remove, 0 dir(s) to prune", plan.describe()
+        )
+
+    def test_applied_plan_leaves_nothing_to_do(self):
+        """Test a plan made after applying one is empty."""
+        job = self._job()
+        plan = plan_job(job, deep_clean=True)
+        self.assertEqual(apply_plan(plan), (2, 0))
+        self.assertTrue(plan_job(job).is_empty())
+
+    def test_plan_removals_and_pruning(self):
+        """Test a vanished source's symlink and the directories left empty are planned for removal."""
+        job = self._job()
+        process_job(job)
+        os.remove(os.path.join(self.src, "Show.Name.S01E02.mkv"))
+        stray_link = os.path.join(self.dest, "Other", "Season 01", "stray.mkv")
+        os.makedirs(os.path.dirname(stray_link))
+        os.symlink("../../missing.mkv", stray_link)
+        before = _snapshot(self.dest)
+
+        plan = plan_job(job, deep_clean=True)
+        self.assertEqual(_snapshot(self.dest), before)
+        self.assertEqual(
+            sorted(os.path.basename(link.link_path) for link in plan.links_to_remove),
+            ["Show.Name.S01E02.mkv", "stray.mkv"],
+        )
+        # The show's season folder still holds the first episode
+        self.assertEqual(
+            plan.dirs_to_prune,
+            [
+                os.path.join(self.dest, "Other", "Season 01"),
+                os.path.join(self.dest, "Other"),
+            ],
+        )
+        self.assertEqual(plan.links_to_create, [])
+
+        apply_plan(plan)
+        self.assertEqual(os.listdir(self.dest), ["Show Name"])
+        self.assertEqual(
+            os.listdir(os.path.join(self.dest, "Show Name", "Season 01")),
+            ["Show.Name.S01E01.mkv"],
+        )
+
+    def test_plan_with_state_index(self):
+        """Test planning with a state index neither creates the index nor re-plans unchanged files."""
+        job = self._job(state_index=True)
+        plan = plan_job(job)
+        self.assertEqual(len(plan.index_updates), 2)
+        self.assertFalse(os.path.exists(self.dest))
+
+        apply_plan(plan)
+        self.assertTrue(plan_job(job).is_empty())
+
+    def test_unchanged_source_dirs_are_skipped(self):
+        """Test files in source directories unchanged since the last run are not stat'ed again."""
+        job = self._job(state_index=True)
+        os.utime(self.src, (1_000_000_000, 1_000_000_000))
+        apply_plan(plan_job(job))
+
+        src_file = os.path.join(self.src, "Show.Name.S01E01.mkv")
+        with mock.patch("linkarr.plan.os.stat", wraps=os.stat) as stat:
+            plan = plan_job(job)
+        self.assertTrue(plan.is_empty())
+        self.assertEqual(plan.num_scanned_files, 2)
+        self.assertNotIn(mock.call(src_file), stat.call_args_list)
+
+        # A full rescan lists and checks every file again, finding nothing new
+        with mock.patch("linkarr.plan.os.stat", wraps=os.stat) as stat:
+            plan = plan_job(job, full_rescan=True)
+        self.assertTrue(plan.is_empty())
+        self.assertIn(mock.call(src_file), stat.call_args_list)
+
+    def test_sharded_scan_matches_sequential_scan(self):
+        """Test scanning with a process pool plans the same links as a single process."""
+        for show in ("Other.Show", "Third.Show"):
+            season = os.path.join(self.src, show, "Season 1")
+            os.makedirs(season)
+            open(os.path.join(season, f"{show}.S01E01.mkv"), "w").close()
+        os.makedirs(os.path.join(self.src, "Sample"))
+        open(os.path.join(self.src, "Sample", "Sample.Show.S01E01.mkv"), "w").close()
+        # Recently modified directories would be listed with a placeholder mtime
+        for dir_path, _, _ in os.walk(self.src):
+            os.utime(dir_path, (1_000_000_000, 1_000_000_000))
+
+        for state_index in (False, True):
+            with self.subTest(state_index=state_index):
+                sequential = plan_job(
+                    self._job(state_index=state_index, exclude_dirs=["sample"]),
+                    deep_clean=True,
+                )
+                job = self._job(
+                    state_index=state_index, exclude_dirs=["sample"], scan_processes=2
+                )
+                sharded = plan_job(job, deep_clean=True)
+                self.assertEqual(sharded.num_scanned_files, 4)
+                self.assertCountEqual(
+                    sharded.links_to_create, sequential.links_to_create
+                )
+                self.assertCountEqual(sharded.index_updates, sequential.index_updates)
+                self.assertEqual(sharded.listing_updates, sequential.listing_updates)
+
+                self.assertEqual(apply_plan(sharded), (4, 0))
+                self.assertTrue(plan_job(job).is_empty())
+                shutil.rmtree(self.dest)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from linkarr.models import FileChange
+from linkarr.watch import SnapshotPoller
+
+
+class TestSnapshotPoller(unittest.TestCase):
+    """Test cases for the polling watcher."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = self.tmp_dir.name
+        os.makedirs(os.path.join(self.src, "Show", "Season 01"))
+        open(
+            os.path.join(self.src, "Show", "Season 01", "Show.S01E01.mkv"), "w"
+        ).close()
+        self._age_dirs()
+        self.reported = []
+        self.poller = SnapshotPoller(
+            self.src,
+            lambda folder, changes: self.reported.append((folder, changes)),
+            1,
+            8,
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _age_dirs(self):
+        """Move directory mtimes into the past, so they are not re-listed as recently modified."""
+        for dir_path, _, _ in os.walk(self.src):
+            os.utime(dir_path, (1_000_000_000, 1_000_000_000))
+
+    def test_reports_created_and_deleted_entries(self):
+        """Test new and removed entries are reported like the event based watcher does."""
+        season = os.path.join(self.src, "Show", "Season 01")
+        os.remove(os.path.join(season, "Show.S01E01.mkv"))
+        open(os.path.join(season, "Show.S01E02.mkv"), "w").close()
+        os.makedirs(os.path.join(self.src, "Other", "Season 01"))
+
+        changes = self.poller.poll()
+        self.assertCountEqual(
+            changes,
+            [
+                FileChange(os.path.join(season, "Show.S01E01.mkv"), "deleted", False),
+                FileChange(os.path.join(season, "Show.S01E02.mkv"), "created", False),
+                FileChange(os.path.join(self.src, "Other"), "created", True),
+            ],
+        )
+        self.assertEqual(self.reported, [(self.src, changes)])
+
+    def test_deleted_directory_is_reported_once(self):
+        """Test removing a directory reports only the directory, not its contents."""
+        season = os.path.join(self.src, "Show", "Season 01")
+        os.remove(os.path.join(season, "Show.S01E01.mkv"))
+        os.rmdir(season)
+        self.assertEqual(self.poller.poll(), [FileChange(season, "deleted", True)])
+
+    def test_only_modified_directories_are_listed(self):
+        """Test a poll lists only the directories whose mtime changed."""
+        with mock.patch("linkarr.watch.os.scandir", wraps=os.scandir) as scandir:
+            self.assertEqual(self.poller.poll(), [])
+        scandir.assert_not_called()
+
+        open(os.path.join(self.src, "Show", "Show.S01E03.mkv"), "w").close()
+        with mock.patch("linkarr.watch.os.scandir", wraps=os.scandir) as scandir:
+            self.poller.poll()
+        scandir.assert_called_once_with(os.path.join(self.src, "Show"))
+
+    def test_interval_backs_off_while_idle(self):
+        """Test the interval doubles while nothing changes and resets on a change."""
+        for expected in (2, 4, 8, 8):
+            self.poller.poll()
+            self.assertEqual(self.poller.current_interval, expected)
+        open(os.path.join(self.src, "new.mkv"), "w").close()
+        self.poller.poll()
+        self.assertEqual(self.poller.current_interval, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from linkarr.main import process_job_for_folder, process_jobs
+from linkarr.models import Config, FileChange, Job
+from linkarr.state import DestinationLocks, locks_for
+
+
+class TestProcessJobs(unittest.TestCase):
+    """Test cases for running several jobs."""
+
+    def test_destination_locks_group_nested_folders(self):
+        """Test equal and nested destinations share a lock while siblings don't."""
+        locks = DestinationLocks(
+            ["/media/tv/anime", "/media/tv", "/media/movies", "/media/tv"]
+        )
+        self.assertIs(locks.lock_for("/media/tv"), locks.lock_for("/media/tv/anime"))
+        self.assertIsNot(locks.lock_for("/media/tv"), locks.lock_for("/media/movies"))
+
+    def test_destination_locks_prefix_is_not_nesting(self):
+        """Test a folder sharing only a name prefix is not treated as nested."""
+        locks = DestinationLocks(["/media/tv", "/media/tv2"])
+        self.assertIsNot(locks.lock_for("/media/tv"), locks.lock_for("/media/tv2"))
+
+    def test_reloaded_config_keeps_locks(self):
+        """Test the locks of a new config carry over those of folders already known."""
+        old_locks = locks_for(Config(jobs=(Job(src="/src/tv", dest="/media/tv"),)))
+        new_locks = locks_for(
+            Config(
+                jobs=(
+                    Job(src="/src/tv", dest="/media/tv"),
+                    Job(src="/src/movies", dest="/media/movies", media_type="movie"),
+                )
+            )
+        )
+        self.assertIs(new_locks.lock_for("/media/tv"), old_locks.lock_for("/media/tv"))
+
+    def test_workers_of_a_new_config_share_locks(self):
+        """Test workers looking up the locks of a new config at once all get the same ones."""
+        config = Config(jobs=(Job(src="/src/tv", dest="/media/tv"),))
+
+        def build_slowly(*args):
+            time.sleep(0.01)
+            return DestinationLocks(*args)
+
+        with mock.patch("linkarr.state.DestinationLocks", side_effect=build_slowly):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: locks_for(config), range(4)))
+        self.assertTrue(all(locks is results[0] for locks in results))
+
+    def test_folder_processing_holds_destination_lock(self):
+        """Test watch mode work on a job holds the lock of its destination folder."""
+        job = Job(src="/src/tv", dest="/media/tv")
+        config = Config(jobs=(job,))
+        held = []
+
+        def record_lock(*args, **kwargs):
+            held.append(locks_for(config).lock_for(job.dest).locked())
+
+        change = FileChange("/src/tv/Show.Name.S01E01.mkv", "created")
+        with mock.patch(
+            "linkarr.main.process_changes", side_effect=record_lock
+        ), mock.patch("linkarr.main.process_job", side_effect=record_lock):
+            process_job_for_folder(config, job.src, [change])
+            process_job_for_folder(config, job.src)
+        self.assertEqual(held, [True, True])
+
+    def test_jobs_run_in_parallel(self):
+        """Test every job is processed when running several workers."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = []
+            for name, media_type, file_name in (
+                ("tv", "tv", "Show.Name.S01E01.mkv"),
+                ("movies", "movie", "Movie.Title.2023.mkv"),
+            ):
+                src = os.path.join(tmp_dir, "src", name)
+                os.makedirs(src)
+                open(os.path.join(src, file_name), "w").close()
+                jobs.append(
+                    Job(
+                        src=src,
+                        dest=os.path.join(tmp_dir, "dest", name),
+                        media_type=media_type,
+                    )
+                )
+
+            process_jobs(Config(jobs=jobs, max_workers=2))
+
+            self.assertEqual(os.listdir(jobs[0].dest), ["Show Name"])
+            self.assertEqual(os.listdir(jobs[1].dest), ["Movie Title (2023)"])
+
+
+if __name__ == "__main__":
+    unittest.main()
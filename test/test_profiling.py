@@ -0,0 +1,64 @@
+import unittest
+import os
+import pstats
+import tempfile
+from unittest import mock
+from linkarr.main import process_jobs, profile_jobs
+from linkarr.metrics import job_label
+from linkarr.models import Config, Job
+from linkarr.profiling import PhaseTimer, profile_run
+
+
+class TestProfiling(unittest.TestCase):
+    """Test cases for profiling a run."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        src = os.path.join(self.tmp_dir.name, "src")
+        os.makedirs(src)
+        for name in ("Show.Name.S01E01.mkv", "Show.Name.S01E02.mkv"):
+            open(os.path.join(src, name), "w").close()
+        self.job = Job(
+            src=src, dest=os.path.join(self.tmp_dir.name, "dest"), media_type="tv"
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_nested_phases_are_not_counted_twice(self):
+        """Test time spent in a nested phase is excluded from the outer phase."""
+        timer = PhaseTimer()
+        with timer.phase("outer"):
+            for _ in timer.iterate(range(3), "inner"):
+                pass
+        self.assertEqual(set(timer.wall), {"outer", "inner"})
+        self.assertGreater(timer.wall["outer"], 0)
+
+    def test_profile_counts_phases_and_filesystem_calls(self):
+        """Test profiling a run collects phase timings and filesystem calls per job."""
+        with profile_run(use_cprofile=False) as profile:
+            process_jobs(Config(jobs=[self.job]))
+
+        job_profile = profile.jobs[job_label(self.job)]
+        self.assertTrue({"clean", "scan", "plan", "apply"} <= set(job_profile.wall))
+        self.assertEqual(job_profile.syscall_counts["symlink"], 2)
+        self.assertGreaterEqual(job_profile.syscall_counts["scandir"], 1)
+        self.assertIsNone(profile.stats)
+        self.assertIn("symlink", profile.report())
+        # The os module is restored once the profile is finished
+        self.assertFalse(hasattr(os.symlink, "__wrapped__"))
+
+    def test_profile_jobs_writes_cprofile_dump(self):
+        """Test the raw cProfile stats are written to the output file."""
+        output_path = os.path.join(self.tmp_dir.name, "linkarr.prof")
+        with mock.patch("builtins.print") as print_mock:
+            profile_jobs(Config(jobs=[self.job]), output_path=output_path)
+
+        report = print_mock.call_args[0][0]
+        self.assertIn(f"Job {job_label(self.job)}", report)
+        self.assertIn("cumulative", report)
+        self.assertGreater(pstats.Stats(output_path).total_calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
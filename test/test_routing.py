@@ -0,0 +1,149 @@
+import unittest
+import os
+import tempfile
+from dataclasses import replace
+from unittest import mock
+from linkarr.main import process_job_for_folder, process_jobs
+from linkarr.models import Config, FileChange, Job
+from linkarr.routing import JobRouter, router_for
+
+
+class TestJobRouter(unittest.TestCase):
+    """Test cases for routing changed paths to the jobs watching them."""
+
+    def setUp(self):
+        self.tv = Job(src="/data/downloads", dest="/media/tv", media_type="tv")
+        self.movies = Job(
+            src="/data/downloads", dest="/media/movies", media_type="movie"
+        )
+        self.anime = Job(
+            src="/data/downloads/anime", dest="/media/anime", media_type="tv"
+        )
+        self.other = Job(src="/data/downloads2", dest="/media/other", media_type="tv")
+        self.router = JobRouter([self.tv, self.movies, self.anime, self.other])
+
+    def test_path_is_routed_to_every_containing_job(self):
+        """Test jobs sharing a source folder and nested jobs all receive a path."""
+        self.assertEqual(
+            self.router.jobs_for("/data/downloads/anime/Show.S01E01.mkv"),
+            [self.tv, self.movies, self.anime],
+        )
+        self.assertEqual(
+            self.router.jobs_for("/data/downloads/Movie.2020.mkv"),
+            [self.tv, self.movies],
+        )
+        self.assertEqual(
+            self.router.jobs_for("/data/downloads/"), [self.tv, self.movies]
+        )
+
+    def test_unrelated_paths_are_not_routed(self):
+        """Test paths outside every source folder, or sharing only a name prefix, match nothing."""
+        self.assertEqual(self.router.jobs_for("/data"), [])
+        self.assertEqual(self.router.jobs_for("/elsewhere/Show.S01E01.mkv"), [])
+        self.assertEqual(self.router.jobs_for("/data/downloads2/a.mkv"), [self.other])
+
+    def test_jobs_under(self):
+        """Test the jobs inside a folder are found in config order."""
+        self.assertEqual(
+            self.router.jobs_under("/data/downloads"),
+            [self.tv, self.movies, self.anime],
+        )
+        self.assertEqual(self.router.jobs_under("/data/downloads/anime"), [self.anime])
+        self.assertEqual(self.router.jobs_under("/data/missing"), [])
+
+    def test_roots(self):
+        """Test only the outermost source folders are roots."""
+        self.assertEqual(
+            self.router.roots(),
+            {
+                "/data/downloads": [self.tv, self.movies, self.anime],
+                "/data/downloads2": [self.other],
+            },
+        )
+
+    def test_router_is_built_once_per_config(self):
+        """Test the router of a config is reused, and only covers enabled jobs."""
+        disabled = Job(src="/data/disabled", dest="/media/disabled", enabled=False)
+        config = Config(jobs=(self.tv, disabled))
+        self.assertIs(router_for(config), router_for(config))
+        self.assertEqual(router_for(config).jobs_for("/data/disabled/a.mkv"), [])
+
+
+class TestOverlappingJobs(unittest.TestCase):
+    """Test cases for processing changes of jobs with overlapping source folders."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "downloads")
+        os.makedirs(os.path.join(self.src, "anime"))
+        self.jobs = {
+            name: Job(
+                src=src,
+                dest=os.path.join(self.tmp_dir.name, name),
+                media_type="movie" if name == "movies" else "tv",
+            )
+            for name, src in (
+                ("tv", self.src),
+                ("movies", self.src),
+                ("anime", os.path.join(self.src, "anime")),
+            )
+        }
+        self.config = Config(jobs=tuple(self.jobs.values()))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _touch(self, *parts):
+        path = os.path.join(self.src, *parts)
+        open(path, "w").close()
+        return path
+
+    def test_changes_reach_every_job(self):
+        """Test a change is processed by each job whose source folder contains it."""
+        movie = self._touch("Movie.Name.2020.1080p.mkv")
+        episode = self._touch("anime", "Show.Name.S01E01.mkv")
+        changes = [FileChange(movie, "created"), FileChange(episode, "created")]
+        process_job_for_folder(self.config, self.src, changes)
+
+        self.assertTrue(
+            os.path.islink(
+                os.path.join(
+                    self.jobs["movies"].dest,
+                    "Movie Name (2020)",
+                    os.path.basename(movie),
+                )
+            )
+        )
+        for name in ("tv", "anime"):
+            with self.subTest(job=name):
+                link = os.path.join(self.jobs[name].dest, "Show Name", "Season 01")
+                self.assertEqual(os.listdir(link), [os.path.basename(episode)])
+
+    def test_full_run_covers_nested_jobs(self):
+        """Test a full run of a folder runs the jobs inside it, but not those outside it."""
+        self._touch("anime", "Show.Name.S01E01.mkv")
+        process_job_for_folder(self.config, os.path.join(self.src, "anime"), None)
+        self.assertTrue(os.path.isdir(self.jobs["anime"].dest))
+        self.assertFalse(os.path.exists(self.jobs["tv"].dest))
+
+    def test_overlapping_jobs_list_each_directory_once(self):
+        """Test a run of jobs with overlapping source folders walks the shared tree once."""
+        episode = self._touch("anime", "Show.Name.S01E01.mkv")
+        with mock.patch("linkarr.helpers.os.scandir", wraps=os.scandir) as scandir:
+            process_jobs(replace(self.config, max_workers=3))
+        self.assertCountEqual(
+            [
+                call.args[0]
+                for call in scandir.call_args_list
+                if call.args[0].startswith(self.src)
+            ],
+            [self.src, os.path.dirname(episode)],
+        )
+        for name in ("tv", "anime"):
+            with self.subTest(job=name):
+                link = os.path.join(self.jobs[name].dest, "Show Name", "Season 01")
+                self.assertEqual(os.listdir(link), [os.path.basename(episode)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import os
+import tempfile
+import time
+from linkarr.scheduler import ChangeScheduler, SettleGate
+from linkarr.models import FileChange
+
+
+class TestChangeScheduler(unittest.TestCase):
+    """Test cases for coalescing watcher changes."""
+
+    def test_changes_are_coalesced(self):
+        """Test repeated changes for the same folder result in a single run."""
+        scheduler = ChangeScheduler(quiet_seconds=0.05)
+        for _ in range(3):
+            scheduler.submit("/src", [FileChange("/src/a.mkv", "created")])
+        scheduler.submit("/src", [FileChange("/src/b.mkv", "created")])
+        folder, delay = scheduler.next_due()
+        self.assertEqual(folder, "/src")
+        self.assertGreater(delay, 0)
+        time.sleep(delay)
+        self.assertEqual(scheduler.next_due(), ("/src", 0.0))
+
+        changes = scheduler.take("/src")
+        self.assertEqual(
+            [change.path for change in changes], ["/src/a.mkv", "/src/b.mkv"]
+        )
+        self.assertEqual(scheduler.last_coalesced["/src"], 2)
+        self.assertFalse(scheduler.has_pending())
+        self.assertIsNone(scheduler.next_due())
+
+    def test_latest_change_wins(self):
+        """Test a path keeps only its latest change."""
+        scheduler = ChangeScheduler()
+        scheduler.submit("/src", [FileChange("/src/a.mkv", "created")])
+        scheduler.submit("/src", [FileChange("/src/a.mkv", "deleted")])
+
+        changes = scheduler.take("/src")
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].change_type, "deleted")
+
+    def test_overflow_falls_back_to_full_run(self):
+        """Test exceeding max_pending requests a full run."""
+        scheduler = ChangeScheduler(max_pending=2)
+        scheduler.submit(
+            "/src", [FileChange(f"/src/{i}.mkv", "created") for i in range(3)]
+        )
+        self.assertIsNone(scheduler.take("/src"))
+
+    def test_next_due_skips_excluded_folders(self):
+        """Test busy folders are skipped, and immediately ignores the quiet window."""
+        scheduler = ChangeScheduler(quiet_seconds=60)
+        scheduler.submit("/src", [FileChange("/src/a.mkv", "created")])
+        scheduler.submit("/other", [FileChange("/other/a.mkv", "created")])
+        self.assertEqual(
+            scheduler.next_due({"/src"}, immediately=True), ("/other", 0.0)
+        )
+        self.assertIsNone(scheduler.next_due({"/src", "/other"}))
+
+    def test_drop_full_runs(self):
+        """Test only the folders queued for a full run are dropped."""
+        scheduler = ChangeScheduler()
+        scheduler.request_full_run("/movies")
+        scheduler.submit("/src", [FileChange("/src/a.mkv", "created")])
+        self.assertEqual(scheduler.drop_full_runs(), ["/movies"])
+        self.assertEqual(scheduler.next_due(immediately=True), ("/src", 0.0))
+
+
+class TestSettleGate(unittest.TestCase):
+    """Test cases for holding new files until they are completely written."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = self.tmp_dir.name
+        self.now = 0.0
+        self.released = []
+        self.gate = SettleGate(
+            lambda folder, changes: self.released.append((folder, changes)),
+            settle_seconds=10,
+            in_progress_patterns=("*.part", "_UNPACK_*"),
+            clock=lambda: self.now,
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, data):
+        path = os.path.join(self.src, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(data)
+        return path
+
+    def _check_after(self, seconds):
+        self.now += seconds
+        self.gate.check()
+
+    def test_file_is_released_once_it_stops_changing(self):
+        """Test a created file is held while it grows, then released once."""
+        path = self._write("Show.S01E01.mkv", "a")
+        self.gate.submit(self.src, [FileChange(path, "created")])
+        self._check_after(0)
+        for _ in range(3):
+            self._write("Show.S01E01.mkv", "a")
+            self._check_after(5)
+        self._check_after(5)
+        self.assertEqual(self.released, [])
+        self.assertTrue(self.gate.has_pending())
+        self._check_after(5)
+        self.assertEqual(self.released, [(self.src, [FileChange(path, "created")])])
+        self.assertFalse(self.gate.has_pending())
+
+    def test_directory_waits_for_its_files(self):
+        """Test a created directory is held while files below it change."""
+        path = self._write(os.path.join("Show.S01", "Show.S01E01.mkv"), "a")
+        change = FileChange(os.path.dirname(path), "created", True)
+        self.gate.submit(self.src, [change])
+        self._check_after(0)
+        self._write(os.path.join("Show.S01", "Show.S01E02.mkv"), "a")
+        self._check_after(10)
+        self.assertEqual(self.released, [])
+        self._check_after(10)
+        self.assertEqual(self.released, [(self.src, [change])])
+
+    def test_in_progress_paths_are_ignored(self):
+        """Test changes to temporary download names, and paths inside them, are dropped."""
+        part = self._write("Show.S01E01.mkv.part", "a")
+        unpacking = self._write(os.path.join("_unpack_Show", "Show.S01E01.mkv"), "a")
+        final = os.path.join(self.src, "Show.S01E01.mkv")
+        self.gate.submit(
+            self.src,
+            [
+                FileChange(part, "created"),
+                FileChange(unpacking, "created"),
+                FileChange(part, "deleted"),
+                FileChange(final, "created"),
+            ],
+        )
+        self.gate.release_all()
+        self.assertEqual(self.released, [(self.src, [FileChange(final, "created")])])
+
+    def test_deletions_pass_through(self):
+        """Test a deletion is released right away and drops the held paths below it."""
+        path = self._write(os.path.join("Show.S01", "Show.S01E01.mkv"), "a")
+        self.gate.submit(self.src, [FileChange(path, "created")])
+        deletion = FileChange(os.path.dirname(path), "deleted", True)
+        self.gate.submit(self.src, [deletion])
+        self.assertEqual(self.released, [(self.src, [deletion])])
+        self.assertFalse(self.gate.has_pending())
+
+    def test_vanished_files_are_dropped(self):
+        """Test a held file that is gone by the next check is not released."""
+        self.gate.submit(
+            self.src, [FileChange(os.path.join(self.src, "gone.mkv"), "created")]
+        )
+        self._check_after(20)
+        self.assertFalse(self.gate.has_pending())
+        self.assertEqual(self.released, [])
+
+    def test_zero_settle_seconds_releases_right_away(self):
+        """Test new files are not held when settling is disabled."""
+        gate = SettleGate(
+            lambda folder, changes: self.released.append((folder, changes)),
+            settle_seconds=0,
+            in_progress_patterns=("*.part",),
+        )
+        change = FileChange(os.path.join(self.src, "Show.S01E01.mkv"), "created")
+        gate.submit(self.src, [change, FileChange(change.path + ".part", "created")])
+        self.assertEqual(self.released, [(self.src, [change])])
+        self.assertFalse(gate.has_pending())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from linkarr.main import process_changes, process_job
+from linkarr.models import FileChange, IndexedFile, Job, MovieInfo, TVShowInfo
+from linkarr.parsers.tv import TVParser
+from dataclasses import replace
+from linkarr.state import StateIndex
+
+
+class TestStateIndex(unittest.TestCase):
+    """Test cases for the persistent state index."""
+
+    def setUp(self):
+        """Set up a temporary source and destination tree."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(self.src)
+        self.job = Job(src=self.src, dest=self.dest, media_type="tv", state_index=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _touch(self, name):
+        path = os.path.join(self.src, name)
+        open(path, "w").close()
+        return path
+
+    def _link(self, name):
+        return os.path.join(self.dest, "Show Name", "Season 01", name)
+
+    #
+    # Storage
+    #
+
+    def test_entries_round_trip(self):
+        """Test entries and their parsed info survive reopening the index."""
+        db_path = os.path.join(self.tmp_dir.name, "index.db")
+        tv_entry = IndexedFile(
+            "/src/a.mkv", 1, 2, 3, TVShowInfo("Show", 1, 2), "/dest/a.mkv"
+        )
+        movie_entry = IndexedFile("/src/b.mkv", 4, 5, 6, MovieInfo("Movie", "2023"))
+        failed_entry = IndexedFile("/src/c.mkv", 7, 8, 9)
+        with StateIndex(db_path) as index:
+            for entry in (tv_entry, movie_entry, failed_entry):
+                index.put(entry)
+
+        with StateIndex(db_path) as index:
+            self.assertEqual(
+                index.entries(),
+                {
+                    "/src/a.mkv": tv_entry,
+                    "/src/b.mkv": movie_entry,
+                    "/src/c.mkv": failed_entry,
+                },
+            )
+            self.assertEqual(index.get("/src/b.mkv"), movie_entry)
+            self.assertIsNone(index.get("/src/missing.mkv"))
+
+    def test_zero_padded_numbers_are_read(self):
+        """Test seasons and episodes stored as strings by older versions are read as numbers."""
+        db_path = os.path.join(self.tmp_dir.name, "index.db")
+        with StateIndex(db_path) as index:
+            index._connection.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    "/src/a.mkv",
+                    1,
+                    2,
+                    3,
+                    '{"kind": "tv", "series_name": "Show", "season_number": "01", '
+                    '"episode_number": "02"}',
+                    None,
+                ),
+            )
+        with StateIndex(db_path) as index:
+            self.assertEqual(
+                index.get("/src/a.mkv").parsed_info, TVShowInfo("Show", 1, 2)
+            )
+
+    def test_entries_under(self):
+        """Test only entries below the given directory are returned."""
+        with StateIndex(os.path.join(self.tmp_dir.name, "index.db")) as index:
+            index.put(IndexedFile("/src/show/a.mkv", 1, 2, 3))
+            index.put(IndexedFile("/src/show2/b.mkv", 1, 2, 3))
+            paths = [entry.src_path for entry in index.entries_under("/src/show")]
+        self.assertEqual(paths, ["/src/show/a.mkv"])
+
+    #
+    # Processing
+    #
+
+    def test_unchanged_files_are_not_reparsed(self):
+        """Test a second run skips files the index already knows about."""
+        self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+        self.assertTrue(os.path.islink(self._link("Show.Name.S01E01.mkv")))
+
+        with mock.patch.object(TVParser, "parse_info") as parse_info:
+            process_job(self.job)
+        parse_info.assert_not_called()
+
+    def test_removed_files_are_unlinked(self):
+        """Test files missing from the source tree have their symlinks removed."""
+        src_file = self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+        os.remove(src_file)
+        process_job(self.job)
+
+        self.assertFalse(os.path.lexists(self._link("Show.Name.S01E01.mkv")))
+        with StateIndex.for_job(self.job) as index:
+            self.assertEqual(index.entries(), {})
+
+    def test_foreign_files_are_not_claimed(self):
+        """Test an existing file not created by linkarr is left alone."""
+        src_file = self._touch("Show.Name.S01E01.mkv")
+        foreign = self._link("Show.Name.S01E01.mkv")
+        os.makedirs(os.path.dirname(foreign))
+        open(foreign, "w").close()
+        process_job(self.job)
+
+        with StateIndex.for_job(self.job) as index:
+            self.assertIsNone(index.get(src_file).link_path)
+        os.remove(src_file)
+        process_job(self.job)
+        self.assertTrue(os.path.isfile(foreign))
+
+    def test_directory_and_file_created_in_one_batch(self):
+        """Test a file reported along with its new directory is indexed once, with its link."""
+        folder = os.path.join(self.src, "Show.Name.S01")
+        os.makedirs(folder)
+        src_file = os.path.join(folder, "Show.Name.S01E01.mkv")
+        open(src_file, "w").close()
+        changes = [
+            FileChange(folder, "created", is_directory=True),
+            FileChange(src_file, "created"),
+        ]
+        with self.assertNoLogs("linkarr", "WARNING"):
+            process_changes(self.job, changes)
+        with StateIndex.for_job(self.job) as index:
+            self.assertEqual(
+                index.get(src_file).link_path, self._link("Show.Name.S01E01.mkv")
+            )
+
+        os.remove(src_file)
+        process_changes(self.job, [FileChange(src_file, "deleted")])
+        self.assertFalse(os.path.lexists(self._link("Show.Name.S01E01.mkv")))
+
+    def test_changed_settings_invalidate_index(self):
+        """Test files indexed with another file type regex are parsed again."""
+        self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+
+        job = replace(self.job, file_type_regex=r".*\.(mkv|mp4)$")
+        with mock.patch.object(TVParser, "parse_info", return_value=None) as parse_info:
+            process_job(job)
+        parse_info.assert_called_once()
+        with StateIndex.for_job(job) as index:
+            self.assertTrue(index.matches_job(job))
+            self.assertFalse(index.matches_job(self.job))
+
+    def test_deep_clean_recreates_missing_links(self):
+        """Test a deep clean links unchanged indexed files again when their link was removed."""
+        self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+        link = self._link("Show.Name.S01E01.mkv")
+        os.remove(link)
+
+        process_job(self.job)
+        self.assertFalse(os.path.lexists(link))
+        process_job(self.job, deep_clean=True)
+        self.assertTrue(os.path.islink(link))
+
+    def test_deep_clean_time_survives_restart(self):
+        """Test a new process loads the link map from the index instead of sweeping again."""
+        src_file = self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+        os.remove(src_file)
+
+        # An empty set of link maps stands in for a new process
+        with mock.patch.dict("linkarr.state._link_maps", clear=True), mock.patch(
+            "linkarr.plan._plan_deep_clean"
+        ) as plan_deep_clean:
+            process_job(self.job)
+        plan_deep_clean.assert_not_called()
+        self.assertFalse(os.path.lexists(self._link("Show.Name.S01E01.mkv")))
+
+    def test_due_deep_clean_survives_restart(self):
+        """Test a new process still sweeps the destination once its deep clean is due."""
+        self._touch("Show.Name.S01E01.mkv")
+        process_job(self.job)
+
+        job = replace(self.job, deep_clean_interval_hours=0)
+        with mock.patch.dict("linkarr.state._link_maps", clear=True), mock.patch(
+            "linkarr.plan._plan_deep_clean"
+        ) as plan_deep_clean:
+            process_job(job)
+        plan_deep_clean.assert_called_once()
+
+    def test_deleted_directory_change_uses_index(self):
+        """Test deleting a source directory removes the symlinks of its indexed files."""
+        folder = os.path.join(self.src, "Show.Name.S01")
+        os.makedirs(folder)
+        for episode in ("01", "02"):
+            open(os.path.join(folder, f"Show.Name.S01E{episode}.mkv"), "w").close()
+        process_changes(self.job, [FileChange(folder, "created", is_directory=True)])
+        self.assertEqual(len(os.listdir(os.path.dirname(self._link("x")))), 2)
+
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+        process_changes(self.job, [FileChange(folder, "deleted", is_directory=True)])
+        self.assertFalse(os.path.exists(os.path.join(self.dest, "Show Name")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from linkarr.main import process_job
+from linkarr.models import Job
+from linkarr.throttle import (
+    IOPRIO_CLASS_IDLE,
+    IOPRIO_CLASS_SHIFT,
+    TokenBucket,
+    get_io_priority,
+    io_budget,
+    throttle,
+)
+
+
+def _io_priorities_supported():
+    try:
+        get_io_priority()
+    except OSError:
+        return False
+    return True
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test cases for the token bucket limiting filesystem calls."""
+
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def _bucket(self, rate, burst=None):
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        return TokenBucket(rate, burst, clock=lambda: self.now, sleep=sleep)
+
+    def test_burst_is_free(self):
+        """Test a full bucket lets a burst through without waiting."""
+        bucket = self._bucket(100)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def test_rate_is_enforced(self):
+        """Test operations beyond the burst wait, and short waits are batched."""
+        bucket = self._bucket(1000, burst=1)
+        for _ in range(2001):
+            bucket.acquire()
+        # 2000 operations past the burst take 2 seconds, in waits of about 10ms
+        self.assertAlmostEqual(self.now, 2.0, places=2)
+        self.assertAlmostEqual(bucket.throttled_seconds, self.now)
+        self.assertTrue(all(seconds >= 0.01 for seconds in self.sleeps))
+        self.assertLess(len(self.sleeps), 250)
+
+    def test_tokens_refill_while_idle(self):
+        """Test pausing refills the bucket, up to the burst size."""
+        bucket = self._bucket(10)
+        for _ in range(10):
+            bucket.acquire()
+        self.now += 60
+        for _ in range(10):
+            bucket.acquire()
+        self.assertEqual(self.sleeps, [])
+
+
+class TestIOBudget(unittest.TestCase):
+    """Test cases for throttling the filesystem calls of job runs."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp_dir.name, "src")
+        self.dest = os.path.join(self.tmp_dir.name, "dest")
+        os.makedirs(os.path.join(self.src, "Show"))
+        for episode in range(1, 4):
+            open(
+                os.path.join(self.src, "Show", f"Show.S01E0{episode}.mkv"), "w"
+            ).close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_throttle_outside_budget_does_nothing(self):
+        """Test filesystem calls outside of a job run are not throttled."""
+        with mock.patch.object(TokenBucket, "acquire") as acquire:
+            throttle()
+        acquire.assert_not_called()
+
+    def test_job_run_is_charged(self):
+        """Test scanning and cleaning up draw from the job's budget, and only with one set."""
+        for io_ops_per_second in (None, 1000.0):
+            with self.subTest(io_ops_per_second=io_ops_per_second):
+                job = Job(
+                    src=self.src,
+                    dest=self.dest,
+                    media_type="tv",
+                    state_index=True,
+                    io_ops_per_second=io_ops_per_second,
+                )
+                with mock.patch.object(
+                    TokenBucket, "acquire", autospec=True
+                ) as acquire:
+                    process_job(job, deep_clean=True)
+                if io_ops_per_second is None:
+                    acquire.assert_not_called()
+                else:
+                    # At least a listing of the two source directories and a stat per file
+                    self.assertGreaterEqual(acquire.call_count, 5)
+                self.assertEqual(
+                    len(os.listdir(os.path.join(self.dest, "Show", "Season 01"))), 3
+                )
+
+    @unittest.skipUnless(_io_priorities_supported(), "I/O priorities are Linux only")
+    def test_idle_priority_is_restored(self):
+        """Test the idle I/O priority only applies within the budget."""
+        job = Job(src=self.src, dest=self.dest, media_type="tv", io_priority="idle")
+        before = get_io_priority()
+        with io_budget(job) as budget:
+            during = get_io_priority()
+        self.assertIsNone(budget.idle_error)
+        self.assertEqual(during >> IOPRIO_CLASS_SHIFT, IOPRIO_CLASS_IDLE)
+        self.assertEqual(get_io_priority(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,8 +23,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:  # Type guard for linter
             self.assertEqual(result.series_name, "Show Name")
-            self.assertEqual(result.season_number, "01")
-            self.assertEqual(result.episode_number, "02")
+            self.assertEqual(result.season_number, 1)
+            self.assertEqual(result.episode_number, 2)
 
     def test_parse_info_valid_format_lowercase(self):
         """Test parse_info with valid TV show filename (s01e02 format)."""
@@ -34,8 +34,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:  # Type guard for linter
             self.assertEqual(result.series_name, "Another Show")
-            self.assertEqual(result.season_number, "03")
-            self.assertEqual(result.episode_number, "12")
+            self.assertEqual(result.season_number, 3)
+            self.assertEqual(result.episode_number, 12)
 
     def test_parse_info_with_special_characters(self):
         """Test parse_info with special characters in show name."""
@@ -45,8 +45,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:  # Type guard for linter
             self.assertEqual(result.series_name, "Show-Name!@#")
-            self.assertEqual(result.season_number, "05")
-            self.assertEqual(result.episode_number, "10")
+            self.assertEqual(result.season_number, 5)
+            self.assertEqual(result.episode_number, 10)
 
     def test_parse_info_with_year(self):
         """Test parse_info with year before season/episode (year should be ignored)."""
@@ -56,8 +56,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:
             self.assertEqual(result.series_name, "Show Name")
-            self.assertEqual(result.season_number, "01")
-            self.assertEqual(result.episode_number, "02")
+            self.assertEqual(result.season_number, 1)
+            self.assertEqual(result.episode_number, 2)
 
     def test_parse_info_invalid_format_no_season_episode(self):
         """Test parse_info with filename missing season/episode (should fail)."""
@@ -73,8 +73,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:
             self.assertEqual(result.series_name, "Show Name")
-            self.assertEqual(result.season_number, "01")
-            self.assertEqual(result.episode_number, "02")
+            self.assertEqual(result.season_number, 1)
+            self.assertEqual(result.episode_number, 2)
 
     def test_parse_info_space_delimited_with_year(self):
         """Test parse_info with year before season/episode and space delimiter."""
@@ -84,8 +84,8 @@ class TestTVParser(unittest.TestCase):
         self.assertIsInstance(result, TVShowInfo)
         if result:
             self.assertEqual(result.series_name, "Show Name")
-            self.assertEqual(result.season_number, "01")
-            self.assertEqual(result.episode_number, "02")
+            self.assertEqual(result.season_number, 1)
+            self.assertEqual(result.episode_number, 2)
 
     #
     # Get destination path